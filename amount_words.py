@@ -0,0 +1,127 @@
+"""Сумма прописью для счетов
+
+    python amount_words.py 1500.29
+    python amount_words.py 1500.29 --currency USD
+    python amount_words.py --bench 100000
+"""
+import argparse
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+CENT = Decimal("0.01")
+
+# Формы для 1, 2–4 и 5–20: рубль / рубля / рублей
+CURRENCIES = {
+    "RUB": {
+        "sign": "₽",
+        "short": "руб.",
+        "units": ("рубль", "рубля", "рублей"),
+        "cents": ("копейка", "копейки", "копеек"),
+    },
+    "USD": {
+        "sign": "$",
+        "short": "долл. США",
+        "units": ("доллар США", "доллара США", "долларов США"),
+        "cents": ("цент", "цента", "центов"),
+    },
+    "EUR": {
+        "sign": "€",
+        "short": "евро",
+        "units": ("евро", "евро", "евро"),
+        "cents": ("цент", "цента", "центов"),
+    },
+    "KZT": {
+        "sign": "₸",
+        "short": "тенге",
+        "units": ("тенге", "тенге", "тенге"),
+        "cents": ("тиын", "тиына", "тиынов"),
+    },
+}
+
+DEFAULT_CURRENCY = "RUB"
+
+
+def normalize_currency(code) -> str:
+    """Код валюты из заказа; неизвестные и пустые — рубли"""
+    code = str(code or "").strip().upper()
+    if code in ("RUR", "₽"):
+        return "RUB"
+    return code if code in CURRENCIES else DEFAULT_CURRENCY
+
+
+def currency_sign(code) -> str:
+    """Знак валюты для страниц: ₽, $, €, ₸"""
+    return CURRENCIES[normalize_currency(code)]["sign"]
+
+
+def plural(number: int, forms: tuple) -> str:
+    """Форма слова для числа: 1 рубль, 2 рубля, 5 рублей, 11 рублей, 21 рубль"""
+    last_two = number % 100
+    last_one = number % 10
+    if 11 <= last_two <= 19:
+        return forms[2]
+    if last_one == 1:
+        return forms[0]
+    if 2 <= last_one <= 4:
+        return forms[1]
+    return forms[2]
+
+
+@lru_cache(maxsize=16384)
+def integer_words(number: int) -> str:
+    """Целое число словами; в счетах одни и те же суммы повторяются"""
+    from num2words import num2words
+    
+    return num2words(number, lang="ru")
+
+
+def amount_in_words(amount, currency: str = DEFAULT_CURRENCY) -> str:
+    """Сумма прописью: "Одна тысяча пятьсот рублей 29 копеек"
+    
+    Считается в Decimal, поэтому 0.29 даёт 29 копеек, а не 28.
+    """
+    names = CURRENCIES[currency]
+    value = abs(Decimal(str(amount))).quantize(CENT, rounding=ROUND_HALF_UP)
+    units = int(value)
+    cents = int((value - units) * 100)
+    
+    words = integer_words(units)
+    return (
+        f"{words[:1].upper()}{words[1:]} {plural(units, names['units'])} "
+        f"{cents:02d} {plural(cents, names['cents'])}"
+    )
+
+
+def _bench(count: int):
+    from num2words import num2words
+    
+    # Типичные цены: несколько тысяч разных сумм на весь поток счетов
+    amounts = [Decimal(i * 7919 % 5000 * 10) + Decimal(i % 100) / 100 for i in range(count)]
+    
+    start = time.perf_counter()
+    for amount in amounts:
+        num2words(int(amount), lang="ru")
+    plain = time.perf_counter() - start
+    
+    integer_words.cache_clear()
+    start = time.perf_counter()
+    for amount in amounts:
+        amount_in_words(amount)
+    cached = time.perf_counter() - start
+    
+    print(f"num2words:       {count / plain:,.0f} calls/sec")
+    print(f"amount_in_words: {count / cached:,.0f} calls/sec ({integer_words.cache_info()})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сумма прописью")
+    parser.add_argument("amount", nargs="?", type=Decimal)
+    parser.add_argument("--currency", default=DEFAULT_CURRENCY, choices=sorted(CURRENCIES))
+    parser.add_argument("--bench", type=int, metavar="N", help="Замерить N преобразований")
+    args = parser.parse_args()
+    
+    if args.bench:
+        _bench(args.bench)
+    if args.amount is not None:
+        print(amount_in_words(args.amount, args.currency))
@@ -0,0 +1,288 @@
+"""Загрузка банковских выписок 1С (1CClientBankExchange) и отметка оплаченных счетов
+
+    python bank_import.py kl_to_1c_*.txt        # выписки за любой период
+    python bank_import.py --rematch             # повторить сопоставление не найденных
+    python bank_import.py --bench 50000         # разбор и сопоставление без БД
+
+Из выписок берутся только поступления на наш счёт. Платежи сохраняются в
+таблицу payments (повторно загруженные пропускаются), затем сопоставляются
+со счетами в памяти: все неоплаченные заказы читаются одним запросом в
+словари по номеру счёта и по ИНН. Порядок проверки:
+
+1. номер счёта в назначении платежа и совпадающая сумма (можно оплатить
+   несколько счетов одной платёжкой);
+2. без номера — единственный неоплаченный счёт этого ИНН на ту же сумму.
+
+Найденные заказы переводятся в paid одним UPDATE. Не сопоставленные
+платежи остаются в payments со статусом unmatched и причиной в note.
+"""
+import argparse
+import logging
+import re
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from config import COMPANY
+from database import (
+    init_pool, close_pool, save_payments, get_pending_payments,
+    get_unpaid_orders, apply_payment_matches
+)
+
+logger = logging.getLogger("bank_import")
+
+# Номер счёта в назначении платежа: ПРЕФИКС-ГГГГММДД-NNN, префикс и
+# разделители необязательны («счёт 20260901-7», «ЧМ 20260901 007»)
+INVOICE_NUMBER_RE = re.compile(
+    r"(?<![0-9A-Za-zА-Яа-яЁё])([A-Za-zА-Яа-яЁё]{1,5})?\s*[-–—_ ]?\s*"
+    r"(20\d{6})\s*[-–—_ /]?\s*(\d{1,6})(?!\d)"
+)
+
+# Латинские буквы, которые в назначении платежа часто пишут вместо кириллицы
+_LOOKALIKES = str.maketrans("ABCEHKMOPTXY", "АВСЕНКМОРТХУ")
+
+
+def parse_statement(data: bytes) -> list:
+    """Документы из файла 1CClientBankExchange: список словарей ключ -> значение"""
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        # Кодировка=DOS — cp866, Кодировка=Windows (по умолчанию) — cp1251
+        text = data.decode("cp866" if b"=DOS" in data[:512] else "cp1251")
+    
+    lines = text.lstrip("\ufeff").splitlines()
+    if not lines or lines[0].strip() != "1CClientBankExchange":
+        raise ValueError("not a 1CClientBankExchange file")
+    
+    documents = []
+    document = None
+    for line in lines:
+        key, _, value = line.partition("=")
+        if key.startswith("СекцияДокумент"):
+            document = {"Вид": value.strip()}
+        elif key == "КонецДокумента":
+            if document is not None:
+                documents.append(document)
+            document = None
+        elif document is not None:
+            document[key.strip()] = value.strip()
+    return documents
+
+
+def _parse_date(value: str):
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+
+def incoming_payments(documents: list) -> list:
+    """Поступления на наш расчётный счёт в виде строк таблицы payments"""
+    payments = []
+    for doc in documents:
+        account = doc.get("ПолучательСчет") or doc.get("ПолучательРасчСчет")
+        if account != COMPANY["account"] and doc.get("ПолучательИНН") != COMPANY["inn"]:
+            continue
+        if doc.get("ПлательщикИНН") == COMPANY["inn"]:
+            # Перевод между своими счетами
+            continue
+        
+        doc_date = _parse_date(doc.get("Дата", ""))
+        try:
+            amount = Decimal(doc.get("Сумма", "").replace(",", "."))
+        except InvalidOperation:
+            amount = None
+        if doc_date is None or amount is None:
+            logger.warning("Skipping malformed document %s", doc.get("Номер"))
+            continue
+        
+        payments.append({
+            "doc_number": doc.get("Номер", ""),
+            "doc_date": doc_date,
+            "received_date": _parse_date(doc.get("ДатаПоступило", "")),
+            "amount": amount,
+            "payer_inn": doc.get("ПлательщикИНН", ""),
+            "payer_name": doc.get("Плательщик1") or doc.get("Плательщик", ""),
+            "payer_account": doc.get("ПлательщикСчет") or doc.get("ПлательщикРасчСчет", ""),
+            "purpose": doc.get("НазначениеПлатежа", ""),
+        })
+    return payments
+
+
+def _number_key(day: str, number: str) -> str:
+    return f"{day}-{int(number)}"
+
+
+def invoice_numbers(purpose: str) -> list:
+    """Номера счетов из назначения платежа: [(префикс или "", ключ ГГГГММДД-N)]"""
+    return [
+        ((prefix or "").upper().translate(_LOOKALIKES), _number_key(day, number))
+        for prefix, day, number in INVOICE_NUMBER_RE.findall(purpose)
+    ]
+
+
+class OrderIndex:
+    """Неоплаченные счета в памяти: по номеру и по ИНН"""
+    
+    def __init__(self, orders: list):
+        self.by_number = defaultdict(list)
+        self.by_inn = defaultdict(list)
+        self.paid = set()
+        for order in orders:
+            prefix, _, rest = order["invoice_number"].partition("-")
+            day, _, number = rest.partition("-")
+            if day.isdigit() and number.isdigit():
+                order["prefix"] = prefix.upper().translate(_LOOKALIKES)
+                self.by_number[_number_key(day, number)].append(order)
+            if order["company_inn"]:
+                self.by_inn[order["company_inn"]].append(order)
+    
+    def find_by_number(self, prefix: str, key: str):
+        candidates = [o for o in self.by_number.get(key, ()) if o["id"] not in self.paid]
+        if prefix and len(candidates) > 1:
+            # «счету 20260901-7» тоже разбирается как префикс — фильтр только уточняет
+            candidates = [o for o in candidates if o["prefix"] == prefix] or candidates
+        return candidates[0] if len(candidates) == 1 else None
+    
+    def match(self, payment: dict) -> tuple:
+        """Заказы, которые оплачивает платёж, и причина, если их нет"""
+        amount = payment["amount"]
+        numbers = invoice_numbers(payment["purpose"])
+        
+        orders = []
+        for prefix, key in dict.fromkeys(numbers):
+            order = self.find_by_number(prefix, key)
+            if order is not None and all(o["id"] != order["id"] for o in orders):
+                orders.append(order)
+        
+        if orders:
+            if sum(o["total_amount"] for o in orders) == amount:
+                return orders, None
+            exact = [o for o in orders if o["total_amount"] == amount]
+            if len(exact) == 1:
+                return exact, None
+            return [], "сумма не совпадает со счетами " + ", ".join(
+                f"{o['invoice_number']} ({o['total_amount']})" for o in orders
+            )
+        
+        candidates = [
+            o for o in self.by_inn.get(payment["payer_inn"], ())
+            if o["id"] not in self.paid and o["total_amount"] == amount
+        ]
+        if len(candidates) == 1:
+            return candidates, None
+        if candidates:
+            return [], f"несколько неоплаченных счетов ИНН {payment['payer_inn']} на {amount}"
+        if numbers:
+            return [], "счёт из назначения платежа не найден или уже оплачен"
+        return [], "нет номера счёта и счёта этого ИНН на ту же сумму"
+    
+    def mark_paid(self, orders: list):
+        self.paid.update(order["id"] for order in orders)
+
+
+def match_payments(payments: list, orders: list) -> tuple:
+    """Сопоставление платежей со счетами: ({id платежа: [id заказов]}, {id платежа: причина})"""
+    index = OrderIndex(orders)
+    matched, unmatched = {}, {}
+    for payment in payments:
+        found, note = index.match(payment)
+        if found:
+            index.mark_paid(found)
+            matched[payment["id"]] = [order["id"] for order in found]
+        else:
+            unmatched[payment["id"]] = note
+    return matched, unmatched
+
+
+def import_statements(paths: list, rematch: bool = False) -> dict:
+    """Загрузка выписок и отметка оплаченных счетов"""
+    stats = {"documents": 0, "incoming": 0, "new": 0}
+    for path in paths:
+        with open(path, "rb") as f:
+            documents = parse_statement(f.read())
+        payments = incoming_payments(documents)
+        stats["documents"] += len(documents)
+        stats["incoming"] += len(payments)
+        stats["new"] += save_payments(payments)
+        logger.info("Loaded %s: %s documents, %s incoming", path, len(documents), len(payments))
+    
+    pending = get_pending_payments(include_unmatched=rematch)
+    matched, unmatched = match_payments(pending, get_unpaid_orders())
+    stats["matched"] = len(matched)
+    stats["unmatched"] = len(unmatched)
+    stats["orders_paid"] = apply_payment_matches(matched, unmatched)
+    return stats
+
+
+def sample_statement(count: int) -> tuple:
+    """Синтетические неоплаченные счета и выписка cp1251 на count поступлений
+    
+    Половина платежей с номером счёта в назначении, половина — только по ИНН.
+    """
+    orders = []
+    lines = ["1CClientBankExchange", "ВерсияФормата=1.03", "Кодировка=Windows"]
+    for n in range(count):
+        created = date(2026, 1, 1) + timedelta(days=n % 365)
+        number = f"ЧМ-{created:%Y%m%d}-{n // 365 + 1:03d}"
+        inn = f"77{n:08d}"
+        total = Decimal(1000 + n % 5000)
+        orders.append({"id": n, "invoice_number": number, "company_inn": inn, "total_amount": total})
+        purpose = f"Оплата по счету № {number} за рекламу" if n % 2 else "Оплата за рекламные услуги"
+        lines += [
+            "СекцияДокумент=Платежное поручение",
+            f"Номер={n}",
+            f"Дата={created:%d.%m.%Y}",
+            f"Сумма={total}.00",
+            f"ПлательщикСчет=40702810{n:012d}",
+            f"ПлательщикИНН={inn}",
+            f"Плательщик1=ООО «Клиент {n}»",
+            f"ПолучательСчет={COMPANY['account']}",
+            f"ПолучательИНН={COMPANY['inn']}",
+            f"НазначениеПлатежа={purpose}",
+            "КонецДокумента",
+        ]
+    lines.append("КонецФайла")
+    return orders, "\r\n".join(lines).encode("cp1251")
+
+
+def bench(count: int):
+    orders, data = sample_statement(count)
+    start = time.perf_counter()
+    payments = incoming_payments(parse_statement(data))
+    for payment_id, payment in enumerate(payments):
+        payment["id"] = payment_id
+    parsed = time.perf_counter() - start
+    matched, unmatched = match_payments(payments, orders)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{count} payments ({len(data) / 2**20:.1f} MB) parsed in {parsed:.2f}s, "
+        f"matched against {count} unpaid orders in {elapsed - parsed:.2f}s: "
+        f"{len(matched)} matched, {len(unmatched)} unmatched"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Загрузка выписок и отметка оплат")
+    parser.add_argument("paths", nargs="*", help="Файлы выписок 1CClientBankExchange")
+    parser.add_argument("--rematch", action="store_true",
+                        help="Заново сопоставить ранее не найденные платежи")
+    parser.add_argument("--bench", type=int, metavar="N",
+                        help="Замер сопоставления N синтетических платежей без БД")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s",
+    )
+    
+    if args.bench:
+        bench(args.bench)
+    else:
+        init_pool()
+        try:
+            stats = import_statements(args.paths, args.rematch)
+        finally:
+            close_pool()
+        print(f"Done: {stats}")
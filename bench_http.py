@@ -0,0 +1,154 @@
+"""Нагрузочный замер HTTP: запросов в секунду и задержки ответа
+
+    python bench_http.py --path /order/1                 # 20 с, 50 одновременных запросов
+    python bench_http.py --path /order/1 --concurrency 200 --duration 60
+    python bench_http.py --path /order/1 . ../invoicegen-old
+    python bench_http.py --path /admin --background "/order/{id}/download" --ids 1-500 --p99-budget 200
+
+Каждый каталог из аргументов (по умолчанию текущий) запускается как
+отдельный uvicorn main:app, и для него печатается строка с результатом.
+Так сравнивается «до и после»: предыдущую версию проще всего получить
+через git worktree add ../invoicegen-old <коммит>. Нужна рабочая БД
+(DATABASE_URL) со схемой и заказом, на который указывает --path.
+
+--background задаёт фоновую нагрузку на время замера: её запросы идут
+параллельно, но в задержки --path не входят (для них печатается своя
+строка). {id} в пути заменяется случайным номером заказа из --ids. Так
+проверяется, что /admin отвечает быстро, пока идут скачивания счетов;
+чтобы скачивания действительно рендерили PDF, а не читали готовые,
+перед запуском очистите кэш: DELETE FROM pdf_cache. С --p99-budget
+скрипт завершается с кодом 1, если p99 --path больше бюджета.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench_startup import free_port
+
+
+def start_server(app_dir: str, port: int, timeout: float = 60.0) -> subprocess.Popen:
+    """uvicorn main:app из каталога app_dir; возвращается, когда сервер отвечает"""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=app_dir,
+        env={**os.environ, "PYTHONUNBUFFERED": "1"},
+    )
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.05)
+    process.terminate()
+    raise TimeoutError(f"uvicorn in {app_dir} did not start in {timeout}s")
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def path_factory(path: str, ids: tuple):
+    """Функция, возвращающая путь запроса; {id} — случайный заказ из ids"""
+    if "{id}" not in path:
+        return lambda: path
+    return lambda: path.replace("{id}", str(random.randint(*ids)))
+
+
+async def _worker(client: httpx.AsyncClient, next_path, deadline: float, latencies: list, errors: list):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.get(next_path())
+            await response.aread()
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+                continue
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def load(base_url: str, path: str, concurrency: int, duration: float,
+               background: str = "", background_concurrency: int = 0, ids: tuple = (1, 1)) -> dict:
+    """Нагрузка path (и фоновая нагрузка background) на duration секунд
+    
+    Возвращает {"path": (задержки, ошибки), "background": (задержки, ошибки)}.
+    """
+    results = {"path": ([], []), "background": ([], [])}
+    workers = [(path_factory(path, ids), results["path"])] * concurrency
+    if background:
+        workers += [(path_factory(background, ids), results["background"])] * background_concurrency
+    
+    limits = httpx.Limits(max_connections=len(workers), max_keepalive_connections=len(workers))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            _worker(client, next_path, deadline, *result) for next_path, result in workers
+        ))
+    return results
+
+
+def report(name: str, latencies: list, errors: list, duration: float) -> str:
+    return (
+        f"{name}: {len(latencies) / duration:.0f} req/s, "
+        f"p50 {percentile(latencies, 0.50) * 1000:.1f} ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms, "
+        f"{len(errors)} errors"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запросов в секунду и задержки маршрута")
+    parser.add_argument("app_dirs", nargs="*", default=["."],
+                        help="Каталоги с версиями приложения для сравнения")
+    parser.add_argument("--path", default="/order/1")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0, help="Секунд нагрузки")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Секунд прогрева без замера")
+    parser.add_argument("--background", default="",
+                        help="Путь фоновой нагрузки, например /order/{id}/download")
+    parser.add_argument("--background-concurrency", type=int, default=20)
+    parser.add_argument("--ids", default="1-1",
+                        help="Диапазон номеров заказов для {id}, например 1-500")
+    parser.add_argument("--p99-budget", type=float,
+                        help="Допустимый p99 для --path, мс (больше — код выхода 1)")
+    args = parser.parse_args()
+    
+    first, _, last = args.ids.partition("-")
+    ids = (int(first), int(last or first))
+    over_budget = False
+    for app_dir in args.app_dirs:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        process = start_server(app_dir, port)
+        try:
+            asyncio.run(load(base_url, args.path, args.concurrency, args.warmup))
+            results = asyncio.run(load(
+                base_url, args.path, args.concurrency, args.duration,
+                args.background, args.background_concurrency, ids,
+            ))
+        finally:
+            process.terminate()
+            process.wait()
+        
+        latencies, errors = results["path"]
+        print(report(f"{app_dir} {args.path}", latencies, errors, args.duration))
+        if args.background:
+            print(report(f"{app_dir} {args.background} (background)", *results["background"], args.duration))
+        if args.p99_budget is not None and percentile(latencies, 0.99) * 1000 > args.p99_budget:
+            print(f"{app_dir}: p99 of {args.path} is over {args.p99_budget:.0f} ms")
+            over_budget = True
+    
+    if over_budget:
+        sys.exit(1)
@@ -0,0 +1,120 @@
+"""Замер скорости рендера счетов и размера PDF
+
+    python bench_pdf.py                 # 1–5 строк, по 300 рендеров
+    python bench_pdf.py -n 1000 --lines 3
+    python bench_pdf.py -n 5 --lines 10 100 1000 5000
+    python bench_pdf.py . ../invoicegen-old
+
+Для каждого числа строк печатаются рендеров в секунду, размер одного PDF
+и сколько из него занимают встроенные шрифты. Каждый каталог из аргументов
+(по умолчанию текущий) замеряется отдельным процессом со своим
+pdf_generator.py. Так сравнивается «до и после»: предыдущую версию проще
+всего получить через git worktree add ../invoicegen-old <коммит>.
+
+ReportLab встраивает TTF только подмножеством глифов, режима полного
+встраивания у него нет. Поэтому для сравнения печатается, сколько весили
+бы сами файлы шрифтов из fonts/, сжатые так же, как поток PDF: столько
+занимали бы шрифты в каждом счёте при полном встраивании.
+
+Кириллица (DejaVu Sans) медленнее встроенной Helvetica в несколько раз:
+на каждый документ ReportLab заново собирает подмножество шрифта, пишет
+таблицу ширин и сжимает его. Без C-ускорителя (пакет rl_accel, requirements.txt)
+таблицы ширин форматируются на Python; печатается, подключён ли он.
+"""
+import argparse
+import re
+import subprocess
+import sys
+import time
+import zlib
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+
+# Поток файла шрифта в PDF: /Length — сжатый размер, /Length1 — исходный
+FONT_STREAM = re.compile(rb"/Length (\d+) /Length1 \d+")
+
+
+def sample_order(lines: int) -> dict:
+    products = [
+        {"name": f"Подписка на сервис, тариф {i}", "amount": Decimal("1490.00"), "period": "01.10.2026–31.10.2026"}
+        for i in range(1, lines + 1)
+    ]
+    # Каждая пятая позиция с длинным названием, которое переносится на несколько строк
+    for product in products[4::5]:
+        product["name"] += " с расширенной технической поддержкой и выделенным менеджером проекта"
+    return {
+        "invoice_number": "ЧМ-000123",
+        "created_at": datetime(2026, 10, 1, 12, 0),
+        "total_amount": sum((p["amount"] for p in products), Decimal("0")),
+        "products": products,
+        "company_name": "ООО \"Ромашка\"",
+        "company_inn": "7707083893",
+        "company_kpp": "770701001",
+        "company_address": "г. Москва, ул. Вавилова, д. 19",
+    }
+
+
+def bench(generate, lines: int, count: int) -> tuple:
+    """(рендеров в секунду, байт в PDF, из них байт шрифтов)"""
+    order = sample_order(lines)
+    pdf = generate(order)
+    start = time.perf_counter()
+    for _ in range(count):
+        generate(order)
+    rate = count / (time.perf_counter() - start)
+    fonts = sum(int(length) for length in FONT_STREAM.findall(pdf))
+    return rate, len(pdf), fonts
+
+
+def full_embedding_size(app_dir: Path) -> int:
+    """Сжатый размер файлов шрифтов — столько весило бы их полное встраивание"""
+    return sum(len(zlib.compress(path.read_bytes())) for path in sorted(app_dir.glob("fonts/*.ttf")))
+
+
+def run(app_dir: Path, lines: list, count: int):
+    """Замер pdf_generator.py из app_dir в текущем процессе"""
+    sys.path.insert(0, str(app_dir))
+    import pdf_generator
+    from reportlab.lib import rl_accel
+    
+    if hasattr(pdf_generator, "warm_up"):
+        pdf_generator.warm_up()
+    accelerated = type(rl_accel.fp_str).__name__ == "builtin_function_or_method"
+    print(f"{app_dir} (rl_accel {'on' if accelerated else 'off'})")
+    fonts = 0
+    for n in lines:
+        rate, size, fonts = bench(pdf_generator.generate_invoice_pdf, n, count)
+        print(
+            f"{n:>5} lines: {rate:6.1f} renders/sec, {1000 / rate / n:7.3f} ms/line, "
+            f"{size / 1024:6.1f} KB/PDF, fonts {fonts / 1024:5.1f} KB"
+        )
+    
+    full = full_embedding_size(app_dir)
+    if full:
+        print(
+            f"full font embedding: fonts {full / 1024:.0f} KB per PDF instead of "
+            f"{fonts / 1024:.0f} KB (compressed fonts/*.ttf)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Скорость рендера и размер PDF счетов")
+    parser.add_argument("app_dirs", nargs="*", default=["."],
+                        help="Каталоги с версиями приложения для сравнения")
+    parser.add_argument("-n", "--count", type=int, default=300, help="Рендеров на замер")
+    parser.add_argument("--lines", type=int, nargs="*", default=[1, 2, 3, 4, 5],
+                        help="Число строк в счёте")
+    args = parser.parse_args()
+    
+    if len(args.app_dirs) == 1:
+        run(Path(args.app_dirs[0]).resolve(), args.lines, args.count)
+        sys.exit(0)
+    
+    # Версии не должны делить модули и кэши ReportLab одного процесса
+    for app_dir in args.app_dirs:
+        subprocess.run(
+            [sys.executable, __file__, app_dir, "-n", str(args.count),
+             "--lines", *map(str, args.lines)],
+            check=True,
+        )
@@ -0,0 +1,167 @@
+"""Замер подсказок поиска в админке (suggest_orders): цель — p99 меньше 50 мс
+
+    python bench_search.py                          # на заказах, которые уже есть в БД
+    python bench_search.py --seed 1000000           # сначала добавить миллион синтетических
+    python bench_search.py --cleanup                # удалить синтетические заказы
+
+Запросы — типичный ввод в поиске: начало названия компании, имя клиента,
+часть email, ИНН, цифры телефона, номер счёта и строка, которой нет.
+Каждый выполняется через suggest_orders, как в /admin/search/suggest, но с
+запасом по statement_timeout, чтобы медленный запрос был виден в замере,
+а не превращался в пустой ответ. Печатаются p50/p99 по видам запросов и
+в целом; если общий p99 больше --budget, код выхода 1.
+
+Синтетические заказы получают номера BENCH-N и удаляются --cleanup. Их
+вставка запускает триггеры orders (сводка отчётов, NOTIFY), поэтому
+--seed лучше делать на отдельной базе. Нужна схема: python migrate.py.
+"""
+import argparse
+import logging
+import random
+import sys
+import time
+from collections import defaultdict
+
+from config import SEARCH_SUGGEST_LIMIT
+from database import init_pool, close_pool, get_connection, suggest_orders
+
+SEED_BATCH_SIZE = 50000
+
+COMPANIES = ["Ромашка", "Вектор", "Северный ветер", "Техноторг", "Альфа-Медиа"]
+FIRST_NAMES = ["Иван", "Пётр", "Анна", "Мария", "Сергей"]
+LAST_NAMES = ["Петров", "Иванов", "Смирнов", "Кузнецов", "Попов"]
+
+
+def _sql_array(values: list) -> str:
+    return "ARRAY[" + ", ".join("'" + value + "'" for value in values) + "]"
+
+
+def seed(count: int):
+    """count синтетических заказов BENCH-N пачками по SEED_BATCH_SIZE"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT count(*) AS n FROM orders WHERE invoice_number LIKE 'BENCH-%'")
+        first = cursor.fetchone()["n"] + 1
+    
+    for start in range(first, first + count, SEED_BATCH_SIZE):
+        end = min(start + SEED_BATCH_SIZE, first + count) - 1
+        with get_connection() as conn:
+            conn.cursor().execute(f"""
+                INSERT INTO orders (
+                    invoice_number, created_at, status, total, currency,
+                    customer_name, customer_email, customer_phone, company_name, company_inn
+                )
+                SELECT 'BENCH-' || n,
+                       now() - (n %% 50000) * interval '10 minutes',
+                       (ARRAY['new', 'pdf_generated', 'paid'])[1 + n %% 3],
+                       1000 + n %% 5000, 'RUB',
+                       ({_sql_array(FIRST_NAMES)})[1 + n %% 5] || ' ' ||
+                           ({_sql_array(LAST_NAMES)})[1 + n / 5 %% 5],
+                       'client' || n || '@example.com',
+                       '+7 (9' || lpad((n %% 100)::text, 2, '0') || ') ' || lpad(n::text, 7, '0'),
+                       'ООО «' || ({_sql_array(COMPANIES)})[1 + n %% 5] || ' ' || n %% 10000 || '»',
+                       (7700000000 + n)::text
+                FROM generate_series(%s, %s) AS n
+            """, (start, end))
+        print(f"seeded {end - first + 1}/{count}")
+    
+    with get_connection() as conn:
+        conn.cursor().execute("ANALYZE orders")
+
+
+def cleanup():
+    """Удаление синтетических заказов пачками"""
+    while True:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE FROM orders WHERE id IN (
+                    SELECT id FROM orders WHERE invoice_number LIKE 'BENCH-%%' LIMIT %s
+                )
+            """, (SEED_BATCH_SIZE,))
+            if cursor.rowcount == 0:
+                return
+
+
+def sample_queries(count: int, high: int) -> list:
+    """count пар (вид запроса, строка) по заказам BENCH-1 .. BENCH-high"""
+    kinds = {
+        "company prefix": lambda n: COMPANIES[n % 5][:4].lower(),
+        "company": lambda n: f"{COMPANIES[n % 5]} {n % 10000}",
+        "customer": lambda n: f"{FIRST_NAMES[n % 5]} {LAST_NAMES[n // 5 % 5]}",
+        "email": lambda n: f"client{n}@",
+        "inn": lambda n: str(7700000000 + n),
+        "phone digits": lambda n: f"{n:07d}"[-7:],
+        "invoice": lambda n: f"BENCH-{n}",
+        "no match": lambda n: f"щъыж{n}",
+    }
+    queries = []
+    for _ in range(count):
+        kind = random.choice(list(kinds))
+        queries.append((kind, kinds[kind](random.randint(1, max(high, 1)))))
+    return queries
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def measure(queries: list, timeout_ms: int) -> dict:
+    """Время suggest_orders в мс по видам запросов"""
+    timings = defaultdict(list)
+    for kind, query in queries:
+        start = time.perf_counter()
+        suggest_orders(query, SEARCH_SUGGEST_LIMIT, timeout_ms)
+        timings[kind].append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Задержка подсказок поиска заказов")
+    parser.add_argument("--seed", type=int, default=0, help="Добавить N синтетических заказов")
+    parser.add_argument("--cleanup", action="store_true", help="Удалить синтетические заказы")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--budget", type=float, default=50.0, help="Допустимый p99, мс")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s",
+    )
+    
+    init_pool()
+    try:
+        if args.cleanup:
+            cleanup()
+            sys.exit(0)
+        if args.seed:
+            seed(args.seed)
+        
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT count(*) AS n FROM orders")
+            total = cursor.fetchone()["n"]
+            cursor.execute("SELECT count(*) AS n FROM orders WHERE invoice_number LIKE 'BENCH-%'")
+            seeded = cursor.fetchone()["n"]
+        
+        queries = sample_queries(args.queries, seeded)
+        measure(queries[:50], int(args.budget * 20))    # прогрев кэша и пула
+        timings = measure(queries, int(args.budget * 20))
+    finally:
+        close_pool()
+    
+    print(f"{total} orders, {len(queries)} queries")
+    for kind, values in sorted(timings.items()):
+        print(
+            f"{kind:>15}: p50 {percentile(values, 0.5):6.1f} ms, "
+            f"p99 {percentile(values, 0.99):6.1f} ms, max {max(values):6.1f} ms"
+        )
+    overall = [value for values in timings.values() for value in values]
+    p99 = percentile(overall, 0.99)
+    print(
+        f"{'all':>15}: p50 {percentile(overall, 0.5):6.1f} ms, p99 {p99:6.1f} ms, "
+        f"budget {args.budget:.0f} ms"
+    )
+    if p99 > args.budget:
+        sys.exit(1)
@@ -0,0 +1,74 @@
+"""Замер холодного старта веб-процесса
+
+    python bench_startup.py                 # 3 запуска uvicorn main:app
+    python bench_startup.py --runs 5 --path /admin
+
+Запускает uvicorn, ждёт первого ответа на --path и печатает время от
+запуска процесса до первого байта. Если оно больше бюджета
+(STARTUP_BUDGET_SECONDS), завершается с кодом 1. Нужна рабочая БД
+(DATABASE_URL) с уже применённой схемой: python migrate.py --schema-only.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from config import STARTUP_BUDGET_SECONDS
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_byte(path: str, timeout: float) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, "PYTHONUNBUFFERED": "1"},
+    )
+    try:
+        url = f"http://127.0.0.1:{port}{path}"
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    response.read(1)
+                return time.perf_counter() - start
+            except urllib.error.HTTPError:
+                # Ответ с ошибкой — тоже первый байт
+                return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError(f"no response from {url} in {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Время холодного старта до первого байта")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--path", default="/metrics")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_SECONDS,
+                        help="Допустимое время до первого байта, секунд")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+    
+    results = []
+    for run in range(1, args.runs + 1):
+        seconds = time_to_first_byte(args.path, args.timeout)
+        results.append(seconds)
+        print(f"run {run}: {seconds:.2f}s to first byte of {args.path}")
+    
+    worst = max(results)
+    print(f"best {min(results):.2f}s, worst {worst:.2f}s, budget {args.budget:.2f}s")
+    if worst > args.budget:
+        sys.exit(1)
@@ -0,0 +1,135 @@
+"""Выгрузка счетов пачкой в ZIP
+
+    python bulk_export.py --date-from 2026-09-01 --date-to 2026-09-30 -o september.zip
+"""
+import argparse
+import asyncio
+import zipfile
+from collections import deque
+from datetime import date
+
+from starlette.concurrency import run_in_threadpool
+
+from config import PDF_WORKERS
+from database import init_pool, close_pool, list_orders, get_cached_pdf
+from pdf_hash import invoice_hash
+from pdf_renderer import start_renderer, stop_renderer, render_invoice
+
+# Заказов за один запрос к БД
+EXPORT_PAGE_SIZE = 200
+
+
+class ZipStream:
+    """Файл для zipfile без seek: копит записанные байты до отправки клиенту
+    
+    zipfile видит, что seek недоступен, и пишет размеры после данных
+    (data descriptor), поэтому архив можно отдавать по частям.
+    """
+    
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._offset
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def _iter_orders(filters: dict):
+    """Заказы с заполненными реквизитами, страница за страницей"""
+    cursor = None
+    while True:
+        orders, cursor = await run_in_threadpool(
+            list_orders, EXPORT_PAGE_SIZE, cursor, True, **filters
+        )
+        for order in orders:
+            if order["company_inn"]:
+                yield order
+        if not cursor:
+            break
+
+
+async def _invoice_pdf(order: dict) -> tuple:
+    """Имя файла и PDF счёта (из кэша, если он актуален)"""
+    pdf = await run_in_threadpool(get_cached_pdf, order["id"], invoice_hash(order))
+    if pdf is None:
+        # В кэш не сохраняем: разовая выгрузка за месяц раздула бы pdf_cache
+        pdf = await render_invoice(order, check_queue=False)
+    return f"Invoice_{order['invoice_number']}.pdf", pdf
+
+
+async def iter_invoices_zip(filters: dict, window: int = PDF_WORKERS):
+    """ZIP со счетами по фильтрам, отдаётся кусками по мере готовности
+    
+    Одновременно рендерится не больше window счетов, поэтому память
+    ограничена размером окна, а не числом заказов.
+    """
+    stream = ZipStream()
+    archive = zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED)
+    pending = deque()
+    
+    try:
+        async for order in _iter_orders(filters):
+            pending.append(asyncio.ensure_future(_invoice_pdf(order)))
+            if len(pending) < window:
+                continue
+            
+            name, pdf = await pending.popleft()
+            archive.writestr(name, pdf)
+            yield stream.drain()
+        
+        while pending:
+            name, pdf = await pending.popleft()
+            archive.writestr(name, pdf)
+            yield stream.drain()
+        
+        archive.close()
+        yield stream.drain()
+    finally:
+        # Клиент отключился или ошибка — не рендерим то, что уже не нужно
+        for task in pending:
+            task.cancel()
+
+
+async def export_to_file(path: str, filters: dict):
+    init_pool()
+    start_renderer()
+    try:
+        with open(path, "wb") as f:
+            async for chunk in iter_invoices_zip(filters):
+                f.write(chunk)
+    finally:
+        stop_renderer()
+        close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Выгрузка PDF счетов в ZIP")
+    parser.add_argument("-o", "--output", required=True, help="Путь к ZIP-файлу")
+    parser.add_argument("--status")
+    parser.add_argument("--inn")
+    parser.add_argument("--customer")
+    parser.add_argument("--date-from", type=date.fromisoformat)
+    parser.add_argument("--date-to", type=date.fromisoformat)
+    args = parser.parse_args()
+    
+    asyncio.run(export_to_file(args.output, {
+        "status": args.status,
+        "inn": args.inn,
+        "customer": args.customer,
+        "date_from": args.date_from,
+        "date_to": args.date_to,
+    }))
+    print(f"Saved {args.output}")
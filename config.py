@@ -1,8 +1,61 @@
 import os
 
+# Миграция схемы при старте веб-процесса. По умолчанию выключена:
+# схему обновляет отдельная команда (release в Procfile: python migrate.py --schema-only)
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "0") == "1"
+
+# Сколько секунд может занимать старт процесса до готовности отвечать
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "5"))
+
+# Сколько секунд при остановке процесса даётся фоновым обработчикам
+# на завершение текущей пачки (меньше graceful_timeout в gunicorn.conf.py)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+
+# Обслуживание БД (выполняет один процесс из всех, см. maintenance.py):
+# период в секундах и сроки хранения в днях
+MAINTENANCE_INTERVAL = int(os.getenv("MAINTENANCE_INTERVAL", "600"))
+WEBHOOK_RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS", "30"))
+RENDER_JOB_RETENTION_DAYS = int(os.getenv("RENDER_JOB_RETENTION_DAYS", "7"))
+
+# Подсказки поиска в админке: сколько заказов и предел времени запроса (мс),
+# после которого подсказки не показываются, а не тормозят ввод
+SEARCH_SUGGEST_LIMIT = int(os.getenv("SEARCH_SUGGEST_LIMIT", "10"))
+SEARCH_SUGGEST_TIMEOUT_MS = int(os.getenv("SEARCH_SUGGEST_TIMEOUT_MS", "200"))
+
+# Живые обновления админки (order_events.py): потоков SSE на процесс,
+# сообщений в очереди одной страницы и период keepalive в секундах
+SSE_MAX_CLIENTS = int(os.getenv("SSE_MAX_CLIENTS", "500"))
+SSE_CLIENT_QUEUE_SIZE = int(os.getenv("SSE_CLIENT_QUEUE_SIZE", "256"))
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+
+# Метрики всех воркеров gunicorn (metrics.py): каталог снимков и период
+# их записи в секундах. Пусто — /metrics отдаёт только свой процесс.
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+# Уровень логирования: DEBUG, INFO, WARNING, ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
 # DaData API
 DADATA_API_KEY = os.getenv("DADATA_API_KEY", "")
 DADATA_SECRET_KEY = os.getenv("DADATA_SECRET_KEY", "")
+DADATA_URL = os.getenv(
+    "DADATA_URL", "https://suggestions.dadata.ru/suggestions/api/4_1/rs/findById/party"
+)
+
+# Локальный реестр компаний (inn_registry.py): если файл задан, ИНН сначала
+# ищется в нём и только при отсутствии — в DaData. Пусто — реестр не используется.
+INN_REGISTRY_PATH = os.getenv("INN_REGISTRY_PATH", "")
+
+# Пакетное обогащение заказов (enrich.py): параллельных запросов и запросов
+# в секунду. Лимит DaData — 30 запросов в секунду с одного IP.
+DADATA_BATCH_CONCURRENCY = int(os.getenv("DADATA_BATCH_CONCURRENCY", "5"))
+DADATA_BATCH_RATE = float(os.getenv("DADATA_BATCH_RATE", "20"))
+
+# Кэш ответов DaData (секунды); ненайденные ИНН кэшируются отдельно
+DADATA_CACHE_TTL = int(os.getenv("DADATA_CACHE_TTL", str(7 * 24 * 3600)))
+DADATA_NEGATIVE_CACHE_TTL = int(os.getenv("DADATA_NEGATIVE_CACHE_TTL", "3600"))
+DADATA_CACHE_SIZE = int(os.getenv("DADATA_CACHE_SIZE", "1024"))
 
 # Реквизиты вашей компании (исполнитель)
 COMPANY = {
@@ -26,3 +79,7 @@ INVOICE_START_NUMBER = 1
 
 # Срок оплаты (дней от даты счёта)
 PAYMENT_DAYS = 3
+
+# Рендеринг PDF: число процессов и предел очереди (сверх него — 503)
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_QUEUE_LIMIT = int(os.getenv("PDF_QUEUE_LIMIT", str(PDF_WORKERS * 4)))
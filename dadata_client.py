@@ -1,21 +1,185 @@
-import httpx
+import asyncio
+import logging
+import time
+from collections import OrderedDict
 from typing import Optional
-from config import DADATA_API_KEY, DADATA_SECRET_KEY
+from starlette.concurrency import run_in_threadpool
+from config import (
+    DADATA_URL, DADATA_API_KEY, DADATA_SECRET_KEY,
+    DADATA_CACHE_TTL, DADATA_NEGATIVE_CACHE_TTL, DADATA_CACHE_SIZE
+)
+from database import get_cached_company, save_cached_company
+from inn_registry import inn_key, lookup as registry_lookup
+from metrics import Counter, Histogram, CallbackGauge
+
+logger = logging.getLogger(__name__)
+
+# Общий клиент: keep-alive соединение с DaData переиспользуется между запросами.
+# httpx импортируется при первом запросе: на старте процесса он не нужен.
+_client: Optional["httpx.AsyncClient"] = None
+
+# LRU-кэш в памяти процесса: ИНН -> (момент устаревания, компания или None)
+_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+# Запросы к DaData в процессе выполнения: ИНН -> задача
+_inflight: dict = {}
+
+cache_stats = {
+    "registry": 0,      # найдено в локальном реестре (inn_registry.py)
+    "hits": 0,          # найдено в памяти
+    "db_hits": 0,       # найдено в кэше PostgreSQL
+    "misses": 0,        # пришлось идти в DaData
+    "coalesced": 0,     # дождались уже идущего запроса того же ИНН
+    "errors": 0,        # ошибки DaData (не кэшируются)
+}
+
+DADATA_SECONDS = Histogram("dadata_request_duration_seconds", "Время запроса к DaData")
+DADATA_REQUESTS = Counter(
+    "dadata_requests_total", "Запросы к DaData по результату", ("result",)
+)
+CallbackGauge(
+    "dadata_cache_events_total", "События кэша DaData",
+    lambda: dict(cache_stats), labelname="event", metric_type="counter"
+)
+CallbackGauge("dadata_cache_size", "Записей в LRU-кэше DaData", lambda: len(_cache))
+
+
+class DaDataError(Exception):
+    """DaData не ответила или ответила ошибкой"""
+
+
+class DaDataRateLimited(DaDataError):
+    """DaData ответила 429: превышен лимит запросов"""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def get_client() -> "httpx.AsyncClient":
+    """Общий HTTP-клиент DaData"""
+    import httpx
+    
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=10.0,
+            limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=60),
+        )
+    return _client
+
+
+async def close_client():
+    """Закрытие HTTP-клиента (вызывается в shutdown)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_cache_stats() -> dict:
+    """Счётчики кэша DaData"""
+    return {**cache_stats, "size": len(_cache), "inflight": len(_inflight)}
+
+
+def _cache_get(inn: str):
+    """Значение из LRU: (True, компания) если есть и не устарело"""
+    entry = _cache.get(inn)
+    if entry is None:
+        return False, None
+    
+    expires_at, company = entry
+    if expires_at < time.monotonic():
+        del _cache[inn]
+        return False, None
+    
+    _cache.move_to_end(inn)
+    return True, company
+
+
+def _cache_put(inn: str, company: Optional[dict], ttl: float):
+    _cache[inn] = (time.monotonic() + ttl, company)
+    _cache.move_to_end(inn)
+    while len(_cache) > DADATA_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def _ttl(company: Optional[dict]) -> int:
+    return DADATA_CACHE_TTL if company else DADATA_NEGATIVE_CACHE_TTL
 
 
 async def get_company_by_inn(inn: str) -> Optional[dict]:
-    """Получение данных компании по ИНН через DaData API"""
+    """Получение данных компании по ИНН через DaData API
+    
+    Порядок поиска: локальный реестр -> память процесса -> кэш в PostgreSQL
+    -> DaData. Одновременные запросы одного ИНН объединяются в один вызов DaData.
+    Строка, которая не может быть ИНН (не 10 и не 12 цифр), сразу даёт None:
+    её не нужно ни запрашивать, ни хранить в кэше ненайденных.
+    """
+    inn = inn.strip()
+    if inn_key(inn) is None:
+        return None
     
-    print(f"=== DaData Search ===")
-    print(f"INN: {inn}")
-    print(f"API Key exists: {bool(DADATA_API_KEY)}")
-    print(f"API Key first 10 chars: {DADATA_API_KEY[:10] if DADATA_API_KEY else 'EMPTY'}")
+    company = registry_lookup(inn)
+    if company is not None:
+        cache_stats["registry"] += 1
+        return company
     
-    if not DADATA_API_KEY:
-        print("ERROR: DADATA_API_KEY is empty!")
+    found, company = _cache_get(inn)
+    if found:
+        cache_stats["hits"] += 1
+        return company
+    
+    task = _inflight.get(inn)
+    if task is not None:
+        cache_stats["coalesced"] += 1
+    else:
+        task = asyncio.ensure_future(_lookup(inn))
+        _inflight[inn] = task
+        task.add_done_callback(lambda _: _inflight.pop(inn, None))
+    
+    # shield: отмена одного ожидающего запроса не отменяет общий поиск
+    return await asyncio.shield(task)
+
+
+async def _lookup(inn: str) -> Optional[dict]:
+    """Поиск ИНН в кэше PostgreSQL, затем в DaData"""
+    try:
+        cached = await run_in_threadpool(get_cached_company, inn)
+    except Exception as e:
+        logger.warning("DaData cache read failed: %s", e)
+        cached = None
+    
+    if cached and cached["age"] < _ttl(cached["data"]):
+        cache_stats["db_hits"] += 1
+        remaining = _ttl(cached["data"]) - cached["age"]
+        _cache_put(inn, cached["data"], remaining)
+        return cached["data"]
+    
+    cache_stats["misses"] += 1
+    try:
+        company = await fetch_company(inn)
+    except DaDataError as e:
+        cache_stats["errors"] += 1
+        logger.warning("DaData error for INN %s: %s", inn, e)
         return None
     
-    url = "https://suggestions.dadata.ru/suggestions/api/4_1/rs/findById/party"
+    _cache_put(inn, company, _ttl(company))
+    try:
+        await run_in_threadpool(save_cached_company, inn, company)
+    except Exception as e:
+        logger.warning("DaData cache write failed: %s", e)
+    
+    return company
+
+
+async def fetch_company(inn: str) -> Optional[dict]:
+    """Запрос компании в DaData без кэша
+    
+    Возвращает None, если компания не найдена; DaDataError — если ответа нет.
+    """
+    if not DADATA_API_KEY:
+        raise DaDataError("DADATA_API_KEY is empty")
     
     headers = {
         "Content-Type": "application/json",
@@ -26,43 +190,55 @@ async def get_company_by_inn(inn: str) -> Optional[dict]:
     if DADATA_SECRET_KEY:
         headers["X-Secret"] = DADATA_SECRET_KEY
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                url,
+    import httpx
+    
+    try:
+        with DADATA_SECONDS.time():
+            response = await get_client().post(
+                DADATA_URL,
                 headers=headers,
                 json={"query": inn},
-                timeout=10.0
             )
-            
-            print(f"Response status: {response.status_code}")
-            print(f"Response body: {response.text[:500]}")
-            
-            if response.status_code != 200:
-                print(f"ERROR: Bad status {response.status_code}")
-                return None
-                
-            data = response.json()
-            
-            if data.get("suggestions"):
-                suggestion = data["suggestions"][0]
-                company_data = suggestion.get("data", {})
-                
-                result = {
-                    "name": suggestion.get("value", ""),
-                    "inn": company_data.get("inn", ""),
-                    "kpp": company_data.get("kpp", ""),
-                    "address": company_data.get("address", {}).get("value", ""),
-                    "ogrn": company_data.get("ogrn", ""),
-                }
-                print(f"Found company: {result}")
-                return result
-            
-            print("No suggestions found")
-            return None
-            
-        except Exception as e:
-            print(f"DaData exception: {e}")
-            import traceback
-            print(traceback.format_exc())
-            return None
+    except httpx.HTTPError as e:
+        DADATA_REQUESTS.inc(result="error")
+        raise DaDataError(f"request failed: {e!r}") from e
+    
+    if response.status_code == 429:
+        DADATA_REQUESTS.inc(result="rate_limited")
+        try:
+            retry_after = float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            retry_after = None
+        raise DaDataRateLimited("rate limited", retry_after)
+    
+    if response.status_code != 200:
+        DADATA_REQUESTS.inc(result="error")
+        raise DaDataError(f"bad status {response.status_code}")
+    
+    try:
+        data = response.json()
+    except ValueError as e:
+        DADATA_REQUESTS.inc(result="error")
+        raise DaDataError(f"bad JSON: {response.text[:200]!r}") from e
+    if not isinstance(data, dict):
+        DADATA_REQUESTS.inc(result="error")
+        raise DaDataError(f"unexpected response: {response.text[:200]!r}")
+    
+    if data.get("suggestions"):
+        suggestion = data["suggestions"][0]
+        company_data = suggestion.get("data", {})
+        
+        result = {
+            "name": suggestion.get("value", ""),
+            "inn": company_data.get("inn", ""),
+            "kpp": company_data.get("kpp", ""),
+            "address": (company_data.get("address") or {}).get("value", ""),
+            "ogrn": company_data.get("ogrn", ""),
+        }
+        DADATA_REQUESTS.inc(result="found")
+        logger.debug("DaData found INN %s: %s", inn, result["name"])
+        return result
+    
+    DADATA_REQUESTS.inc(result="not_found")
+    logger.debug("DaData has no company for INN %s", inn)
+    return None
@@ -1,23 +1,251 @@
+import hashlib
 import os
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 from typing import Optional
 import json
 
+from metrics import Histogram, CallbackGauge, timed
+
+logger = logging.getLogger(__name__)
+
+# Текст заказа для поиска. Запросы должны использовать ровно те же
+# выражения, что и индексы в init_db, иначе планировщик индекс не возьмёт.
+_SEARCH_FIELDS = """
+    coalesce(invoice_number, '') || ' ' || coalesce(company_inn, '') || ' ' ||
+    coalesce(company_name, '') || ' ' || coalesce(customer_name, '') || ' ' ||
+    coalesce(customer_email, '') || ' ' || coalesce(customer_phone, '')
+"""
+# Полнотекстовый: слова по началу с русской морфологией («ромашк» -> «Ромашка»)
+ORDER_SEARCH_TSV = f"to_tsvector('russian', {_SEARCH_FIELDS})"
+# Триграммный: любая подстрока, телефон ещё и одними цифрами
+ORDER_SEARCH_TEXT = (
+    f"lower({_SEARCH_FIELDS} || ' ' || "
+    r"regexp_replace(coalesce(customer_phone, ''), '\D', '', 'g'))"
+)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Канал NOTIFY об изменениях заказов (см. _init_order_notify и order_events.py)
+ORDERS_CHANNEL = "orders_changed"
+
+# Размер пула соединений (на один процесс uvicorn). ThreadedConnectionPool
+# закрывает возвращённое соединение, если свободных уже DB_POOL_MIN, поэтому
+# по умолчанию MIN = MAX: иначе под нагрузкой снова подключение на запрос
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", str(DB_POOL_MAX)))
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool не ждёт свободное соединение, а сразу бросает
+# PoolError, поэтому ограничиваем число одновременных getconn() семафором
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+# Соединений, выданных get_connection (для метрики db_pool_connections)
+_pool_in_use = 0
+_pool_in_use_lock = threading.Lock()
+
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Время функций database.py", ("function",)
+)
+CallbackGauge(
+    "db_pool_connections", "Соединения пула PostgreSQL",
+    lambda: {"in_use": _pool_in_use, "max": DB_POOL_MAX},
+    labelname="state"
+)
+
+
+def init_pool():
+    """Создание пула соединений (вызывается в startup)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(
+                DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL,
+                cursor_factory=RealDictCursor
+            )
+
+
+# Таблицы, которые создаёт init_db; по ним проверяется, что миграция прошла
+SCHEMA_TABLES = (
+    "orders", "invoice_counters", "order_items", "webhook_inbox",
+    "company_cache", "pdf_cache", "render_jobs",
+    "order_stats_daily", "order_stats_customer", "order_stats_delta", "payments",
+)
+
+
+def close_pool():
+    """Закрытие всех соединений пула (вызывается в shutdown)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+@timed(DB_QUERY_SECONDS)
+def check_schema() -> list:
+    """Таблицы из SCHEMA_TABLES, которых нет в базе (пустой список — всё на месте)
+    
+    Вызывается на старте вместо init_db: один короткий запрос
+    без блокировок вместо десятков DDL.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT name FROM unnest(%s::text[]) AS name
+            WHERE to_regclass(name) IS NULL
+        """, (list(SCHEMA_TABLES),))
+        return [row["name"] for row in cursor.fetchall()]
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
 
+def dump_products(products: list) -> str:
+    """Товары заказа в JSON (суммы Decimal пишутся числами)"""
+    return json.dumps(products, ensure_ascii=False, default=_json_default)
+
+
+def load_products(text: Optional[str]) -> list:
+    """Товары заказа из JSON, суммы читаются как Decimal"""
+    return json.loads(text, parse_float=Decimal) if text else []
+
+
+@contextmanager
 def get_connection():
-    """Подключение к PostgreSQL"""
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    """Соединение из пула: commit при успехе, rollback при ошибке"""
+    if _pool is None:
+        init_pool()
+    
+    global _pool_in_use
+    with _pool_slots:
+        pool = _pool
+        conn = pool.getconn()
+        with _pool_in_use_lock:
+            _pool_in_use += 1
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            with _pool_in_use_lock:
+                _pool_in_use -= 1
+            pool.putconn(conn, close=bool(conn.closed))
+
+
+# Ожидание блокировки таблицы одним шагом миграции (мс) и число попыток:
+# DDL не должен стоять в очереди за долгим запросом (например, выгрузкой),
+# задерживая все запросы к orders, которые встанут в очередь уже за ним
+MIGRATION_LOCK_TIMEOUT_MS = int(os.getenv("MIGRATION_LOCK_TIMEOUT_MS", "5000"))
+MIGRATION_LOCK_RETRIES = 5
+
+
+def _migration_step(step, *args):
+    """Шаг миграции в отдельной короткой транзакции с lock_timeout
+    
+    Если блокировку за MIGRATION_LOCK_TIMEOUT_MS взять не удалось, шаг
+    откатывается и повторяется позже, а не держит очередь к таблице.
+    """
+    for attempt in range(1, MIGRATION_LOCK_RETRIES + 1):
+        try:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SET LOCAL lock_timeout = %s", (MIGRATION_LOCK_TIMEOUT_MS,))
+                return step(cursor, *args)
+        except psycopg2.errors.LockNotAvailable:
+            if attempt == MIGRATION_LOCK_RETRIES:
+                raise
+            logger.warning(
+                "Migration step %s: table is locked, retry %s/%s",
+                step.__name__, attempt, MIGRATION_LOCK_RETRIES - 1
+            )
+            time.sleep(attempt)
 
 
+@timed(DB_QUERY_SECONDS)
 def init_db():
-    """Создание таблиц"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    """Создание и обновление схемы
     
+    Шаги выполняются отдельно, чтобы не держать блокировку orders дольше
+    нужного: новые таблицы — одной транзакцией, недостающие колонки orders —
+    каждая своей короткой транзакцией, триггеры — только если их определение
+    изменилось, индексы orders — CONCURRENTLY. На актуальной схеме повторный
+    запуск (migrate.py --schema-only на каждом релизе) orders не блокирует.
+    """
+    columns = _migration_step(_create_tables)
+    for column, definition in ORDER_ADDED_COLUMNS:
+        if column not in columns:
+            _migration_step(_add_order_column, column, definition)
+    if _migration_step(_add_payment_fkey):
+        _migration_step(_validate_payment_fkey)
+    _migration_step(_init_order_stats)
+    _migration_step(_init_order_notify)
+    _create_order_indexes()
+    logger.info("Database initialized")
+
+
+# Колонки, добавленные в orders после первой версии, в порядке добавления
+ORDER_ADDED_COLUMNS = (
+    # Деньги в NUMERIC: total заменяет REAL-колонку total_amount,
+    # которая остаётся только для строк, ещё не перенесённых migrate.py
+    ("total", "NUMERIC(12, 2)"),
+    # Номер заказа в Тильде: повторный вебхук не создаёт второй заказ
+    ("tilda_order_id", "TEXT"),
+    # Валюта счёта (код ISO 4217), от неё зависит сумма прописью
+    ("currency", "TEXT NOT NULL DEFAULT 'RUB'"),
+    # Промокод и скидка заказа из Тильды (total — уже со скидкой)
+    ("promocode", "TEXT NOT NULL DEFAULT ''"),
+    ("discount", "NUMERIC(12, 2) NOT NULL DEFAULT 0"),
+    # Поступление, которым оплачен счёт (bank_import.py)
+    ("payment_id", "BIGINT"),
+)
+
+
+def _add_order_column(cursor, column: str, definition: str):
+    # С постоянным DEFAULT это изменение только каталога, без перезаписи таблицы
+    cursor.execute(f"ALTER TABLE orders ADD COLUMN IF NOT EXISTS {column} {definition}")
+    logger.info("Added column orders.%s", column)
+
+
+def _add_payment_fkey(cursor):
+    """Внешний ключ orders.payment_id без долгой блокировки orders
+    
+    Ключ добавляется NOT VALID (мгновенно), а существующие строки
+    проверяет отдельная транзакция VALIDATE, которая не мешает записи.
+    """
+    cursor.execute("""
+        SELECT convalidated FROM pg_constraint
+        WHERE conrelid = 'orders'::regclass AND conname = 'orders_payment_id_fkey'
+    """)
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute("""
+            ALTER TABLE orders ADD CONSTRAINT orders_payment_id_fkey
+            FOREIGN KEY (payment_id) REFERENCES payments(id) ON DELETE SET NULL NOT VALID
+        """)
+    return row is None or not row["convalidated"]
+
+
+def _validate_payment_fkey(cursor):
+    cursor.execute("ALTER TABLE orders VALIDATE CONSTRAINT orders_payment_id_fkey")
+
+
+def _create_tables(cursor) -> set:
+    """Недостающие таблицы; возвращает уже существующие колонки orders"""
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS orders (
             id SERIAL PRIMARY KEY,
@@ -39,31 +267,614 @@ def init_db():
         )
     """)
     
-    conn.commit()
-    conn.close()
-    print("Database initialized!")
+    # Счётчики номеров счетов: одна строка на префикс и день
+    cursor.execute("SELECT to_regclass('invoice_counters') IS NULL AS missing")
+    counters_missing = cursor.fetchone()["missing"]
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS invoice_counters (
+            prefix TEXT NOT NULL,
+            day DATE NOT NULL,
+            last_number INTEGER NOT NULL,
+            PRIMARY KEY (prefix, day)
+        )
+    """)
+    
+    # Один раз, при создании счётчиков, переносим уже выданные номера
+    # вида ПРЕФИКС-ГГГГММДД-NNN, чтобы нумерация продолжилась, а не
+    # началась заново
+    if counters_missing:
+        cursor.execute("""
+            INSERT INTO invoice_counters (prefix, day, last_number)
+            SELECT split_part(invoice_number, '-', 1),
+                   to_date(split_part(invoice_number, '-', 2), 'YYYYMMDD'),
+                   MAX(split_part(invoice_number, '-', 3)::int)
+            FROM orders
+            WHERE invoice_number ~ '^[^-]+-[0-9]{8}-[0-9]+$'
+            GROUP BY 1, 2
+            ON CONFLICT (prefix, day) DO NOTHING
+        """)
+    
+    # Товары заказа. У перенесённых и новых заказов orders.products = NULL
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL DEFAULT '',
+            sku TEXT NOT NULL DEFAULT '',
+            period TEXT NOT NULL DEFAULT '',
+            quantity INTEGER NOT NULL DEFAULT 1,
+            price NUMERIC(12, 2) NOT NULL DEFAULT 0,
+            amount NUMERIC(12, 2) NOT NULL DEFAULT 0,
+            options JSONB,
+            PRIMARY KEY (order_id, position)
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS order_items_sku_idx ON order_items (sku)
+    """)
+    
+    # Входящие вебхуки: сохраняются как есть и разбираются фоновым обработчиком.
+    # Пока запись обрабатывается, next_attempt_at служит сроком аренды:
+    # если процесс упал, запись снова станет доступной после него.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS webhook_inbox (
+            id BIGSERIAL PRIMARY KEY,
+            received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            order_id INTEGER
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS webhook_inbox_next_attempt_idx
+        ON webhook_inbox (next_attempt_at)
+        WHERE status IN ('pending', 'processing')
+    """)
+    
+    # Кэш ответов DaData; data = NULL означает «компания не найдена»
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS company_cache (
+            inn TEXT PRIMARY KEY,
+            data TEXT,
+            fetched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Готовые PDF счетов; content_hash — хэш данных, из которых собран PDF
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pdf_cache (
+            order_id INTEGER PRIMARY KEY REFERENCES orders(id) ON DELETE CASCADE,
+            content_hash TEXT NOT NULL,
+            pdf BYTEA NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Фоновый рендер PDF после сохранения реквизитов, по одной задаче
+    # на заказ. queued_at меняется при повторной постановке: результат
+    # рендера по устаревшим данным задачу не закрывает.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS render_jobs (
+            order_id INTEGER PRIMARY KEY REFERENCES orders(id) ON DELETE CASCADE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            queued_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS render_jobs_next_attempt_idx
+        ON render_jobs (next_attempt_at)
+        WHERE status IN ('pending', 'processing')
+    """)
+    
+    # Триграммы для поискового индекса (см. ORDER_INDEXES)
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    
+    # Поступления из банковских выписок (bank_import.py). Уникальный ключ
+    # не даёт загрузить одну платёжку дважды из пересекающихся выписок;
+    # status: new — ещё не сопоставлена, matched / unmatched — результат.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            id BIGSERIAL PRIMARY KEY,
+            doc_number TEXT NOT NULL,
+            doc_date DATE NOT NULL,
+            received_date DATE,
+            amount NUMERIC(12, 2) NOT NULL,
+            payer_inn TEXT NOT NULL DEFAULT '',
+            payer_name TEXT NOT NULL DEFAULT '',
+            payer_account TEXT NOT NULL DEFAULT '',
+            purpose TEXT NOT NULL DEFAULT '',
+            status TEXT NOT NULL DEFAULT 'new',
+            note TEXT,
+            imported_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (doc_date, doc_number, payer_account, amount)
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS payments_status_idx
+        ON payments (status) WHERE status <> 'matched'
+    """)
+    
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'orders'
+    """)
+    return {row["column_name"] for row in cursor.fetchall()}
+
+
+# Индексы orders: имя -> оператор CREATE INDEX CONCURRENTLY.
+# Строятся через CREATE INDEX CONCURRENTLY вне транзакции схемы: обычный
+# CREATE INDEX (тем более GIN по большой таблице) блокировал бы запись
+# в orders на всё время сборки.
+ORDER_INDEXES = {
+    # keyset-пагинация и фильтры админки
+    "orders_created_at_id_idx": (
+        "CREATE INDEX CONCURRENTLY {name} ON orders (created_at DESC, id DESC)"
+    ),
+    "orders_status_created_at_idx": (
+        "CREATE INDEX CONCURRENTLY {name} ON orders (status, created_at DESC, id DESC)"
+    ),
+    "orders_company_inn_created_at_idx": (
+        "CREATE INDEX CONCURRENTLY {name} ON orders (company_inn, created_at DESC, id DESC)"
+    ),
+    # повторный вебхук Тильды не создаёт второй заказ
+    "orders_tilda_order_id_key": (
+        "CREATE UNIQUE INDEX CONCURRENTLY {name} ON orders (tilda_order_id)"
+    ),
+    # поиск в админке: GIN по tsvector и по триграммам (pg_trgm)
+    "orders_search_tsv_idx": (
+        "CREATE INDEX CONCURRENTLY {name} "
+        f"ON orders USING GIN (({ORDER_SEARCH_TSV}))"
+    ),
+    "orders_search_trgm_idx": (
+        "CREATE INDEX CONCURRENTLY {name} "
+        f"ON orders USING GIN (({ORDER_SEARCH_TEXT}) gin_trgm_ops)"
+    ),
+    # отчёт по неоплаченным счетам
+    "orders_unpaid_created_at_idx": (
+        "CREATE INDEX CONCURRENTLY {name} ON orders (created_at) WHERE status <> 'paid'"
+    ),
+}
 
 
-def get_next_invoice_number(prefix: str = "СЧ", start_number: int = 1) -> str:
-    """Генерация номера счёта"""
-    conn = get_connection()
-    cursor = conn.cursor()
+def _create_order_indexes():
+    """Недостающие индексы ORDER_INDEXES, по одному CREATE INDEX CONCURRENTLY
+    
+    Прерванная сборка оставляет невалидный индекс: он удаляется и строится
+    заново. Уже построенные индексы не трогаются.
+    """
+    with get_connection() as conn:
+        # CONCURRENTLY нельзя выполнять внутри транзакции
+        conn.autocommit = True
+        try:
+            cursor = conn.cursor()
+            for name, statement in ORDER_INDEXES.items():
+                cursor.execute(
+                    "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,)
+                )
+                row = cursor.fetchone()
+                if row and row["indisvalid"]:
+                    continue
+                if row:
+                    logger.warning("Index %s is invalid (interrupted build), rebuilding", name)
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                
+                start = time.perf_counter()
+                cursor.execute(statement.replace("{name}", name))
+                logger.info("Built index %s in %.1fs", name, time.perf_counter() - start)
+        finally:
+            conn.autocommit = False
+
+
+def _install_triggers(cursor, function: str, triggers: tuple, statements: list,
+                      force: bool = False) -> bool:
+    """Функция и триггеры orders, если их определение изменилось
+    
+    statements — CREATE OR REPLACE FUNCTION, DROP и CREATE TRIGGER. Хэш
+    их текста хранится в комментарии функции; если он совпадает и все
+    триггеры на месте, ничего не выполняется: DROP/CREATE TRIGGER
+    блокирует запись в orders и ждал бы в очереди за долгими запросами.
+    """
+    digest = hashlib.sha1("\n".join(statements).encode("utf-8")).hexdigest()
+    cursor.execute("""
+        SELECT obj_description(to_regproc(%s), 'pg_proc') AS digest,
+               (SELECT count(*) FROM pg_trigger
+                WHERE tgrelid = 'orders'::regclass AND tgname = ANY(%s)) AS triggers
+    """, (function, list(triggers)))
+    row = cursor.fetchone()
+    if not force and row["digest"] == digest and row["triggers"] == len(triggers):
+        return False
     
-    today = datetime.now().strftime("%Y%m%d")
+    for statement in statements:
+        cursor.execute(statement)
+    cursor.execute(f"COMMENT ON FUNCTION {function}() IS %s", (digest,))
+    logger.info("Installed triggers %s", ", ".join(triggers))
+    return True
+
+
+def _init_order_notify(cursor):
+    """Триггер NOTIFY на новые и изменённые заказы для живой админки
     
-    cursor.execute(
-        "SELECT COUNT(*) as cnt FROM orders WHERE invoice_number LIKE %s",
-        (f"{prefix}-{today}%",)
+    В сообщении — поля строки списка заказов, чтобы слушателю не нужно
+    было перечитывать заказ. Тексты обрезаются: NOTIFY длиннее 8000 байт
+    отменил бы саму транзакцию с заказом.
+    """
+    statements = []
+    statements.append(f"""
+        CREATE OR REPLACE FUNCTION orders_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{ORDERS_CHANNEL}', json_build_object(
+                'op', TG_OP,
+                'id', NEW.id,
+                'invoice_number', NEW.invoice_number,
+                'created_at', NEW.created_at,
+                'status', NEW.status,
+                'total_amount', COALESCE(NEW.total, NEW.total_amount::numeric(12, 2)),
+                'currency', NEW.currency,
+                'customer_name', left(NEW.customer_name, 200),
+                'company_name', left(NEW.company_name, 300),
+                'company_inn', NEW.company_inn
+            )::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    statements.append("DROP TRIGGER IF EXISTS orders_notify_trigger ON orders")
+    statements.append("DROP TRIGGER IF EXISTS orders_notify_update_trigger ON orders")
+    # В WHEN триггера на INSERT нельзя ссылаться на OLD, поэтому их два
+    statements.append("""
+        CREATE TRIGGER orders_notify_trigger
+        AFTER INSERT ON orders
+        FOR EACH ROW EXECUTE FUNCTION orders_notify()
+    """)
+    # UPDATE, не изменивший ни одного поля из сообщения (например, повторное
+    # сохранение тех же реквизитов), не рассылается всем открытым админкам
+    statements.append("""
+        CREATE TRIGGER orders_notify_update_trigger
+        AFTER UPDATE OF
+            invoice_number, created_at, status, total, total_amount, currency,
+            customer_name, company_name, company_inn
+        ON orders
+        FOR EACH ROW
+        WHEN ((OLD.invoice_number, OLD.created_at, OLD.status, OLD.total, OLD.total_amount,
+               OLD.currency, OLD.customer_name, OLD.company_name, OLD.company_inn)
+              IS DISTINCT FROM
+              (NEW.invoice_number, NEW.created_at, NEW.status, NEW.total, NEW.total_amount,
+               NEW.currency, NEW.customer_name, NEW.company_name, NEW.company_inn))
+        EXECUTE FUNCTION orders_notify()
+    """)
+    _install_triggers(
+        cursor, "orders_notify", ("orders_notify_trigger", "orders_notify_update_trigger"),
+        statements
     )
-    result = cursor.fetchone()
-    count = result['cnt'] if result else 0
+
+
+# Сумма заказа для триггера статистики (NEW/OLD — строка orders)
+_STATS_TOTAL = "COALESCE({row}.total, {row}.total_amount::numeric(12, 2), 0)"
+
+
+def _init_order_stats(cursor):
+    """Сводные таблицы для отчётов и триггер, который держит их актуальными
+    
+    Триггер на каждое изменение заказа дописывает в order_stats_delta
+    строку с минусом для старых значений и строку с плюсом для новых.
+    Общие строки сводки он не трогает: иначе встречные смены статуса за
+    один день блокировали бы одни и те же строки в разном порядке
+    (взаимоблокировки) и ждали бы друг друга до commit. Изменения сворачивает
+    в сводку обслуживание (fold_order_stats), а отчёт читает сводку вместе
+    с ещё не свёрнутыми изменениями. Суммы в разных валютах не складываются:
+    валюта входит в ключ сводки.
+    """
+    # Сводка без валюты (до её появления в ключе) пересоздаётся с нуля
+    cursor.execute("""
+        SELECT to_regclass('order_stats_daily') IS NULL OR NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'order_stats_customer' AND column_name = 'currency'
+        ) AS missing
+    """)
+    missing = cursor.fetchone()["missing"]
+    if missing:
+        cursor.execute("DROP TABLE IF EXISTS order_stats_daily, order_stats_customer")
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_stats_daily (
+            day DATE NOT NULL,
+            status TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            orders_count INTEGER NOT NULL DEFAULT 0,
+            revenue NUMERIC(14, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, status, currency)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_stats_customer (
+            company_inn TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            company_name TEXT,
+            orders_count INTEGER NOT NULL DEFAULT 0,
+            revenue NUMERIC(14, 2) NOT NULL DEFAULT 0,
+            paid NUMERIC(14, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (company_inn, currency)
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS order_stats_customer_revenue_idx
+        ON order_stats_customer (currency, revenue DESC)
+    """)
+    # Ещё не свёрнутые изменения; company_inn = '' — заказ без компании
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_stats_delta (
+            id BIGSERIAL PRIMARY KEY,
+            day DATE NOT NULL,
+            status TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            company_inn TEXT NOT NULL,
+            company_name TEXT,
+            orders_count INTEGER NOT NULL,
+            revenue NUMERIC(14, 2) NOT NULL,
+            paid NUMERIC(14, 2) NOT NULL
+        )
+    """)
+    
+    old_total = _STATS_TOTAL.format(row="OLD")
+    new_total = _STATS_TOTAL.format(row="NEW")
+    statements = []
+    statements.append(f"""
+        CREATE OR REPLACE FUNCTION orders_stats_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO order_stats_delta
+                    (day, status, currency, company_inn, company_name, orders_count, revenue, paid)
+                VALUES (
+                    OLD.created_at::date, COALESCE(OLD.status, 'new'), OLD.currency,
+                    COALESCE(OLD.company_inn, ''), NULL, -1, -{old_total},
+                    CASE WHEN OLD.status = 'paid' THEN -{old_total} ELSE 0 END
+                );
+            END IF;
+            
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO order_stats_delta
+                    (day, status, currency, company_inn, company_name, orders_count, revenue, paid)
+                VALUES (
+                    NEW.created_at::date, COALESCE(NEW.status, 'new'), NEW.currency,
+                    COALESCE(NEW.company_inn, ''), NEW.company_name, 1, {new_total},
+                    CASE WHEN NEW.status = 'paid' THEN {new_total} ELSE 0 END
+                );
+            END IF;
+            
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    statements.append("DROP TRIGGER IF EXISTS orders_stats_trigger ON orders")
+    statements.append("DROP TRIGGER IF EXISTS orders_stats_update_trigger ON orders")
+    statements.append("""
+        CREATE TRIGGER orders_stats_trigger
+        AFTER INSERT OR DELETE ON orders
+        FOR EACH ROW EXECUTE FUNCTION orders_stats_apply()
+    """)
+    # UPDATE без изменения полей сводки (например, повторная запись тех же
+    # реквизитов) не оставляет пару взаимно гасящих строк
+    statements.append("""
+        CREATE TRIGGER orders_stats_update_trigger
+        AFTER UPDATE OF
+            status, total, total_amount, company_inn, company_name, created_at, currency
+        ON orders
+        FOR EACH ROW
+        WHEN ((OLD.status, OLD.total, OLD.total_amount, OLD.company_inn,
+               OLD.company_name, OLD.created_at::date, OLD.currency)
+              IS DISTINCT FROM
+              (NEW.status, NEW.total, NEW.total_amount, NEW.company_inn,
+               NEW.company_name, NEW.created_at::date, NEW.currency))
+        EXECUTE FUNCTION orders_stats_apply()
+    """)
+    
+    # Без сводки триггеры пересоздаются вместе с её пересчётом в одной
+    # транзакции, иначе изменения между ними потерялись бы
+    _install_triggers(
+        cursor, "orders_stats_apply", ("orders_stats_trigger", "orders_stats_update_trigger"),
+        statements, force=missing
+    )
+    
+    if missing:
+        _rebuild_order_stats(cursor)
+
+
+def _rebuild_order_stats(cursor):
+    """Пересчёт сводных таблиц с нуля по всем заказам"""
+    # Блокируем запись в orders на время пересчёта, чтобы не потерять изменения
+    cursor.execute("LOCK TABLE orders IN SHARE MODE")
+    cursor.execute("TRUNCATE order_stats_daily, order_stats_customer, order_stats_delta")
+    
+    total = _STATS_TOTAL.format(row="orders")
+    cursor.execute(f"""
+        INSERT INTO order_stats_daily (day, status, currency, orders_count, revenue)
+        SELECT created_at::date, COALESCE(status, 'new'), currency, COUNT(*), SUM({total})
+        FROM orders
+        GROUP BY 1, 2, 3
+    """)
+    cursor.execute(f"""
+        INSERT INTO order_stats_customer
+            (company_inn, currency, company_name, orders_count, revenue, paid)
+        SELECT company_inn,
+               currency,
+               (array_agg(company_name ORDER BY id DESC))[1],
+               COUNT(*),
+               SUM({total}),
+               SUM(CASE WHEN status = 'paid' THEN {total} ELSE 0 END)
+        FROM orders
+        WHERE COALESCE(company_inn, '') <> ''
+        GROUP BY company_inn, currency
+    """)
+
+
+# Сводка по дням вместе с ещё не свёрнутыми изменениями (для отчётов)
+_STATS_DAILY = """(
+    SELECT day, status, currency, orders_count, revenue FROM order_stats_daily
+    UNION ALL
+    SELECT day, status, currency, orders_count, revenue FROM order_stats_delta
+) AS stats"""
+
+
+@timed(DB_QUERY_SECONDS)
+def fold_order_stats() -> int:
+    """Перенос накопленных изменений из order_stats_delta в сводку
+    
+    Выполняет один процесс (лидер обслуживания), поэтому строки сводки
+    обновляются одним запросом без встречных блокировок. Изменения из ещё
+    не завершённых транзакций не видны и останутся до следующего раза.
+    Возвращает число свёрнутых строк.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            WITH moved AS (
+                DELETE FROM order_stats_delta RETURNING *
+            ),
+            daily AS (
+                INSERT INTO order_stats_daily AS s (day, status, currency, orders_count, revenue)
+                SELECT day, status, currency, SUM(orders_count), SUM(revenue)
+                FROM moved
+                GROUP BY day, status, currency
+                ON CONFLICT (day, status, currency) DO UPDATE
+                SET orders_count = s.orders_count + EXCLUDED.orders_count,
+                    revenue = s.revenue + EXCLUDED.revenue
+            ),
+            customers AS (
+                INSERT INTO order_stats_customer AS c
+                    (company_inn, currency, company_name, orders_count, revenue, paid)
+                SELECT company_inn, currency,
+                       (array_agg(company_name ORDER BY id DESC)
+                            FILTER (WHERE company_name IS NOT NULL))[1],
+                       SUM(orders_count), SUM(revenue), SUM(paid)
+                FROM moved
+                WHERE company_inn <> ''
+                GROUP BY company_inn, currency
+                ON CONFLICT (company_inn, currency) DO UPDATE
+                SET company_name = COALESCE(EXCLUDED.company_name, c.company_name),
+                    orders_count = c.orders_count + EXCLUDED.orders_count,
+                    revenue = c.revenue + EXCLUDED.revenue,
+                    paid = c.paid + EXCLUDED.paid
+            )
+            SELECT COUNT(*) AS folded FROM moved
+        """)
+        return cursor.fetchone()["folded"]
+
+
+@timed(DB_QUERY_SECONDS)
+def rebuild_order_stats():
+    """Пересчёт статистики для отчётов (если сводка разошлась с данными)"""
+    with get_connection() as conn:
+        _rebuild_order_stats(conn.cursor())
+
+
+def get_next_invoice_number(cursor, prefix: str = "СЧ", start_number: int = 1) -> str:
+    """Генерация номера счёта
+    
+    Вызывается внутри транзакции создания заказа: строка счётчика остаётся
+    заблокированной до commit, поэтому параллельные заказы получают номера
+    строго по очереди, а при rollback номер не теряется.
+    """
+    today = datetime.now()
+    
+    cursor.execute("""
+        INSERT INTO invoice_counters (prefix, day, last_number)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (prefix, day)
+        DO UPDATE SET last_number = invoice_counters.last_number + 1
+        RETURNING last_number
+    """, (prefix, today.date(), start_number))
+    number = cursor.fetchone()['last_number']
+    
+    return f"{prefix}-{today.strftime('%Y%m%d')}-{number:03d}"
+
+
+# total_amount читается из NUMERIC-колонки total; REAL-колонка — запасной
+# вариант для строк, которые migrate.py ещё не перенёс
+ORDER_TOTAL_SQL = "COALESCE(total, total_amount::numeric(12, 2)) AS total_amount"
+
+# Колонки заказа целиком (products — только у ещё не перенесённых строк)
+ORDER_COLUMNS = f"""
+    id, invoice_number, created_at, status, {ORDER_TOTAL_SQL},
+    customer_name, customer_email, customer_phone,
+    company_name, company_inn, company_kpp, company_address,
+    tilda_order_id, currency, promocode, discount, products
+"""
+
+# Колонки для списка заказов (без товаров)
+ORDER_LIST_COLUMNS = f"""
+    id, invoice_number, created_at, status, {ORDER_TOTAL_SQL},
+    customer_name, customer_email, customer_phone,
+    company_name, company_inn, currency
+"""
+
+
+def _save_items(cursor, order_id: int, products: list):
+    """Запись товаров заказа в order_items"""
+    if not products:
+        return
+    execute_values(cursor, """
+        INSERT INTO order_items (
+            order_id, position, name, sku, period, quantity, price, amount, options
+        ) VALUES %s
+    """, [
+        (
+            order_id,
+            position,
+            product.get("name", ""),
+            product.get("sku", "") or "",
+            product.get("period", "") or "",
+            product.get("quantity", 1),
+            product.get("price", 0),
+            product.get("amount", 0),
+            dump_products(product["options"]) if product.get("options") else None,
+        )
+        for position, product in enumerate(products, 1)
+    ])
+
+
+def _attach_products(cursor, orders: list):
+    """Товары для списка заказов: одним запросом к order_items"""
+    ids = []
+    for order in orders:
+        legacy = order.pop("products", None)
+        if legacy is not None:
+            order["products"] = load_products(legacy)
+        else:
+            order["products"] = []
+            ids.append(order["id"])
     
-    conn.close()
+    if not ids:
+        return
     
-    number = start_number + count
-    return f"{prefix}-{today}-{number:03d}"
+    cursor.execute("""
+        SELECT order_id, name, sku, period, quantity, price, amount, options
+        FROM order_items
+        WHERE order_id = ANY(%s)
+        ORDER BY order_id, position
+    """, (ids,))
+    
+    by_id = {order["id"]: order for order in orders}
+    for row in cursor.fetchall():
+        product = {
+            "name": row["name"],
+            "quantity": row["quantity"],
+            "price": row["price"],
+            "amount": row["amount"],
+            "sku": row["sku"],
+            "period": row["period"],
+        }
+        if row["options"]:
+            product["options"] = row["options"]
+        by_id[row["order_id"]]["products"].append(product)
 
 
+@timed(DB_QUERY_SECONDS)
 def create_order(
     products: list,
     total_amount: float,
@@ -71,113 +882,976 @@ def create_order(
     customer_email: str,
     customer_phone: str,
     invoice_prefix: str = "СЧ",
-    start_number: int = 1
+    start_number: int = 1,
+    tilda_order_id: Optional[str] = None,
+    currency: str = "RUB",
+    promocode: str = "",
+    discount: Decimal = Decimal("0")
 ) -> int:
-    """Создание заказа"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    invoice_number = get_next_invoice_number(invoice_prefix, start_number)
-    
-    cursor.execute("""
-        INSERT INTO orders (
-            invoice_number, products, total_amount,
-            customer_name, customer_email, customer_phone
-        ) VALUES (%s, %s, %s, %s, %s, %s)
-        RETURNING id
-    """, (
-        invoice_number,
-        json.dumps(products, ensure_ascii=False),
-        total_amount,
-        customer_name,
-        customer_email,
-        customer_phone
-    ))
-    
-    order_id = cursor.fetchone()['id']
-    conn.commit()
-    conn.close()
-    
-    print(f"Created order {order_id}: {invoice_number}")
+    """Создание заказа
+    
+    Если заказ с таким tilda_order_id уже есть, возвращает его ID.
+    """
+    tilda_order_id = tilda_order_id or None
+    
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        if tilda_order_id:
+            # Блокировка на время транзакции: параллельные повторы одного
+            # вебхука ждут здесь, а не падают на уникальном индексе
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (tilda_order_id,))
+            cursor.execute(
+                "SELECT id FROM orders WHERE tilda_order_id = %s", (tilda_order_id,)
+            )
+            row = cursor.fetchone()
+            if row:
+                logger.info("Order for Tilda %s already exists: %s", tilda_order_id, row['id'])
+                return row['id']
+        
+        invoice_number = get_next_invoice_number(cursor, invoice_prefix, start_number)
+        
+        cursor.execute("""
+            INSERT INTO orders (
+                invoice_number, total, total_amount,
+                customer_name, customer_email, customer_phone,
+                tilda_order_id, currency, promocode, discount
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        """, (
+            invoice_number,
+            total_amount,
+            total_amount,
+            customer_name,
+            customer_email,
+            customer_phone,
+            tilda_order_id,
+            currency,
+            promocode,
+            discount
+        ))
+        
+        order_id = cursor.fetchone()['id']
+        _save_items(cursor, order_id, products)
+    
+    logger.info("Created order %s: %s", order_id, invoice_number)
     return order_id
 
 
+@timed(DB_QUERY_SECONDS)
 def get_order(order_id: int) -> Optional[dict]:
     """Получение заказа по ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM orders WHERE id = %s", (order_id,))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {ORDER_COLUMNS} FROM orders WHERE id = %s", (order_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        
         order = dict(row)
-        order["products"] = json.loads(order["products"]) if order["products"] else []
-        return order
-    return None
+        _attach_products(cursor, [order])
+    
+    return order
 
 
+@timed(DB_QUERY_SECONDS)
 def get_all_orders() -> list:
     """Получение всех заказов"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {ORDER_COLUMNS} FROM orders ORDER BY created_at DESC")
+        orders = [dict(row) for row in cursor.fetchall()]
+        _attach_products(cursor, orders)
     
-    cursor.execute("SELECT * FROM orders ORDER BY created_at DESC")
-    rows = cursor.fetchall()
-    conn.close()
+    return orders
+
+
+def _search_condition(query: str) -> Optional[tuple]:
+    """Условие поиска заказа и его параметры (None — искать нечего)
     
-    orders = []
-    for row in rows:
-        order = dict(row)
-        order["products"] = json.loads(order["products"]) if order["products"] else []
-        orders.append(order)
+    Слова запроса ищутся по началу в tsvector, вся строка — как подстрока
+    по триграммам. Строку короче трёх символов триграммный индекс не
+    ускоряет, поэтому для неё остаётся только поиск по словам.
+    """
+    conditions = []
+    params = []
     
-    return orders
+    words = re.findall(r"[^\W_]+", query.lower())
+    if words:
+        conditions.append(f"{ORDER_SEARCH_TSV} @@ to_tsquery('russian', %s)")
+        params.append(" & ".join(f"{word}:*" for word in words))
+    
+    text = query.strip().lower()
+    if len(text) >= 3:
+        pattern = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append(f"{ORDER_SEARCH_TEXT} LIKE %s")
+        params.append(f"%{pattern}%")
+    
+    if not conditions:
+        return None
+    return f"({' OR '.join(conditions)})", params
 
 
-def update_order(order_id: int, data: dict) -> bool:
-    """Обновление заказа"""
-    conn = get_connection()
-    cursor = conn.cursor()
+def _order_filters(
+    status: Optional[str] = None,
+    inn: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    customer: Optional[str] = None,
+    q: Optional[str] = None,
+) -> tuple:
+    """Условия WHERE и параметры для фильтров списка заказов"""
+    conditions = []
+    params = []
+    
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    if inn:
+        conditions.append("company_inn = %s")
+        params.append(inn)
+    if date_from:
+        conditions.append("created_at >= %s")
+        params.append(date_from)
+    if date_to:
+        # Включительно: до начала следующего дня
+        conditions.append("created_at < %s")
+        params.append(date_to + timedelta(days=1))
+    if customer:
+        conditions.append(
+            "(customer_name ILIKE %s OR customer_email ILIKE %s OR company_name ILIKE %s)"
+        )
+        pattern = f"%{customer}%"
+        params.extend([pattern, pattern, pattern])
+    if q:
+        search = _search_condition(q)
+        if search:
+            conditions.append(search[0])
+            params.extend(search[1])
+    
+    return conditions, params
+
+
+def encode_cursor(order: dict) -> str:
+    """Курсор страницы: позиция последнего заказа в сортировке"""
+    return f"{order['created_at'].isoformat()}|{order['id']}"
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Разбор курсора страницы, ValueError если он испорчен"""
+    created_at, order_id = cursor.rsplit("|", 1)
+    return datetime.fromisoformat(created_at), int(order_id)
+
+
+@timed(DB_QUERY_SECONDS)
+def list_orders(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    with_products: bool = False,
+    **filters
+) -> tuple:
+    """Страница заказов (новые сверху) и курсор следующей страницы
+    
+    Пагинация по (created_at, id), поэтому стоимость страницы не зависит
+    от того, насколько далеко она от начала списка.
+    """
+    conditions, params = _order_filters(**filters)
+    
+    if cursor:
+        conditions.append("(created_at, id) < (%s, %s)")
+        params.extend(decode_cursor(cursor))
+    
+    columns = ORDER_COLUMNS if with_products else ORDER_LIST_COLUMNS
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    with get_connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.execute(f"""
+            SELECT {columns} FROM orders
+            {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, params + [limit + 1])
+        rows = db_cursor.fetchall()
+        
+        orders = [dict(row) for row in rows[:limit]]
+        if with_products:
+            _attach_products(db_cursor, orders)
+    
+    next_cursor = encode_cursor(orders[-1]) if len(rows) > limit else None
+    return orders, next_cursor
+
+
+def iter_orders_with_items(batch_size: int = 5000, **filters):
+    """Заказы с товарами по возрастанию id для выгрузки
+    
+    Строки читаются серверным (именованным) курсором по batch_size за раз,
+    в памяти — только текущая пачка, поэтому объём выгрузки не ограничен.
+    Соединение из пула занято, пока генератор не исчерпан или не закрыт.
+    """
+    conditions, params = _order_filters(**filters)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    with get_connection() as conn:
+        with conn.cursor(name="orders_export") as cursor:
+            cursor.itersize = batch_size
+            # Порядок по первичным ключам: merge join orders с order_items
+            # без сортировки, первые строки приходят сразу
+            cursor.execute(f"""
+                SELECT o.*,
+                       i.position AS item_position, i.name AS item_name,
+                       i.sku AS item_sku, i.period AS item_period,
+                       i.quantity AS item_quantity, i.price AS item_price,
+                       i.amount AS item_amount
+                FROM (SELECT {ORDER_COLUMNS} FROM orders {where}) o
+                LEFT JOIN order_items i ON i.order_id = o.id
+                ORDER BY o.id, i.position
+            """, params)
+            
+            order = None
+            for row in cursor:
+                if order is None or order["id"] != row["id"]:
+                    if order is not None:
+                        yield order
+                    order = {k: v for k, v in row.items() if not k.startswith("item_")}
+                    order["products"] = load_products(order["products"])
+                
+                if row["item_position"] is not None:
+                    order["products"].append({
+                        "name": row["item_name"],
+                        "sku": row["item_sku"],
+                        "period": row["item_period"],
+                        "quantity": row["item_quantity"],
+                        "price": row["item_price"],
+                        "amount": row["item_amount"],
+                    })
+            
+            if order is not None:
+                yield order
+
+
+@timed(DB_QUERY_SECONDS)
+def suggest_orders(query: str, limit: int, timeout_ms: int) -> list:
+    """Заказы для подсказок поиска, новые сверху
+    
+    Если запрос не уложился в timeout_ms, возвращается пустой список:
+    подсказка, пришедшая позже следующего нажатия клавиши, не нужна.
+    """
+    search = _search_condition(query)
+    if search is None:
+        return []
+    condition, params = search
     
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+        try:
+            cursor.execute(f"""
+                SELECT id, invoice_number, created_at, status,
+                       company_name, company_inn, customer_name, customer_email
+                FROM orders
+                WHERE {condition}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """, params + [limit])
+        except psycopg2.errors.QueryCanceled:
+            conn.rollback()
+            logger.warning("Search suggestions for %r timed out", query)
+            return []
+        return [dict(row) for row in cursor.fetchall()]
+
+
+@timed(DB_QUERY_SECONDS)
+def estimate_orders_count(**filters) -> int:
+    """Оценка числа заказов по статистике планировщика (без COUNT(*))"""
+    conditions, params = _order_filters(**filters)
+    
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        if not conditions:
+            cursor.execute(
+                "SELECT reltuples::bigint AS estimate FROM pg_class WHERE oid = 'orders'::regclass"
+            )
+            return max(cursor.fetchone()["estimate"], 0)
+        
+        cursor.execute(
+            f"EXPLAIN (FORMAT JSON) SELECT 1 FROM orders WHERE {' AND '.join(conditions)}",
+            params
+        )
+        plan = cursor.fetchone()["QUERY PLAN"]
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _update_order(cursor, order_id: int, data: dict) -> bool:
     fields = []
     values = []
     
     for key, value in data.items():
-        if key not in ['id', 'created_at', 'invoice_number']:
+        if key not in ['id', 'created_at', 'invoice_number', 'products']:
             fields.append(f"{key} = %s")
-            if key == 'products':
-                values.append(json.dumps(value, ensure_ascii=False))
-            else:
-                values.append(value)
+            values.append(value)
+        if key == 'total_amount':
+            fields.append("total = %s")
+            values.append(value)
+    
+    if 'products' in data:
+        fields.append("products = NULL")
     
     if not fields:
         return False
     
     values.append(order_id)
     query = f"UPDATE orders SET {', '.join(fields)} WHERE id = %s"
-    
     cursor.execute(query, values)
-    conn.commit()
-    conn.close()
+    
+    if 'products' in data:
+        cursor.execute("DELETE FROM order_items WHERE order_id = %s", (order_id,))
+        _save_items(cursor, order_id, data['products'])
+    
+    # Смена статуса не влияет на содержимое PDF, остальные поля — влияют
+    if set(data) - {"status"}:
+        cursor.execute("DELETE FROM pdf_cache WHERE order_id = %s", (order_id,))
     
     return True
 
+
+@timed(DB_QUERY_SECONDS)
+def update_order(order_id: int, data: dict) -> bool:
+    """Обновление заказа"""
+    with get_connection() as conn:
+        return _update_order(conn.cursor(), order_id, data)
+
+@timed(DB_QUERY_SECONDS)
 def update_order_company(order_id: int, company_name: str, company_inn: str, 
                           company_kpp: str, company_address: str) -> bool:
-    """Обновление данных компании в заказе"""
-    return update_order(order_id, {
-        "company_name": company_name,
-        "company_inn": company_inn,
-        "company_kpp": company_kpp,
-        "company_address": company_address
-    })
+    """Обновление данных компании в заказе
+    
+    В той же транзакции ставит задачу на фоновый рендер PDF, чтобы к
+    моменту скачивания счёт уже лежал в pdf_cache.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        _update_order(cursor, order_id, {
+            "company_name": company_name,
+            "company_inn": company_inn,
+            "company_kpp": company_kpp,
+            "company_address": company_address
+        })
+        _enqueue_render(cursor, order_id)
+    return True
 
 
+@timed(DB_QUERY_SECONDS)
 def mark_pdf_generated(order_id: int) -> bool:
-    """Отметка что PDF сгенерирован"""
-    return update_order(order_id, {
-        "status": "pdf_generated"
-    })
+    """Отметка что PDF сгенерирован (только для новых и ещё не отрендеренных)"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE orders SET status = 'pdf_generated'
+            WHERE id = %s AND status IN ('new', 'rendering')
+        """, (order_id,))
+        return cursor.rowcount > 0
 
+
+def _enqueue_render(cursor, order_id: int):
+    """Задача на рендер PDF; повторная постановка сбрасывает попытки"""
+    cursor.execute("""
+        INSERT INTO render_jobs (order_id) VALUES (%s)
+        ON CONFLICT (order_id) DO UPDATE
+        SET status = 'pending',
+            attempts = 0,
+            next_attempt_at = CURRENT_TIMESTAMP,
+            queued_at = CURRENT_TIMESTAMP,
+            last_error = NULL
+    """, (order_id,))
+    # Оплаченные и прочие «дальние» статусы рендер не откатывает
+    cursor.execute("""
+        UPDATE orders SET status = 'rendering'
+        WHERE id = %s AND status IN ('new', 'pdf_generated')
+    """, (order_id,))
+
+
+@timed(DB_QUERY_SECONDS)
+def claim_render_jobs(limit: int, lease_seconds: int) -> list:
+    """Захват пачки задач рендера (как claim_webhooks)"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE render_jobs
+            SET status = 'processing',
+                attempts = attempts + 1,
+                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            WHERE order_id IN (
+                SELECT order_id FROM render_jobs
+                WHERE status IN ('pending', 'processing')
+                  AND next_attempt_at <= CURRENT_TIMESTAMP
+                ORDER BY next_attempt_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING order_id, attempts, queued_at
+        """, (lease_seconds, limit))
+        return [dict(row) for row in cursor.fetchall()]
+
+
+@timed(DB_QUERY_SECONDS)
+def complete_render_job(order_id: int, queued_at) -> bool:
+    """PDF готов: закрыть задачу и перевести заказ в pdf_generated
+    
+    Если задачу успели поставить заново (queued_at изменился), она
+    остаётся в очереди, а статус заказа не меняется.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM render_jobs WHERE order_id = %s AND queued_at = %s",
+            (order_id, queued_at)
+        )
+        if cursor.rowcount == 0:
+            return False
+        cursor.execute("""
+            UPDATE orders SET status = 'pdf_generated'
+            WHERE id = %s AND status = 'rendering'
+        """, (order_id,))
+        return True
+
+
+@timed(DB_QUERY_SECONDS)
+def fail_render_job(order_id: int, queued_at, error: str, retry_in: Optional[int]):
+    """Ошибка рендера: повтор через retry_in секунд или отказ
+    
+    При отказе заказ возвращается в new — PDF соберётся при скачивании.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if retry_in is None:
+            cursor.execute("""
+                UPDATE render_jobs SET status = 'failed', last_error = %s
+                WHERE order_id = %s AND queued_at = %s
+            """, (error, order_id, queued_at))
+            if cursor.rowcount:
+                cursor.execute("""
+                    UPDATE orders SET status = 'new'
+                    WHERE id = %s AND status = 'rendering'
+                """, (order_id,))
+        else:
+            cursor.execute("""
+                UPDATE render_jobs
+                SET status = 'pending',
+                    last_error = %s,
+                    next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                WHERE order_id = %s AND queued_at = %s
+            """, (error, retry_in, order_id, queued_at))
+
+
+@timed(DB_QUERY_SECONDS)
+def get_cached_company(inn: str) -> Optional[dict]:
+    """Запись кэша DaData: {"data": dict | None, "age": секунды} или None"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT data, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - fetched_at) AS age
+            FROM company_cache WHERE inn = %s
+        """, (inn,))
+        row = cursor.fetchone()
+    
+    if row:
+        return {
+            "data": json.loads(row["data"]) if row["data"] else None,
+            "age": float(row["age"]),
+        }
+    return None
+
+
+@timed(DB_QUERY_SECONDS)
+def save_cached_company(inn: str, data: Optional[dict]):
+    """Сохранение ответа DaData в кэш (None — компания не найдена)"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO company_cache (inn, data, fetched_at)
+            VALUES (%s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (inn)
+            DO UPDATE SET data = EXCLUDED.data, fetched_at = EXCLUDED.fetched_at
+        """, (inn, json.dumps(data, ensure_ascii=False) if data else None))
+
+
+@timed(DB_QUERY_SECONDS)
+def get_cached_companies(inns: list) -> dict:
+    """Записи кэша DaData для многих ИНН одним запросом: {ИНН: {"data", "age"}}"""
+    if not inns:
+        return {}
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT inn, data, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - fetched_at) AS age
+            FROM company_cache WHERE inn = ANY(%s)
+        """, (list(inns),))
+        return {
+            row["inn"]: {
+                "data": json.loads(row["data"]) if row["data"] else None,
+                "age": float(row["age"]),
+            }
+            for row in cursor.fetchall()
+        }
+
+
+@timed(DB_QUERY_SECONDS)
+def save_cached_companies(companies: dict):
+    """Сохранение многих ответов DaData в кэш: {ИНН: компания или None}"""
+    if not companies:
+        return
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        execute_values(cursor, """
+            INSERT INTO company_cache (inn, data, fetched_at) VALUES %s
+            ON CONFLICT (inn)
+            DO UPDATE SET data = EXCLUDED.data, fetched_at = EXCLUDED.fetched_at
+        """, [
+            (inn, json.dumps(data, ensure_ascii=False) if data else None)
+            for inn, data in companies.items()
+        ], template="(%s, %s, CURRENT_TIMESTAMP)")
+
+
+# Заказы с ИНН, но без названия или адреса компании
+_MISSING_COMPANY_SQL = """
+    COALESCE(company_inn, '') <> ''
+    AND (COALESCE(company_name, '') = '' OR COALESCE(company_address, '') = '')
+"""
+
+
+@timed(DB_QUERY_SECONDS)
+def find_inns_to_enrich(after_inn: str, limit: int) -> list:
+    """Уникальные ИНН заказов без реквизитов, по возрастанию, после after_inn"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT DISTINCT company_inn FROM orders
+            WHERE {_MISSING_COMPANY_SQL} AND company_inn > %s
+            ORDER BY company_inn
+            LIMIT %s
+        """, (after_inn, limit))
+        return [row["company_inn"] for row in cursor.fetchall()]
+
+
+@timed(DB_QUERY_SECONDS)
+def fill_company_details(companies: dict) -> int:
+    """Заполнение пустых реквизитов заказов по ИНН одним UPDATE
+    
+    companies: {ИНН: {"name", "kpp", "address"}}. Уже заполненные поля
+    не перезаписываются. PDF обновлённых заказов удаляются из кэша.
+    Возвращает число обновлённых заказов.
+    """
+    if not companies:
+        return 0
+    rows = [
+        (inn, company.get("name", ""), company.get("kpp", ""), company.get("address", ""))
+        for inn, company in companies.items()
+    ]
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        result = execute_values(cursor, """
+            WITH updated AS (
+                UPDATE orders AS o SET
+                    company_name = COALESCE(NULLIF(o.company_name, ''), v.name),
+                    company_kpp = COALESCE(NULLIF(o.company_kpp, ''), v.kpp),
+                    company_address = COALESCE(NULLIF(o.company_address, ''), v.address)
+                FROM (VALUES %s) AS v (inn, name, kpp, address)
+                WHERE o.company_inn = v.inn
+                  AND (COALESCE(o.company_name, '') = '' OR COALESCE(o.company_address, '') = '')
+                RETURNING o.id
+            ), purged AS (
+                DELETE FROM pdf_cache WHERE order_id IN (SELECT id FROM updated)
+            )
+            SELECT COUNT(*) AS count FROM updated
+        """, rows, page_size=len(rows), fetch=True)
+        return result[0]["count"]
+
+
+@timed(DB_QUERY_SECONDS)
+def get_cached_pdf(order_id: int, content_hash: str) -> Optional[bytes]:
+    """Готовый PDF заказа, если он собран из тех же данных"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT pdf FROM pdf_cache WHERE order_id = %s AND content_hash = %s",
+            (order_id, content_hash)
+        )
+        row = cursor.fetchone()
+    
+    return bytes(row["pdf"]) if row else None
+
+
+@timed(DB_QUERY_SECONDS)
+def save_cached_pdf(order_id: int, content_hash: str, pdf: bytes):
+    """Сохранение готового PDF заказа"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO pdf_cache (order_id, content_hash, pdf, created_at)
+            VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (order_id) DO UPDATE
+            SET content_hash = EXCLUDED.content_hash,
+                pdf = EXCLUDED.pdf,
+                created_at = EXCLUDED.created_at
+        """, (order_id, content_hash, psycopg2.Binary(pdf)))
+
+
+@timed(DB_QUERY_SECONDS)
+def enqueue_webhook(payload) -> int:
+    """Сохранение входящего вебхука в очередь"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO webhook_inbox (payload) VALUES (%s) RETURNING id",
+            (json.dumps(payload, ensure_ascii=False, default=str),)
+        )
+        return cursor.fetchone()["id"]
+
+
+@timed(DB_QUERY_SECONDS)
+def claim_webhooks(limit: int, lease_seconds: int) -> list:
+    """Захват пачки вебхуков на обработку
+    
+    SKIP LOCKED позволяет нескольким обработчикам брать разные записи.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE webhook_inbox
+            SET status = 'processing',
+                attempts = attempts + 1,
+                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            WHERE id IN (
+                SELECT id FROM webhook_inbox
+                WHERE status IN ('pending', 'processing')
+                  AND next_attempt_at <= CURRENT_TIMESTAMP
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, payload, attempts
+        """, (lease_seconds, limit))
+        rows = cursor.fetchall()
+    
+    return [
+        {**dict(row), "payload": json.loads(row["payload"])}
+        for row in sorted(rows, key=lambda row: row["id"])
+    ]
+
+
+@timed(DB_QUERY_SECONDS)
+def complete_webhook(webhook_id: int, order_id: int):
+    """Вебхук обработан, заказ создан"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE webhook_inbox
+            SET status = 'done', order_id = %s, last_error = NULL
+            WHERE id = %s
+        """, (order_id, webhook_id))
+
+
+@timed(DB_QUERY_SECONDS)
+def fail_webhook(webhook_id: int, error: str, retry_in: Optional[int]):
+    """Ошибка обработки: повтор через retry_in секунд или окончательный отказ"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if retry_in is None:
+            cursor.execute("""
+                UPDATE webhook_inbox SET status = 'failed', last_error = %s
+                WHERE id = %s
+            """, (error, webhook_id))
+        else:
+            cursor.execute("""
+                UPDATE webhook_inbox
+                SET status = 'pending',
+                    last_error = %s,
+                    next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                WHERE id = %s
+            """, (error, retry_in, webhook_id))
+
+
+PAYMENT_COLUMNS = (
+    "doc_number", "doc_date", "received_date", "amount",
+    "payer_inn", "payer_name", "payer_account", "purpose",
+)
+
+
+@timed(DB_QUERY_SECONDS)
+def save_payments(payments: list) -> int:
+    """Запись поступлений из выписки одним INSERT, уже загруженные пропускаются
+    
+    Возвращает число новых платежей.
+    """
+    if not payments:
+        return 0
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        result = execute_values(cursor, f"""
+            INSERT INTO payments ({", ".join(PAYMENT_COLUMNS)}) VALUES %s
+            ON CONFLICT (doc_date, doc_number, payer_account, amount) DO NOTHING
+            RETURNING id
+        """, [
+            tuple(payment[column] for column in PAYMENT_COLUMNS)
+            for payment in payments
+        ], page_size=1000, fetch=True)
+        return len(result)
+
+
+@timed(DB_QUERY_SECONDS)
+def get_pending_payments(include_unmatched: bool = False) -> list:
+    """Ещё не сопоставленные платежи (и ранее не найденные, если include_unmatched)"""
+    statuses = ["new", "unmatched"] if include_unmatched else ["new"]
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT id, {", ".join(PAYMENT_COLUMNS)} FROM payments
+            WHERE status = ANY(%s)
+            ORDER BY COALESCE(received_date, doc_date), id
+        """, (statuses,))
+        return [dict(row) for row in cursor.fetchall()]
+
+
+@timed(DB_QUERY_SECONDS)
+def get_unpaid_orders() -> list:
+    """Все неоплаченные счета одним запросом — индекс для сопоставления платежей"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT id, invoice_number, company_inn, {ORDER_TOTAL_SQL}
+            FROM orders
+            WHERE status <> 'paid' AND invoice_number IS NOT NULL
+            ORDER BY created_at, id
+        """)
+        return [dict(row) for row in cursor.fetchall()]
+
+
+@timed(DB_QUERY_SECONDS)
+def apply_payment_matches(matched: dict, unmatched: dict) -> int:
+    """Результат сопоставления одной транзакцией
+    
+    matched: {id платежа: [id заказов]} — заказы переводятся в paid одним
+    UPDATE; unmatched: {id платежа: причина}. Заказы, которые успели
+    оплатить другим платежом, не трогаются. Возвращает число оплаченных заказов.
+    """
+    pairs = [
+        (order_id, payment_id)
+        for payment_id, order_ids in matched.items()
+        for order_id in order_ids
+    ]
+    statuses = [(payment_id, "matched", None) for payment_id in matched]
+    statuses += [(payment_id, "unmatched", note) for payment_id, note in unmatched.items()]
+    
+    paid = 0
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if pairs:
+            result = execute_values(cursor, """
+                WITH paid AS (
+                    UPDATE orders AS o SET status = 'paid', payment_id = v.payment_id
+                    FROM (VALUES %s) AS v (order_id, payment_id)
+                    WHERE o.id = v.order_id AND o.status <> 'paid'
+                    RETURNING o.id
+                )
+                SELECT COUNT(*) AS count FROM paid
+            """, pairs, page_size=len(pairs), fetch=True)
+            paid = result[0]["count"]
+        if statuses:
+            execute_values(cursor, """
+                UPDATE payments AS p SET status = v.status, note = v.note
+                FROM (VALUES %s) AS v (id, status, note)
+                WHERE p.id = v.id
+            """, statuses, page_size=1000)
+    
+    return paid
+
+
+@timed(DB_QUERY_SECONDS)
+def purge_stale_rows(
+    webhook_days: int, render_job_days: int, cache_ttl: int, negative_cache_ttl: int
+) -> dict:
+    """Удаление отработавших записей очередей и устаревшего кэша DaData
+    
+    Возвращает число удалённых строк по таблицам.
+    """
+    deleted = {}
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM webhook_inbox
+            WHERE status IN ('done', 'failed')
+              AND received_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+        """, (webhook_days,))
+        deleted["webhook_inbox"] = cursor.rowcount
+        
+        cursor.execute("""
+            DELETE FROM render_jobs
+            WHERE status = 'failed'
+              AND queued_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+        """, (render_job_days,))
+        deleted["render_jobs"] = cursor.rowcount
+        
+        # Просроченные записи всё равно не читаются (см. dadata_client)
+        cursor.execute("""
+            DELETE FROM company_cache
+            WHERE fetched_at < CURRENT_TIMESTAMP - make_interval(secs => CASE
+                WHEN data IS NULL THEN %s ELSE %s END)
+        """, (negative_cache_ttl, cache_ttl))
+        deleted["company_cache"] = cursor.rowcount
+    
+    return deleted
+
+
+@timed(DB_QUERY_SECONDS)
+def backfill_order_items(after_id: int, limit: int) -> Optional[int]:
+    """Перенос пачки старых заказов в order_items и NUMERIC-колонку total
+    
+    Берёт до limit заказов с id > after_id, у которых ещё есть products
+    или нет total, и переносит их одной короткой транзакцией. Возвращает
+    последний обработанный id или None, если переносить больше нечего.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            WITH batch AS (
+                SELECT id, products, total_amount FROM orders
+                WHERE id > %s AND (products IS NOT NULL OR total IS NULL)
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE
+            ), items AS (
+                INSERT INTO order_items (
+                    order_id, position, name, sku, period, quantity, price, amount, options
+                )
+                SELECT b.id,
+                       p.position,
+                       COALESCE(p.item->>'name', ''),
+                       COALESCE(p.item->>'sku', ''),
+                       COALESCE(p.item->>'period', ''),
+                       COALESCE(NULLIF(p.item->>'quantity', '')::numeric::int, 1),
+                       COALESCE(NULLIF(p.item->>'price', '')::numeric(12, 2), 0),
+                       COALESCE(NULLIF(p.item->>'amount', '')::numeric(12, 2), 0),
+                       p.item->'options'
+                FROM batch b,
+                     jsonb_array_elements(NULLIF(b.products, '')::jsonb)
+                         WITH ORDINALITY AS p(item, position)
+                ON CONFLICT (order_id, position) DO NOTHING
+            )
+            UPDATE orders o
+            SET products = NULL,
+                total = COALESCE(o.total, b.total_amount::numeric(12, 2))
+            FROM batch b
+            WHERE o.id = b.id
+            RETURNING o.id
+        """, (after_id, limit))
+        ids = [row["id"] for row in cursor.fetchall()]
+    
+    return max(ids) if ids else None
+
+
+@timed(DB_QUERY_SECONDS)
+def get_report(payment_days: int, overdue_limit: int = 50) -> dict:
+    """Отчёт по выручке и дебиторке из сводных таблиц
+    
+    Строки сводок — по валютам: суммы в рублях и в долларах не складываются.
+    К сводке добавляются ещё не свёрнутые изменения из order_stats_delta.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(f"""
+            SELECT day, currency,
+                   SUM(orders_count) AS orders_count,
+                   SUM(revenue) AS revenue,
+                   SUM(revenue) FILTER (WHERE status = 'paid') AS paid
+            FROM {_STATS_DAILY}
+            WHERE day > CURRENT_DATE - 30
+            GROUP BY day, currency
+            HAVING SUM(orders_count) > 0
+            ORDER BY day DESC, currency <> 'RUB', currency
+        """)
+        daily = [dict(row) for row in cursor.fetchall()]
+        
+        cursor.execute(f"""
+            SELECT date_trunc('month', day)::date AS month, currency,
+                   SUM(orders_count) AS orders_count,
+                   SUM(revenue) AS revenue,
+                   SUM(revenue) FILTER (WHERE status = 'paid') AS paid
+            FROM {_STATS_DAILY}
+            WHERE day >= date_trunc('month', CURRENT_DATE) - INTERVAL '11 months'
+            GROUP BY 1, 2
+            HAVING SUM(orders_count) > 0
+            ORDER BY 1 DESC, currency <> 'RUB', currency
+        """)
+        monthly = [dict(row) for row in cursor.fetchall()]
+        
+        cursor.execute(f"""
+            SELECT status, currency, SUM(orders_count) AS orders_count, SUM(revenue) AS revenue
+            FROM {_STATS_DAILY}
+            GROUP BY status, currency
+            HAVING SUM(orders_count) > 0
+            ORDER BY status, currency <> 'RUB', currency
+        """)
+        by_status = [dict(row) for row in cursor.fetchall()]
+        
+        # Топ-10 по каждой валюте: выручку в разных валютах не сравниваем
+        cursor.execute("""
+            SELECT company_inn, company_name, currency, orders_count, revenue, paid
+            FROM (
+                SELECT company_inn, currency,
+                       (array_agg(company_name ORDER BY id DESC)
+                            FILTER (WHERE company_name IS NOT NULL))[1] AS company_name,
+                       SUM(orders_count) AS orders_count,
+                       SUM(revenue) AS revenue,
+                       SUM(paid) AS paid,
+                       row_number() OVER (
+                           PARTITION BY currency ORDER BY SUM(revenue) DESC
+                       ) AS place
+                FROM (
+                    SELECT company_inn, currency, company_name, orders_count, revenue, paid,
+                           0 AS id
+                    FROM order_stats_customer
+                    UNION ALL
+                    SELECT company_inn, currency, company_name, orders_count, revenue, paid, id
+                    FROM order_stats_delta
+                    WHERE company_inn <> ''
+                ) AS customers
+                GROUP BY company_inn, currency
+                HAVING SUM(orders_count) > 0
+            ) AS ranked
+            WHERE place <= 10
+            ORDER BY currency <> 'RUB', currency, revenue DESC
+        """)
+        top_customers = [dict(row) for row in cursor.fetchall()]
+        
+        # Просрочен: дата счёта + срок оплаты уже прошли
+        cursor.execute(f"""
+            SELECT currency, SUM(orders_count) AS orders_count, SUM(revenue) AS revenue
+            FROM {_STATS_DAILY}
+            WHERE status <> 'paid' AND day < CURRENT_DATE - %s
+            GROUP BY currency
+            HAVING SUM(orders_count) > 0
+            ORDER BY currency <> 'RUB', currency
+        """, (payment_days,))
+        overdue_total = [dict(row) for row in cursor.fetchall()]
+        
+        cursor.execute(f"""
+            SELECT {ORDER_LIST_COLUMNS},
+                   CURRENT_DATE - created_at::date - %s AS days_overdue
+            FROM orders
+            WHERE status <> 'paid' AND created_at < CURRENT_DATE - %s
+            ORDER BY created_at
+            LIMIT %s
+        """, (payment_days, payment_days, overdue_limit))
+        overdue = [dict(row) for row in cursor.fetchall()]
+    
+    return {
+        "daily": daily,
+        "monthly": monthly,
+        "by_status": by_status,
+        "top_customers": top_customers,
+        "overdue_total": overdue_total,
+        "overdue": overdue,
+    }
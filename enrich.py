@@ -0,0 +1,177 @@
+"""Пакетное заполнение реквизитов заказов через DaData
+
+    python enrich.py                        # все заказы с ИНН без названия/адреса
+    python enrich.py --rate 10 --concurrency 3 --max-requests 5000
+
+Уникальные ИНН берутся пачками, сначала ищутся в локальном реестре
+(inn_registry.py, если он настроен) и в кэше company_cache,
+остальные запрашиваются в DaData с ограничением параллельности и частоты
+(на 429 все запросы приостанавливаются). Результаты пишутся в кэш и в
+заказы одним UPDATE на пачку, а не по заказу.
+"""
+import argparse
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from config import (
+    DADATA_CACHE_TTL, DADATA_NEGATIVE_CACHE_TTL,
+    DADATA_BATCH_CONCURRENCY, DADATA_BATCH_RATE
+)
+from dadata_client import fetch_company, close_client, DaDataError, DaDataRateLimited
+from database import (
+    init_pool, close_pool, find_inns_to_enrich, get_cached_companies,
+    save_cached_companies, fill_company_details
+)
+from inn_registry import lookup as registry_lookup
+
+logger = logging.getLogger("enrich")
+
+# ИНН за одну пачку: один SELECT, один запрос к кэшу, один UPDATE
+ENRICH_BATCH_SIZE = 500
+MAX_RETRIES = 5
+
+
+class RateLimiter:
+    """Не больше rate запросов в секунду на всех, с общей паузой после 429"""
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+    
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    def pause(self, seconds: float):
+        """Отложить все следующие запросы как минимум на seconds"""
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+async def _fetch_with_retry(inn: str, limiter: RateLimiter) -> Optional[dict]:
+    for attempt in range(1, MAX_RETRIES + 1):
+        await limiter.wait()
+        try:
+            return await fetch_company(inn)
+        except DaDataRateLimited as e:
+            delay = e.retry_after or min(2 ** attempt, 60)
+            logger.warning("DaData rate limit, pausing for %ss", delay)
+            limiter.pause(delay)
+        except DaDataError as e:
+            if attempt == MAX_RETRIES:
+                raise
+            logger.warning("DaData error for INN %s: %s, retrying", inn, e)
+            await asyncio.sleep(min(2 ** attempt, 60))
+    raise DaDataError(f"INN {inn}: still rate limited after {MAX_RETRIES} attempts")
+
+
+async def lookup_many(inns: list, concurrency: int, rate: float) -> dict:
+    """Компании для списка ИНН из DaData: {ИНН: компания или None}
+    
+    ИНН, по которым DaData так и не ответила, в результат не попадают.
+    """
+    limiter = RateLimiter(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {}
+    
+    async def lookup(inn: str):
+        async with semaphore:
+            try:
+                results[inn] = await _fetch_with_retry(inn, limiter)
+            except DaDataError as e:
+                logger.error("DaData lookup failed for INN %s: %s", inn, e)
+    
+    await asyncio.gather(*(lookup(inn) for inn in dict.fromkeys(inns)))
+    return results
+
+
+def _fresh(cached: dict) -> bool:
+    ttl = DADATA_CACHE_TTL if cached["data"] else DADATA_NEGATIVE_CACHE_TTL
+    return cached["age"] < ttl
+
+
+async def enrich_orders(
+    concurrency: int = DADATA_BATCH_CONCURRENCY,
+    rate: float = DADATA_BATCH_RATE,
+    max_requests: Optional[int] = None,
+) -> dict:
+    """Заполнение реквизитов всех заказов, у которых есть только ИНН"""
+    stats = {
+        "inns": 0, "registry": 0, "cached": 0, "requested": 0, "not_found": 0, "orders": 0
+    }
+    after_inn = ""
+    
+    while True:
+        inns = await run_in_threadpool(find_inns_to_enrich, after_inn, ENRICH_BATCH_SIZE)
+        if not inns:
+            break
+        after_inn = inns[-1]
+        stats["inns"] += len(inns)
+        
+        companies = {}
+        for inn in inns:
+            company = registry_lookup(inn)
+            if company is not None:
+                companies[inn] = company
+        stats["registry"] += len(companies)
+        
+        remaining = [inn for inn in inns if inn not in companies]
+        cached = await run_in_threadpool(get_cached_companies, remaining)
+        fresh = {inn: entry["data"] for inn, entry in cached.items() if _fresh(entry)}
+        stats["cached"] += len(fresh)
+        companies.update(fresh)
+        
+        missing = [inn for inn in remaining if inn not in companies]
+        if max_requests is not None:
+            missing = missing[:max(max_requests - stats["requested"], 0)]
+        if missing:
+            fetched = await lookup_many(missing, concurrency, rate)
+            stats["requested"] += len(missing)
+            await run_in_threadpool(save_cached_companies, fetched)
+            companies.update(fetched)
+        
+        found = {inn: company for inn, company in companies.items() if company}
+        stats["not_found"] += len(companies) - len(found)
+        stats["orders"] += await run_in_threadpool(fill_company_details, found)
+        logger.info("Enriched up to INN %s: %s", after_inn, stats)
+        
+        if max_requests is not None and stats["requested"] >= max_requests:
+            logger.warning("Stopped at --max-requests %s", max_requests)
+            break
+    
+    return stats
+
+
+async def main(args):
+    init_pool()
+    try:
+        return await enrich_orders(args.concurrency, args.rate, args.max_requests)
+    finally:
+        await close_client()
+        close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заполнение реквизитов заказов через DaData")
+    parser.add_argument("--concurrency", type=int, default=DADATA_BATCH_CONCURRENCY,
+                        help="Одновременных запросов к DaData")
+    parser.add_argument("--rate", type=float, default=DADATA_BATCH_RATE,
+                        help="Запросов к DaData в секунду")
+    parser.add_argument("--max-requests", type=int,
+                        help="Не больше запросов к DaData за запуск (дневная квота)")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s",
+    )
+    stats = asyncio.run(main(args))
+    print(f"Done: {stats}")
@@ -0,0 +1,394 @@
+"""Выгрузка заказов с товарами для загрузки в 1С
+
+    python export_orders.py --format csv -o orders.csv --date-from 2026-09-01
+    python export_orders.py --format xlsx -o orders.xlsx --status pdf_generated
+    python export_orders.py --format xml -o orders.xml      # CommerceML 2.10
+    python export_orders.py --bench 1000000                 # без БД, синтетика
+
+Заказы читаются серверным курсором пачками (iter_orders_with_items) и сразу
+пишутся в выходной поток кусками по EXPORT_CHUNK_SIZE байт, поэтому память
+не зависит от числа строк. CSV и XLSX — по строке на позицию счёта с
+повторёнными полями заказа; XML — документ «Счет на оплату» на заказ.
+XLSX собирается без openpyxl: лист пишется построчно прямо в ZIP.
+"""
+import argparse
+import csv
+import io
+import re
+import resource
+import time
+import zipfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from xml.sax.saxutils import escape, quoteattr
+
+from config import COMPANY
+from bulk_export import ZipStream
+from database import init_pool, close_pool, iter_orders_with_items
+
+# Строк заказов за один FETCH серверного курсора
+EXPORT_BATCH_SIZE = 5000
+# Сколько байт копится перед отправкой клиенту
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+COLUMNS = (
+    "Номер счёта", "Дата", "Статус", "Валюта", "Сумма счёта",
+    "Покупатель", "ИНН", "КПП", "Адрес",
+    "Контактное лицо", "Email", "Телефон",
+    "№", "Товар", "Артикул", "Период", "Количество", "Цена", "Сумма",
+)
+
+# Управляющие символы, недопустимые в XML 1.0
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _rows(orders, convert):
+    """Строки выгрузки: по одной на позицию, заказ без товаров — одна строка
+    
+    convert переводит значение в формат выгрузки; поля заказа переводятся
+    один раз на заказ, а не на каждую его позицию.
+    """
+    for order in orders:
+        head = [convert(value) for value in (
+            order["invoice_number"], order["created_at"], order["status"],
+            order["currency"], order["total_amount"],
+            order["company_name"], order["company_inn"],
+            order["company_kpp"], order["company_address"],
+            order["customer_name"], order["customer_email"],
+            order["customer_phone"],
+        )]
+        products = order["products"] or [{}]
+        for position, product in enumerate(products, 1):
+            yield head + [convert(value) for value in (
+                position if product else None,
+                product.get("name"),
+                product.get("sku"),
+                product.get("period"),
+                product.get("quantity"),
+                product.get("price"),
+                product.get("amount"),
+            )]
+
+
+# Excel и LibreOffice считают формулой ячейку CSV, начинающуюся с этих
+# символов; имя или компания из формы Тильды не должны стать формулой
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime("%d.%m.%Y")
+    if isinstance(value, (Decimal, float)):
+        # 1С и русский Excel ждут десятичную запятую
+        return f"{value:.2f}".replace(".", ",")
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def write_csv(orders):
+    """CSV для 1С: UTF-8 с BOM, разделитель «;»"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";", lineterminator="\r\n")
+    buffer.write("\ufeff")
+    writer.writerow(COLUMNS)
+    
+    for row in _rows(orders, _csv_value):
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    
+    yield buffer.getvalue().encode("utf-8")
+
+
+# Минимальная книга XLSX: один лист, стиль 1 — дата, стиль 2 — деньги
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Заказы" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+        '<cellXfs count="3"><xf/>'
+        '<xf numFmtId="14" applyNumberFormat="1"/>'
+        '<xf numFmtId="4" applyNumberFormat="1"/>'
+        '</cellXfs>'
+        '</styleSheet>'
+    ),
+}
+
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+
+def _xlsx_cell(value) -> str:
+    if value is None or value == "":
+        return "<c/>"
+    if isinstance(value, datetime):
+        serial = (value - _EXCEL_EPOCH) / timedelta(days=1)
+        return f'<c s="1"><v>{serial:.6f}</v></c>'
+    if isinstance(value, (Decimal, float)):
+        return f'<c s="2"><v>{value}</v></c>'
+    if isinstance(value, int):
+        return f"<c><v>{value}</v></c>"
+    text = escape(_XML_INVALID.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def write_xlsx(orders):
+    """XLSX с одним листом; лист сжимается и отдаётся по мере записи строк"""
+    stream = ZipStream()
+    # Размер листа заранее неизвестен: ZIP64, чтобы не упереться в 4 ГБ
+    archive = zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+    for name, content in _XLSX_PARTS.items():
+        archive.writestr(name, content)
+    
+    with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+        buffer = io.StringIO()
+        buffer.write(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            '<sheetData>'
+        )
+        buffer.write("<row>" + "".join(_xlsx_cell(name) for name in COLUMNS) + "</row>")
+        
+        for row in _rows(orders, _xlsx_cell):
+            buffer.write("<row>" + "".join(row) + "</row>")
+            if buffer.tell() >= EXPORT_CHUNK_SIZE:
+                sheet.write(buffer.getvalue().encode("utf-8"))
+                buffer.seek(0)
+                buffer.truncate()
+                yield stream.drain()
+        
+        buffer.write("</sheetData></worksheet>")
+        sheet.write(buffer.getvalue().encode("utf-8"))
+    
+    archive.close()
+    yield stream.drain()
+
+
+def _xml_text(value) -> str:
+    return escape(_XML_INVALID.sub("", str(value or "")))
+
+
+def _xml_counterparty(company: dict, role: str) -> str:
+    return (
+        "<Контрагент>"
+        f"<Ид>{_xml_text(company['inn'])}</Ид>"
+        f"<Наименование>{_xml_text(company['name'])}</Наименование>"
+        f"<ОфициальноеНаименование>{_xml_text(company['name'])}</ОфициальноеНаименование>"
+        f"<ИНН>{_xml_text(company['inn'])}</ИНН>"
+        f"<КПП>{_xml_text(company['kpp'])}</КПП>"
+        f"<Роль>{role}</Роль>"
+        f"<ЮридическийАдрес><Представление>{_xml_text(company['address'])}</Представление></ЮридическийАдрес>"
+        "</Контрагент>"
+    )
+
+
+def _xml_document(order: dict, seller: str) -> str:
+    buyer = _xml_counterparty({
+        "inn": order["company_inn"],
+        "name": order["company_name"] or order["customer_name"],
+        "kpp": order["company_kpp"],
+        "address": order["company_address"],
+    }, "Покупатель")
+    
+    items = []
+    for product in order["products"]:
+        period = ""
+        if product.get("period"):
+            period = (
+                "<ЗначенияРеквизитов><ЗначениеРеквизита><Наименование>Период</Наименование>"
+                f"<Значение>{_xml_text(product['period'])}</Значение>"
+                "</ЗначениеРеквизита></ЗначенияРеквизитов>"
+            )
+        items.append(
+            "<Товар>"
+            f"<Ид>{_xml_text(product.get('sku') or product.get('name'))}</Ид>"
+            f"<Артикул>{_xml_text(product.get('sku'))}</Артикул>"
+            f"<Наименование>{_xml_text(product.get('name'))}</Наименование>"
+            '<БазоваяЕдиница Код="796" НаименованиеПолное="Штука" МеждународноеСокращение="PCE">шт</БазоваяЕдиница>'
+            f"<ЦенаЗаЕдиницу>{product.get('price', 0)}</ЦенаЗаЕдиницу>"
+            f"<Количество>{product.get('quantity', 1)}</Количество>"
+            f"<Сумма>{product.get('amount', 0)}</Сумма>"
+            f"{period}"
+            "</Товар>"
+        )
+    
+    created_at = order["created_at"]
+    return (
+        "<Документ>"
+        f"<Ид>{order['id']}</Ид>"
+        f"<Номер>{_xml_text(order['invoice_number'])}</Номер>"
+        f"<Дата>{created_at:%Y-%m-%d}</Дата>"
+        f"<Время>{created_at:%H:%M:%S}</Время>"
+        "<ХозОперация>Счет на оплату</ХозОперация>"
+        "<Роль>Продавец</Роль>"
+        f"<Валюта>{_xml_text(order['currency'])}</Валюта>"
+        "<Курс>1</Курс>"
+        f"<Сумма>{order['total_amount']}</Сумма>"
+        f"<Контрагенты>{seller}{buyer}</Контрагенты>"
+        f"<Товары>{''.join(items)}</Товары>"
+        "<ЗначенияРеквизитов><ЗначениеРеквизита><Наименование>Статус заказа</Наименование>"
+        f"<Значение>{_xml_text(order['status'])}</Значение>"
+        "</ЗначениеРеквизита></ЗначенияРеквизитов>"
+        "</Документ>\n"
+    )
+
+
+def write_commerceml(orders):
+    """CommerceML 2.10: документ «Счет на оплату» на каждый заказ"""
+    seller = _xml_counterparty(COMPANY, "Продавец")
+    created = quoteattr(datetime.now().strftime("%Y-%m-%dT%H:%M:%S"))
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<КоммерческаяИнформация ВерсияСхемы="2.10" ДатаФормирования={created}>\n'
+    ]
+    size = 0
+    
+    for order in orders:
+        document = _xml_document(order, seller)
+        parts.append(document)
+        size += len(document)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield "".join(parts).encode("utf-8")
+            parts.clear()
+            size = 0
+    
+    parts.append("</КоммерческаяИнформация>\n")
+    yield "".join(parts).encode("utf-8")
+
+
+# Формат -> (функция записи, MIME-тип)
+EXPORT_FORMATS = {
+    "csv": (write_csv, "text/csv; charset=utf-8"),
+    "xlsx": (write_xlsx, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "xml": (write_commerceml, "application/xml"),
+}
+
+
+def iter_export(fmt: str, filters: dict, batch_size: int = EXPORT_BATCH_SIZE):
+    """Выгрузка заказов по фильтрам админки кусками байт"""
+    write, _ = EXPORT_FORMATS[fmt]
+    return write(iter_orders_with_items(batch_size, **filters))
+
+
+def sample_orders(rows: int, items_per_order: int = 4):
+    """Синтетические заказы для замера: всего rows позиций"""
+    created_at = datetime(2026, 1, 1, 12, 0)
+    for order_id in range(1, rows // items_per_order + 1):
+        products = [
+            {
+                "name": f"Размещение баннера на главной странице, позиция {n}",
+                "sku": f"BN-{n:03d}",
+                "period": "01.09.2026 - 30.09.2026",
+                "quantity": n,
+                "price": Decimal("1500.00"),
+                "amount": Decimal("1500.00") * n,
+            }
+            for n in range(1, items_per_order + 1)
+        ]
+        yield {
+            "id": order_id,
+            "invoice_number": f"CM-{order_id:07d}",
+            "created_at": created_at,
+            "status": "pdf_generated",
+            "currency": "RUB",
+            "total_amount": sum(p["amount"] for p in products),
+            "customer_name": "Иван Петров",
+            "customer_email": "ivan@example.com",
+            "customer_phone": "+7 900 000-00-00",
+            "company_name": "ООО «Ромашка»",
+            "company_inn": "7707083893",
+            "company_kpp": "773601001",
+            "company_address": "117312, г. Москва, ул. Вавилова, д. 19",
+            "products": products,
+        }
+
+
+def bench(rows: int, formats: list):
+    """Скорость записи и пиковая память на rows синтетических позиций"""
+    for fmt in formats:
+        write, _ = EXPORT_FORMATS[fmt]
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        size = sum(len(chunk) for chunk in write(sample_orders(rows)))
+        elapsed = time.perf_counter() - start
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(
+            f"{fmt}: {rows} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s), "
+            f"{size / 2**20:.0f} MB, peak RSS +{(rss_after - rss_before) / 1024:.1f} MB"
+        )
+
+
+def export_to_file(path: str, fmt: str, filters: dict):
+    init_pool()
+    try:
+        with open(path, "wb") as f:
+            for chunk in iter_export(fmt, filters):
+                f.write(chunk)
+    finally:
+        close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Выгрузка заказов для 1С")
+    parser.add_argument("--format", choices=EXPORT_FORMATS,
+                        help="csv, xlsx или xml (CommerceML); по умолчанию csv, для --bench — все")
+    parser.add_argument("-o", "--output", help="Путь к файлу выгрузки")
+    parser.add_argument("--status")
+    parser.add_argument("--inn")
+    parser.add_argument("--customer")
+    parser.add_argument("--date-from", type=date.fromisoformat)
+    parser.add_argument("--date-to", type=date.fromisoformat)
+    parser.add_argument("--bench", type=int, metavar="ROWS",
+                        help="Замер записи ROWS синтетических позиций без БД")
+    args = parser.parse_args()
+    
+    if args.bench:
+        bench(args.bench, [args.format] if args.format else list(EXPORT_FORMATS))
+    else:
+        if not args.output:
+            parser.error("-o/--output is required")
+        export_to_file(args.output, args.format or "csv", {
+            "status": args.status,
+            "inn": args.inn,
+            "customer": args.customer,
+            "date_from": args.date_from,
+            "date_to": args.date_to,
+        })
+        print(f"Saved {args.output}")
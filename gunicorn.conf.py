@@ -0,0 +1,58 @@
+"""Настройки gunicorn: python -m gunicorn main:app -c gunicorn.conf.py
+
+Общее состояние между воркерами хранится в PostgreSQL (кэш DaData в
+company_cache, готовые PDF в pdf_cache, очереди webhook_inbox и
+render_jobs), поэтому воркеров и машин может быть сколько угодно.
+"""
+import os
+import shutil
+import tempfile
+
+_cpus = os.cpu_count() or 1
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+# UvicornWorker, закрывающий потоки SSE в начале остановки (uvicorn_worker.py)
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# Веб-воркеры почти всё время ждут БД и DaData, рендер идёт в отдельных
+# процессах, поэтому по воркеру на ядро, а процессы рендера делятся между ними
+workers = int(os.getenv("WEB_CONCURRENCY", str(_cpus)))
+os.environ.setdefault("PDF_WORKERS", str(max(1, _cpus // workers)))
+
+# Соединений с БД на воркер: DB_POOL_MAX + 1 (LISTEN для живых обновлений
+# админки, order_events.py) + 1 (обслуживание: у лидера постоянное, у
+# остальных на время попытки взять блокировку, maintenance.py).
+# Всего workers * (DB_POOL_MAX + 2) — должно укладываться в max_connections
+# PostgreSQL вместе с другими клиентами; бюджет задаёт DB_CONNECTIONS
+_db_connections = int(os.getenv("DB_CONNECTIONS", "40"))
+os.environ.setdefault("DB_POOL_MAX", str(max(2, _db_connections // workers - 2)))
+# Пул держит все соединения открытыми, а не переподключается под нагрузкой
+os.environ.setdefault("DB_POOL_MIN", os.environ["DB_POOL_MAX"])
+
+# При остановке воркер перестаёт принимать запросы, дорабатывает начатые
+# и фоновые пачки (SHUTDOWN_TIMEOUT) и только потом завершается
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = 60
+keepalive = 5
+
+# max_requests не задан: ReportLab работает в процессах рендера, а не в
+# веб-воркере, а каждый перезапуск воркера останавливает его прогретый пул
+# рендера и обрывает потоки SSE открытых страниц админки
+
+# Метрики всех воркеров собираются через снимки в METRICS_DIR (metrics.py)
+os.environ.setdefault("METRICS_DIR", tempfile.mkdtemp(prefix="invoicegen-metrics-"))
+
+
+def on_starting(server):
+    # Снимки прошлого запуска не должны попасть в счётчики
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["METRICS_DIR"])
+
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid, os.environ["METRICS_DIR"])
+
+
+def on_exit(server):
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
@@ -0,0 +1,271 @@
+"""Локальный реестр компаний по ИНН (необязательный, вместо запросов в DaData)
+
+    python inn_registry.py egrul.csv companies.jsonl -o data/inn_registry.bin
+    python inn_registry.py --get 7707083893
+    python inn_registry.py --bench 1000000
+
+Загрузчик принимает CSV (разделитель «,» или «;», колонки inn, kpp, name,
+address, ogrn — или ИНН, КПП, Наименование, Адрес, ОГРН) и JSON Lines:
+по объекту на строку, плоскому или в формате подсказки DaData
+({"value": ..., "data": {"inn": ..., "address": {"value": ...}}}).
+
+Файл реестра:
+    заголовок   MAGIC, число записей
+    ключи       count x uint64, по возрастанию: (длина ИНН << 40) | ИНН
+    смещения    count x uint64 записи от начала файла
+    записи      uint32 длина + UTF-8 «name␟kpp␟address␟ogrn»
+
+Файл открывается через mmap и ищется двоичным поиском по ключам, поэтому
+поиск занимает микросекунды, не требует сети и не читает файл в память.
+Реестр перезаписывается атомарно (os.replace); запущенные процессы видят
+новый файл после перезапуска.
+"""
+import argparse
+import bisect
+import csv
+import json
+import logging
+import mmap
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+from array import array
+from typing import Optional
+
+from config import INN_REGISTRY_PATH
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"INNREG01"
+HEADER = struct.Struct("<8sQ")
+RECORD_LENGTH = struct.Struct("<I")
+FIELDS = ("name", "kpp", "address", "ogrn")
+SEPARATOR = "\x1f"
+
+# Названия колонок выгрузок -> поле реестра
+COLUMN_ALIASES = {
+    "inn": "inn", "инн": "inn",
+    "kpp": "kpp", "кпп": "kpp",
+    "ogrn": "ogrn", "огрн": "ogrn",
+    "name": "name", "value": "name", "наименование": "name", "name_short": "name",
+    "address": "address", "адрес": "address",
+}
+
+_registry = None
+_opened = False
+
+
+def inn_key(inn: str) -> Optional[int]:
+    """Ключ ИНН в реестре; None, если это не ИНН (10 или 12 цифр)
+    
+    Длина входит в ключ, чтобы ИНН с ведущими нулями не совпадали.
+    """
+    if len(inn) not in (10, 12) or not inn.isdigit():
+        return None
+    return (len(inn) << 40) | int(inn)
+
+
+class InnRegistry:
+    """Открытый файл реестра"""
+    
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} is not an INN registry")
+        
+        view = memoryview(self._mm)
+        keys_start = HEADER.size
+        offsets_start = keys_start + 8 * count
+        self._keys = view[keys_start:offsets_start].cast("Q")
+        self._offsets = view[offsets_start:offsets_start + 8 * count].cast("Q")
+        self.path = path
+    
+    def __len__(self) -> int:
+        return len(self._keys)
+    
+    def get(self, inn: str) -> Optional[dict]:
+        """Компания по ИНН в формате fetch_company или None"""
+        key = inn_key(inn)
+        if key is None:
+            return None
+        i = bisect.bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            return None
+        
+        offset = self._offsets[i]
+        (length,) = RECORD_LENGTH.unpack_from(self._mm, offset)
+        start = offset + RECORD_LENGTH.size
+        values = self._mm[start:start + length].decode("utf-8").split(SEPARATOR)
+        return {"inn": inn, **dict(zip(FIELDS, values))}
+    
+    def close(self):
+        self._keys.release()
+        self._offsets.release()
+        self._mm.close()
+
+
+def lookup(inn: str) -> Optional[dict]:
+    """Компания из реестра INN_REGISTRY_PATH (None — нет записи или реестра)"""
+    global _registry, _opened
+    if not _opened:
+        _opened = True
+        if INN_REGISTRY_PATH:
+            try:
+                _registry = InnRegistry(INN_REGISTRY_PATH)
+                logger.info("INN registry %s: %s companies", INN_REGISTRY_PATH, len(_registry))
+            except (OSError, ValueError) as e:
+                logger.warning("INN registry is not available: %s", e)
+    if _registry is None:
+        return None
+    return _registry.get(inn)
+
+
+def _normalize(row: dict) -> Optional[dict]:
+    """Поля реестра из строки CSV или объекта JSON"""
+    if isinstance(row.get("data"), dict):
+        # Подсказка DaData
+        data = row["data"]
+        address = data.get("address") or {}
+        return {
+            "inn": data.get("inn") or "",
+            "name": row.get("value") or "",
+            "kpp": data.get("kpp") or "",
+            "address": address.get("value", "") if isinstance(address, dict) else address,
+            "ogrn": data.get("ogrn") or "",
+        }
+    company = {}
+    for column, value in row.items():
+        field = COLUMN_ALIASES.get((column or "").strip().lower())
+        if field and field not in company:
+            company[field] = (value or "").strip()
+    return company
+
+
+def read_dump(path: str, encoding: str = "utf-8-sig"):
+    """Компании из выгрузки CSV или JSON Lines (по расширению .jsonl/.json)"""
+    with open(path, encoding=encoding, newline="") as f:
+        if path.endswith((".jsonl", ".json")):
+            for line in f:
+                if line.strip():
+                    yield _normalize(json.loads(line))
+            return
+        
+        header = f.readline()
+        delimiter = ";" if header.count(";") > header.count(",") else ","
+        columns = next(csv.reader([header], delimiter=delimiter))
+        for row in csv.DictReader(f, fieldnames=columns, delimiter=delimiter):
+            yield _normalize(row)
+
+
+def build_registry(companies, path: str) -> int:
+    """Запись реестра из итератора компаний, возвращает число записей
+    
+    Записи пишутся во временный файл по мере чтения, в памяти остаются
+    только ключи и смещения. При повторе ИНН остаётся последняя запись.
+    """
+    keys = array("Q")
+    offsets = array("Q")
+    directory = os.path.dirname(os.path.abspath(path))
+    
+    with tempfile.TemporaryFile(dir=directory) as records:
+        position = 0
+        for company in companies:
+            key = inn_key((company or {}).get("inn", ""))
+            if key is None:
+                continue
+            data = SEPARATOR.join(
+                (company.get(field) or "").replace(SEPARATOR, " ") for field in FIELDS
+            ).encode("utf-8")
+            records.write(RECORD_LENGTH.pack(len(data)))
+            records.write(data)
+            keys.append(key)
+            offsets.append(position)
+            position += RECORD_LENGTH.size + len(data)
+        
+        # sorted устойчив: из одинаковых ИНН последней идёт последняя запись
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        unique = [
+            i for n, i in enumerate(order)
+            if n + 1 == len(order) or keys[order[n + 1]] != keys[i]
+        ]
+        
+        records_start = HEADER.size + 16 * len(unique)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as out:
+            out.write(HEADER.pack(MAGIC, len(unique)))
+            array("Q", (keys[i] for i in unique)).tofile(out)
+            array("Q", (records_start + offsets[i] for i in unique)).tofile(out)
+            records.seek(0)
+            shutil.copyfileobj(records, out, 1024 * 1024)
+        os.replace(tmp_path, path)
+    
+    return len(unique)
+
+
+def bench(count: int, lookups: int = 100000):
+    """Построение реестра из count синтетических компаний и замер поиска"""
+    inns = [f"{7700000000 + n * 7:010d}" for n in range(count)]
+    companies = (
+        {"inn": inn, "name": f"ООО «Компания {n}»", "kpp": "770001001",
+         "address": f"г. Москва, ул. Тверская, д. {n % 200}", "ogrn": f"{1027700000000 + n}"}
+        for n, inn in enumerate(inns)
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "registry.bin")
+        start = time.perf_counter()
+        build_registry(companies, path)
+        built = time.perf_counter() - start
+        size = os.path.getsize(path)
+        
+        registry = InnRegistry(path)
+        sample = random.sample(inns, min(lookups, count))
+        start = time.perf_counter()
+        for inn in sample:
+            registry.get(inn)
+        elapsed = time.perf_counter() - start
+        registry.close()
+    
+    print(
+        f"{count} companies: built in {built:.1f}s, {size / 2**20:.0f} MB; "
+        f"lookup {elapsed / len(sample) * 1e6:.1f} us"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный реестр компаний по ИНН")
+    parser.add_argument("dumps", nargs="*", help="Выгрузки CSV или JSON Lines")
+    parser.add_argument("-o", "--output", default=INN_REGISTRY_PATH,
+                        help="Файл реестра (по умолчанию INN_REGISTRY_PATH)")
+    parser.add_argument("--encoding", default="utf-8-sig", help="Кодировка выгрузок")
+    parser.add_argument("--get", metavar="INN", help="Найти ИНН в реестре")
+    parser.add_argument("--bench", type=int, metavar="N",
+                        help="Замер на N синтетических компаниях")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s",
+    )
+    
+    if args.bench:
+        bench(args.bench)
+    elif args.get:
+        if not args.output:
+            parser.error("-o/--output or INN_REGISTRY_PATH is required")
+        print(InnRegistry(args.output).get(args.get))
+    else:
+        if not args.dumps or not args.output:
+            parser.error("dump files and -o/--output (or INN_REGISTRY_PATH) are required")
+        companies = (
+            company
+            for path in args.dumps
+            for company in read_dump(path, args.encoding)
+        )
+        count = build_registry(companies, args.output)
+        print(f"Saved {count} companies to {args.output}")
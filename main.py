@@ -1,18 +1,65 @@
 from fastapi import FastAPI, Request, Form, HTTPException
-from fastapi.responses import HTMLResponse, Response, RedirectResponse
+from fastapi.responses import (
+    HTMLResponse, JSONResponse, PlainTextResponse, Response, RedirectResponse,
+    StreamingResponse
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+from datetime import date, datetime
+from typing import Optional
+from urllib.parse import quote, urlencode
+import asyncio
 import json
+import logging
+import time
 
 from database import (
-    init_db, create_order, get_order, get_all_orders,
-    update_order_company, mark_pdf_generated
+    init_pool, close_pool, init_db, check_schema, get_order, enqueue_webhook,
+    list_orders, estimate_orders_count, suggest_orders, get_report,
+    update_order_company, mark_pdf_generated,
+    get_cached_pdf, save_cached_pdf
+)
+from amount_words import currency_sign
+from bulk_export import iter_invoices_zip
+from export_orders import EXPORT_FORMATS, iter_export
+from dadata_client import get_company_by_inn, get_cache_stats, close_client
+from pdf_hash import invoice_hash
+from pdf_renderer import (
+    start_renderer, stop_renderer, render_invoice, RendererBusy
+)
+from maintenance import start_maintenance, stop_maintenance
+from order_events import (
+    start_order_events, stop_order_events, subscribe, stream_events,
+    TooManyClients
+)
+from render_worker import start_render_worker, stop_render_worker, notify_render_worker
+from webhook_worker import (
+    start_webhook_worker, stop_webhook_worker, notify_webhook_worker
+)
+from metrics import (
+    Counter, Histogram, CallbackGauge, render_metrics, start_metrics_writer, stop_metrics_writer
+)
+from config import (
+    AUTO_MIGRATE, COMPANY, LOG_LEVEL, PAYMENT_DAYS, STARTUP_BUDGET_SECONDS,
+    SEARCH_SUGGEST_LIMIT, SEARCH_SUGGEST_TIMEOUT_MS
+)
+
+logging.basicConfig(
+    level=LOG_LEVEL,
+    format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s",
+)
+# httpx пишет INFO на каждый запрос к DaData — это лишний вывод на горячем пути
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger("invoicegen")
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Время обработки запроса", ("method", "route")
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Запросы по маршруту и статусу", ("method", "route", "status")
 )
-from dadata_client import get_company_by_inn
-from pdf_generator import generate_invoice_pdf
-from config import COMPANY, INVOICE_PREFIX, INVOICE_START_NUMBER
 
 app = FastAPI(title="InvoiceGen")
 # Разрешаем запросы от Тильды
@@ -24,71 +71,105 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+
+@app.middleware("http")
+async def measure_requests(request: Request, call_next):
+    """Время и статус каждого запроса по шаблону маршрута (/order/{order_id})"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start, method=request.method, route=path
+        )
+        HTTP_REQUESTS.inc(method=request.method, route=path, status=status)
+
+
 # Статические файлы и шаблоны
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+templates.env.filters["currency_sign"] = currency_sign
 
-# Инициализация БД при запуске
-@app.on_event("startup")
-async def startup():
-    init_db()
+# Время последнего старта процесса (для /metrics)
+_startup_seconds = 0.0
+CallbackGauge(
+    "app_startup_duration_seconds", "Время старта процесса до готовности",
+    lambda: _startup_seconds
+)
 
 
+def render_order_row(order: dict) -> str:
+    """Строка таблицы заказов админки (для живых обновлений)"""
+    return templates.get_template("_order_row.html").render(order=order)
 
-# Парсер
 
-def parse_tilda_order(data: dict) -> dict:
-    """Парсит данные заказа от Тильды (form-data формат)"""
-    
-    # Извлекаем товары из формата payment[products][0][name]
-    products = []
-    i = 0
-    while True:
-        name_key = f'payment[products][{i}][name]'
-        if name_key not in data:
-            break
-        
-        product = {
-            "name": data.get(f'payment[products][{i}][name]', ''),
-            "quantity": int(data.get(f'payment[products][{i}][quantity]', 1)),
-            "price": float(data.get(f'payment[products][{i}][price]', 0)),
-            "amount": float(data.get(f'payment[products][{i}][amount]', 0)),
-            "sku": data.get(f'payment[products][{i}][sku]', ''),
-            "period": "",  # Можно извлечь из названия если нужно
-        }
-        products.append(product)
-        i += 1
+def precompile_templates():
+    """Компиляция всех шаблонов заранее, а не на первом запросе к каждой странице"""
+    for name in templates.env.list_templates():
+        templates.env.get_template(name)
+
+
+# Инициализация при запуске
+# Запросы к БД блокирующие (psycopg2), поэтому все они выполняются
+# в пуле потоков через run_in_threadpool, а не прямо в event loop
+@app.on_event("startup")
+async def startup():
+    global _startup_seconds
+    start = time.perf_counter()
     
-    # Если товары не найдены, создаём один товар из общей суммы
-    if not products:
-        total = float(data.get('payment[amount]', 0))
-        if total > 0:
-            products = [{
-                "name": "Заказ",
-                "quantity": 1,
-                "price": total,
-                "amount": total,
-                "sku": "",
-                "period": "",
-            }]
+    # Процессы рендеринга поднимаются и прогреваются параллельно с подключением к БД
+    renderer = asyncio.ensure_future(run_in_threadpool(start_renderer))
+    missing = []
+    try:
+        await run_in_threadpool(init_pool)
+        if AUTO_MIGRATE:
+            await run_in_threadpool(init_db)
+        else:
+            missing = await run_in_threadpool(check_schema)
+        precompile_templates()
+    finally:
+        await renderer
     
-    # Общая сумма
-    total_amount = float(data.get('payment[amount]', 0))
-    if total_amount == 0:
-        total_amount = sum(p['amount'] for p in products)
+    if missing:
+        # Без таблиц запросы падали бы уже у пользователей: воркер не
+        # стартует, и gunicorn останавливается с ошибкой загрузки
+        await run_in_threadpool(stop_renderer)
+        await run_in_threadpool(close_pool)
+        raise RuntimeError(
+            f"Database schema is outdated, missing tables: {', '.join(missing)}. "
+            "Run: python migrate.py --schema-only"
+        )
     
-    # Номер заказа
-    order_id = data.get('payment[orderid]', '')
+    start_webhook_worker()
+    start_render_worker()
+    start_maintenance()
+    start_order_events(render_order_row)
+    start_metrics_writer()
     
-    return {
-        "tilda_order_id": order_id,
-        "customer_name": data.get('Name', ''),
-        "customer_email": data.get('Email', ''),
-        "customer_phone": data.get('Phone', ''),
-        "products": products,
-        "total_amount": total_amount,
-    }
-
+    _startup_seconds = time.perf_counter() - start
+    if _startup_seconds > STARTUP_BUDGET_SECONDS:
+        logger.warning("Startup took %.2fs, budget is %.2fs", _startup_seconds, STARTUP_BUDGET_SECONDS)
+    else:
+        logger.info("Startup finished in %.2fs", _startup_seconds)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Обработчики дорабатывают текущие пачки параллельно, пул рендеринга
+    # дожидается уже отправленных в него счетов
+    await asyncio.gather(
+        stop_webhook_worker(), stop_render_worker(), stop_maintenance(), stop_order_events()
+    )
+    await close_client()
+    await run_in_threadpool(stop_renderer)
+    await run_in_threadpool(close_pool)
+    await stop_metrics_writer()
 
 
 
@@ -96,14 +177,12 @@ def parse_tilda_order(data: dict) -> dict:
 
 @app.post("/webhook/tilda")
 async def tilda_webhook(request: Request):
-    """Приём вебхука от Тильды"""
+    """Приём вебхука от Тильды
+    
+    Вебхук только сохраняется в webhook_inbox и сразу подтверждается;
+    заказ создаёт фоновый обработчик (webhook_worker) с повторами при ошибках.
+    """
     try:
-        content_type = request.headers.get("content-type", "")
-        
-        print("=" * 50)
-        print("WEBHOOK RECEIVED!")
-        print(f"Content-Type: {content_type}")
-        
         # Получаем form-data
         data = {}
         try:
@@ -119,35 +198,20 @@ async def tilda_webhook(request: Request):
                 pass
         
         if not data:
-            print("No data received")
+            logger.warning("Webhook without data, content-type %s",
+                           request.headers.get("content-type", ""))
             return {"status": "error", "message": "No data received"}
         
-        print(f"Data: {data}")
-        
-        # Парсим заказ
-        order_data = parse_tilda_order(data)
-        print(f"Parsed order: {order_data}")
-        
-        # Сохраняем - передаём параметры правильно
-        order_id = create_order(
-            products=order_data["products"],
-            total_amount=order_data["total_amount"],
-            customer_name=order_data["customer_name"],
-            customer_email=order_data["customer_email"],
-            customer_phone=order_data["customer_phone"],
-            invoice_prefix="СЧ",
-            start_number=1
-        )
-        
-        print(f"SUCCESS! Created order ID: {order_id}")
-        print("=" * 50)
+        inbox_id = await run_in_threadpool(enqueue_webhook, data)
+        notify_webhook_worker()
         
-        return {"status": "ok", "order_id": order_id}
+        logger.info("Queued webhook %s", inbox_id)
+        return {"status": "ok", "inbox_id": inbox_id}
         
-    except Exception as e:
-        import traceback
-        print(f"WEBHOOK ERROR: {traceback.format_exc()}")
-        return {"status": "ok"}
+    except Exception:
+        logger.exception("Webhook was not queued")
+        # Не 200, чтобы Тильда повторила отправку
+        return JSONResponse(status_code=500, content={"status": "error"})
 
 
 
@@ -159,7 +223,7 @@ async def tilda_webhook(request: Request):
 async def order_form(request: Request, order_id: int):
     """Страница с формой дозаполнения реквизитов"""
     
-    order = get_order(order_id)
+    order = await run_in_threadpool(get_order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Заказ не найден")
     
@@ -180,6 +244,18 @@ async def api_get_company(inn: str):
     return {"error": "Компания не найдена"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Метрики в формате Prometheus"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/company/stats")
+async def api_company_cache_stats():
+    """Счётчики кэша DaData (попадания, промахи, объединённые запросы)"""
+    return get_cache_stats()
+
+
 @app.post("/order/{order_id}/save")
 async def save_order_company(
     order_id: int,
@@ -190,17 +266,20 @@ async def save_order_company(
 ):
     """Сохранение реквизитов компании"""
     
-    order = get_order(order_id)
+    order = await run_in_threadpool(get_order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Заказ не найден")
     
-    update_order_company(
+    await run_in_threadpool(
+        update_order_company,
         order_id=order_id,
         company_name=company_name,
         company_inn=company_inn,
         company_kpp=company_kpp,
         company_address=company_address
     )
+    # PDF начинает собираться, пока клиент смотрит страницу предпросмотра
+    notify_render_worker()
     
     return RedirectResponse(url=f"/order/{order_id}/preview", status_code=303)
 
@@ -211,7 +290,7 @@ async def save_order_company(
 async def order_preview(request: Request, order_id: int):
     """Предпросмотр перед генерацией PDF"""
     
-    order = get_order(order_id)
+    order = await run_in_threadpool(get_order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Заказ не найден")
     
@@ -225,19 +304,60 @@ async def order_preview(request: Request, order_id: int):
     })
 
 
+def attachment_header(filename: str) -> str:
+    """Content-Disposition для имени файла с кириллицей (RFC 5987)"""
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace("?", "_")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Совпадает ли ETag с заголовком If-None-Match"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in tags or "*" in tags
+
+
 @app.get("/order/{order_id}/download")
-async def download_pdf(order_id: int):
-    """Скачивание PDF счёта"""
+async def download_pdf(request: Request, order_id: int):
+    """Скачивание PDF счёта
+    
+    Готовый PDF хранится в pdf_cache под хэшем данных заказа, поэтому
+    повторное скачивание — чтение из БД (или 304), а не новая сборка.
+    """
     
-    order = get_order(order_id)
+    order = await run_in_threadpool(get_order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Заказ не найден")
     
     if not order["company_inn"]:
         raise HTTPException(status_code=400, detail="Сначала заполните реквизиты")
     
-    pdf_bytes = generate_invoice_pdf(order)
-    mark_pdf_generated(order_id)
+    content_hash = invoice_hash(order)
+    etag = f'"{content_hash}"'
+    cache_headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+    }
+    
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=cache_headers)
+    
+    pdf_bytes = await run_in_threadpool(get_cached_pdf, order_id, content_hash)
+    if pdf_bytes is None:
+        try:
+            pdf_bytes = await render_invoice(order)
+        except RendererBusy:
+            raise HTTPException(
+                status_code=503,
+                detail="Сервер занят формированием счетов, повторите через несколько секунд",
+                headers={"Retry-After": "5"},
+            )
+        await run_in_threadpool(save_cached_pdf, order_id, content_hash, pdf_bytes)
+    
+    if order["status"] in ("new", "rendering"):
+        await run_in_threadpool(mark_pdf_generated, order_id)
     
     filename = f"Invoice_{order['invoice_number']}.pdf"
     
@@ -245,30 +365,189 @@ async def download_pdf(order_id: int):
         content=pdf_bytes,
         media_type="application/pdf",
         headers={
-            "Content-Disposition": f'attachment; filename="{filename}"'
+            **cache_headers,
+            "Content-Disposition": attachment_header(filename)
         }
     )
 
 
 # ============== АДМИНКА ==============
 
+ADMIN_PAGE_SIZE = 50
+
+
+def parse_date(value: Optional[str]) -> Optional[date]:
+    """Дата из query-параметра (пустая строка — нет фильтра)"""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Неверная дата: {value}")
+
+
+def order_filters(
+    status: Optional[str] = None,
+    inn: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    customer: Optional[str] = None,
+    q: Optional[str] = None,
+) -> dict:
+    """Фильтры списка заказов из query-параметров"""
+    return {
+        "status": status or None,
+        "inn": inn or None,
+        "date_from": parse_date(date_from),
+        "date_to": parse_date(date_to),
+        "customer": customer or None,
+        "q": q.strip() if q and q.strip() else None,
+    }
+
+
 @app.get("/admin", response_class=HTMLResponse)
-async def admin_panel(request: Request):
+async def admin_panel(
+    request: Request,
+    status: Optional[str] = None,
+    inn: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    customer: Optional[str] = None,
+    q: Optional[str] = None,
+    cursor: Optional[str] = None,
+):
     """Админ-панель со списком заказов"""
+    filters = order_filters(status, inn, date_from, date_to, customer, q)
     try:
-        orders = get_all_orders()
-        return templates.TemplateResponse("admin.html", {
+        try:
+            orders, next_cursor = await run_in_threadpool(
+                list_orders, ADMIN_PAGE_SIZE, cursor or None, **filters
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Неверный курсор страницы")
+        
+        total_estimate = await run_in_threadpool(estimate_orders_count, **filters)
+        
+        query = {k: v for k, v in request.query_params.items() if k != "cursor" and v}
+        next_url = None
+        if next_cursor:
+            next_url = "/admin?" + urlencode({**query, "cursor": next_cursor})
+        
+        response = templates.TemplateResponse("admin.html", {
             "request": request,
             "orders": orders,
+            "filters": query,
+            "total_estimate": total_estimate,
+            "next_url": next_url,
+            "first_url": "/admin?" + urlencode(query) if cursor else None,
+            "export_url": "/admin/export/invoices.zip?" + urlencode(query),
+            "export_query": urlencode(query),
         })
-    except Exception as e:
+        response.headers["X-Total-Count-Estimate"] = str(total_estimate)
+        return response
+    except HTTPException:
+        raise
+    except Exception:
         import traceback
         error_text = traceback.format_exc()
-        print(f"ERROR in /admin: {error_text}")
+        logger.error("Error in /admin: %s", error_text)
         return HTMLResponse(content=f"<pre>Error: {error_text}</pre>", status_code=500)
 
 
 
+@app.get("/admin/events")
+async def admin_events(request: Request):
+    """Поток изменений заказов для открытой админки (Server-Sent Events)"""
+    try:
+        client = subscribe(resumed="last-event-id" in request.headers)
+    except TooManyClients:
+        raise HTTPException(
+            status_code=503,
+            detail="Слишком много открытых страниц админки",
+            headers={"Retry-After": "30"},
+        )
+    return StreamingResponse(
+        stream_events(client),
+        media_type="text/event-stream",
+        # Без буферизации в nginx и кэширования: события должны приходить сразу
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/admin/search/suggest")
+async def admin_search_suggest(q: str = ""):
+    """Подсказки поиска заказов по мере ввода"""
+    orders = await run_in_threadpool(
+        suggest_orders, q, SEARCH_SUGGEST_LIMIT, SEARCH_SUGGEST_TIMEOUT_MS
+    )
+    return [
+        {
+            "id": order["id"],
+            "invoice_number": order["invoice_number"],
+            "date": order["created_at"].strftime("%d.%m.%Y") if order["created_at"] else "",
+            "status": order["status"],
+            "title": order["company_name"] or order["customer_name"] or order["customer_email"] or "",
+            "inn": order["company_inn"] or "",
+            "url": f"/order/{order['id']}",
+        }
+        for order in orders
+    ]
+
+
+@app.get("/admin/reports", response_class=HTMLResponse)
+async def admin_reports(request: Request):
+    """Выручка по дням и месяцам, статусы, топ клиентов и просроченные счета"""
+    report = await run_in_threadpool(get_report, PAYMENT_DAYS)
+    return templates.TemplateResponse("reports.html", {
+        "request": request,
+        "report": report,
+        "payment_days": PAYMENT_DAYS,
+    })
+
+
+@app.get("/admin/export/invoices.zip")
+async def export_invoices_zip(
+    status: Optional[str] = None,
+    inn: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    customer: Optional[str] = None,
+    q: Optional[str] = None,
+):
+    """ZIP со всеми PDF счетов по фильтрам админки (отдаётся потоком)"""
+    filters = order_filters(status, inn, date_from, date_to, customer, q)
+    return StreamingResponse(
+        iter_invoices_zip(filters),
+        media_type="application/zip",
+        headers={"Content-Disposition": attachment_header("invoices.zip")},
+    )
+
+
+@app.get("/admin/export/orders.{fmt}")
+async def export_orders(
+    fmt: str,
+    status: Optional[str] = None,
+    inn: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    customer: Optional[str] = None,
+    q: Optional[str] = None,
+):
+    """Заказы с товарами для 1С: csv, xlsx или xml (CommerceML), потоком"""
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=404, detail=f"Неизвестный формат: {fmt}")
+    
+    filters = order_filters(status, inn, date_from, date_to, customer, q)
+    _, media_type = EXPORT_FORMATS[fmt]
+    # Синхронный генератор: Starlette читает его в пуле потоков
+    return StreamingResponse(
+        iter_export(fmt, filters),
+        media_type=media_type,
+        headers={"Content-Disposition": attachment_header(f"orders.{fmt}")},
+    )
+
+
+
 # ============== ГЛАВНАЯ ==============
 
 @app.get("/", response_class=HTMLResponse)
@@ -0,0 +1,112 @@
+"""Периодическое обслуживание БД, которое должен выполнять один процесс
+
+При нескольких воркерах (gunicorn, несколько машин) каждый запускает этот
+цикл, но работу делает только лидер — процесс, который держит сессионную
+advisory-блокировку PostgreSQL на отдельном соединении. Если лидер упал
+или потерял соединение, блокировка снимается сама, и её забирает другой.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+import psycopg2
+from starlette.concurrency import run_in_threadpool
+
+from config import (
+    DADATA_CACHE_TTL, DADATA_NEGATIVE_CACHE_TTL, MAINTENANCE_INTERVAL,
+    WEBHOOK_RETENTION_DAYS, RENDER_JOB_RETENTION_DAYS
+)
+from database import DATABASE_URL, fold_order_stats, purge_stale_rows
+from metrics import CallbackGauge
+
+logger = logging.getLogger(__name__)
+
+LEADER_LOCK_NAME = "invoicegen:maintenance"
+
+# Соединение, на котором держится блокировка лидера (вне пула)
+_leader_conn = None
+_task: Optional[asyncio.Task] = None
+
+CallbackGauge(
+    "maintenance_leader", "Этот процесс выполняет обслуживание БД",
+    lambda: 1 if _leader_conn is not None else 0
+)
+
+
+def try_become_leader() -> bool:
+    """Попытка захватить блокировку лидера; True — этот процесс лидер"""
+    global _leader_conn
+    if _leader_conn is not None:
+        try:
+            # Соединение живо — блокировка всё ещё наша
+            with _leader_conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            logger.warning("Lost maintenance leader connection")
+            release_leadership()
+    
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (LEADER_LOCK_NAME,))
+        acquired = cursor.fetchone()[0]
+    
+    if not acquired:
+        conn.close()
+        return False
+    
+    _leader_conn = conn
+    logger.info("This process is now the maintenance leader")
+    return True
+
+
+def release_leadership():
+    """Закрытие соединения лидера; блокировка снимается вместе с сессией"""
+    global _leader_conn
+    if _leader_conn is not None:
+        try:
+            _leader_conn.close()
+        except psycopg2.Error:
+            pass
+        _leader_conn = None
+
+
+def run_maintenance() -> dict:
+    deleted = purge_stale_rows(
+        WEBHOOK_RETENTION_DAYS, RENDER_JOB_RETENTION_DAYS,
+        DADATA_CACHE_TTL, DADATA_NEGATIVE_CACHE_TTL
+    )
+    folded = fold_order_stats()
+    logger.info("Maintenance done, deleted rows: %s, folded stats rows: %s", deleted, folded)
+    return deleted
+
+
+async def _run():
+    while True:
+        try:
+            if await run_in_threadpool(try_become_leader):
+                await run_in_threadpool(run_maintenance)
+        except Exception:
+            logger.exception("Maintenance error")
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+
+def start_maintenance():
+    """Запуск цикла обслуживания в текущем event loop (вызывается в startup)"""
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_run())
+
+
+async def stop_maintenance():
+    """Остановка цикла и передача лидерства другому процессу (вызывается в shutdown)"""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    await run_in_threadpool(release_leadership)
@@ -0,0 +1,322 @@
+"""Метрики приложения в текстовом формате Prometheus (отдаются на /metrics)
+
+Под gunicorn у каждого воркера свои значения, а /metrics обслуживает
+случайный воркер. Поэтому при заданном METRICS_DIR (gunicorn.conf.py
+задаёт его сам) каждый процесс раз в METRICS_FLUSH_SECONDS и при остановке
+пишет туда снимок своих метрик, а /metrics складывает снимки всех
+воркеров: счётчики и гистограммы суммируются, включая уже завершённые
+воркеры (mark_process_dead), мгновенные значения (gauge) отдаются по
+каждому живому воркеру с меткой worker. Значения других воркеров
+отстают не больше чем на METRICS_FLUSH_SECONDS.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Optional
+
+from config import METRICS_DIR, METRICS_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Границы бакетов гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_writer: Optional[asyncio.Task] = None
+
+# Снимок завершённых воркеров: их счётчики и гистограммы
+DEAD_SNAPSHOT = "dead.json"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = ""
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+    
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+    
+    def _header(self) -> list:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+    
+    def collect(self) -> dict:
+        """Текущие значения процесса: {значения меток: значение}"""
+        raise NotImplementedError
+    
+    def _samples(self, values: dict, labelnames: tuple) -> list:
+        return [
+            f"{self.name}{_format_labels(labelnames, key)} {value}"
+            for key, value in sorted(values.items())
+        ]
+    
+    def render(self, values: Optional[dict] = None, labelnames: Optional[tuple] = None) -> list:
+        """Строки метрики; по умолчанию — значения этого процесса"""
+        if values is None:
+            values = self.collect()
+        return self._header() + self._samples(values, labelnames or self.labelnames)
+
+
+class Counter(_Metric):
+    type = "counter"
+    
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def collect(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}   # labels -> [счётчики по бакетам..., сумма, количество]
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+    
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def collect(self) -> dict:
+        with self._lock:
+            return {key: list(state) for key, state in self._values.items()}
+    
+    def _samples(self, values: dict, labelnames: tuple) -> list:
+        lines = []
+        for key, state in sorted(values.items()):
+            for bound, count in zip(self.buckets, state):
+                labels = _format_labels(labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labelnames, key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(labelnames, key)} {state[-1]}")
+        return lines
+
+
+class CallbackGauge(_Metric):
+    """Значения считываются в момент запроса /metrics
+    
+    callback возвращает число или словарь {значение метки: число}.
+    """
+    type = "gauge"
+    
+    def __init__(self, name, documentation, callback, labelname: str = "", metric_type: str = "gauge"):
+        super().__init__(name, documentation, (labelname,) if labelname else ())
+        self.callback = callback
+        self.type = metric_type
+    
+    def collect(self) -> dict:
+        values = self.callback()
+        if not isinstance(values, dict):
+            return {(): values}
+        return {((key,) if self.labelnames else ()): value for key, value in values.items()}
+
+
+def timed(histogram: Histogram, **labels):
+    """Декоратор: время выполнения функции в гистограмму"""
+    def decorator(func):
+        func_labels = {"function": func.__name__, **labels}
+        
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**func_labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _add(total: dict, key: tuple, value):
+    current = total.get(key)
+    if current is None:
+        total[key] = value
+    elif isinstance(value, list):
+        if len(value) == len(current):
+            total[key] = [a + b for a, b in zip(current, value)]
+    else:
+        total[key] = current + value
+
+
+@contextmanager
+def _locked(directory: str, mode: int):
+    """Блокировка каталога снимков: чтение не видит наполовину слитый воркер"""
+    with open(os.path.join(directory, ".lock"), "a") as f:
+        fcntl.flock(f, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger.warning("Bad metrics snapshot %s", path)
+        return {}
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def write_snapshot(directory: str = METRICS_DIR):
+    """Снимок метрик этого процесса в directory/<pid>.json"""
+    snapshot = {
+        metric.name: {
+            "type": metric.type,
+            "values": [[list(key), value] for key, value in metric.collect().items()],
+        }
+        for metric in _registry
+    }
+    _write_json(os.path.join(directory, f"{os.getpid()}.json"), snapshot)
+
+
+def mark_process_dead(pid: int, directory: str = METRICS_DIR):
+    """Воркер завершился: его счётчики и гистограммы переносятся в общий
+    снимок завершённых, мгновенные значения отбрасываются
+    
+    Вызывается в мастере gunicorn (child_exit в gunicorn.conf.py).
+    """
+    path = os.path.join(directory, f"{pid}.json")
+    with _locked(directory, fcntl.LOCK_EX):
+        snapshot = _read_json(path)
+        if not snapshot:
+            return
+        dead_path = os.path.join(directory, DEAD_SNAPSHOT)
+        dead = _read_json(dead_path)
+        for name, metric in snapshot.items():
+            if metric["type"] == "gauge":
+                continue
+            total = {tuple(key): value for key, value in dead.get(name, {}).get("values", ())}
+            for key, value in metric["values"]:
+                _add(total, tuple(key), value)
+            dead[name] = {"type": metric["type"], "values": [[list(k), v] for k, v in total.items()]}
+        _write_json(dead_path, dead)
+        os.remove(path)
+
+
+def _render_merged(directory: str) -> list:
+    """Метрики всех воркеров из снимков в directory"""
+    os.makedirs(directory, exist_ok=True)
+    write_snapshot(directory)
+    with _locked(directory, fcntl.LOCK_SH):
+        names = [name for name in os.listdir(directory) if name.endswith(".json")]
+        snapshots = {name[:-5]: _read_json(os.path.join(directory, name)) for name in names}
+    dead = snapshots.pop(DEAD_SNAPSHOT[:-5], {})
+    
+    lines = []
+    for metric in _registry:
+        values = {}
+        if metric.type == "gauge":
+            for worker, snapshot in sorted(snapshots.items()):
+                for key, value in snapshot.get(metric.name, {}).get("values", ()):
+                    values[(worker, *key)] = value
+            lines.extend(metric.render(values, ("worker", *metric.labelnames)))
+            continue
+        for snapshot in [dead, *snapshots.values()]:
+            for key, value in snapshot.get(metric.name, {}).get("values", ()):
+                _add(values, tuple(key), value)
+        lines.extend(metric.render(values))
+    return lines
+
+
+def render_metrics() -> str:
+    """Все метрики в текстовом формате Prometheus (всех воркеров при METRICS_DIR)"""
+    if METRICS_DIR:
+        lines = _render_merged(METRICS_DIR)
+    else:
+        lines = []
+        for metric in _registry:
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def _write_loop():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            write_snapshot()
+        except OSError as e:
+            logger.warning("Cannot write metrics snapshot: %s", e)
+
+
+def start_metrics_writer():
+    """Периодическая запись снимка в METRICS_DIR (вызывается в startup)"""
+    global _writer
+    if METRICS_DIR and _writer is None:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        write_snapshot()
+        _writer = asyncio.create_task(_write_loop())
+
+
+async def stop_metrics_writer():
+    """Последний снимок перед завершением процесса (вызывается в shutdown)"""
+    global _writer
+    if _writer is None:
+        return
+    _writer.cancel()
+    try:
+        await _writer
+    except asyncio.CancelledError:
+        pass
+    _writer = None
+    try:
+        write_snapshot()
+    except OSError as e:
+        logger.warning("Cannot write metrics snapshot: %s", e)
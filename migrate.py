@@ -0,0 +1,61 @@
+"""Миграция схемы и перенос данных
+
+    python migrate.py                   # схема + перенос товаров в order_items
+    python migrate.py --batch-size 500 --pause 0.1
+
+Перенос идёт пачками по id, каждая пачка — отдельная короткая транзакция,
+поэтому таблица orders не блокируется и приложение продолжает работать.
+Запуск можно прервать и повторить: перенесённые строки пропускаются.
+"""
+import argparse
+import logging
+import time
+
+from database import (
+    init_pool, close_pool, init_db, backfill_order_items, rebuild_order_stats
+)
+
+logger = logging.getLogger("migrate")
+
+
+def run_backfill(batch_size: int, pause: float):
+    last_id = 0
+    total = 0
+    while True:
+        next_id = backfill_order_items(last_id, batch_size)
+        if next_id is None:
+            break
+        total += 1
+        last_id = next_id
+        logger.info("Backfilled batch %s, last order id %s", total, last_id)
+        if pause:
+            time.sleep(pause)
+    logger.info("Backfill finished")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграция базы InvoiceGen")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.0,
+                        help="Пауза между пачками, секунд")
+    parser.add_argument("--schema-only", action="store_true",
+                        help="Только создать таблицы и индексы")
+    parser.add_argument("--rebuild-stats", action="store_true",
+                        help="Пересчитать сводные таблицы отчётов")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s",
+    )
+    
+    init_pool()
+    try:
+        init_db()
+        if not args.schema_only:
+            run_backfill(args.batch_size, args.pause)
+        if args.rebuild_stats:
+            rebuild_order_stats()
+            logger.info("Report stats rebuilt")
+    finally:
+        close_pool()
@@ -0,0 +1,255 @@
+"""Живые обновления админки: изменения заказов из LISTEN/NOTIFY в SSE
+
+Триггер orders_notify (database.py) шлёт NOTIFY на каждый новый или
+изменённый заказ. Каждый процесс держит одно отдельное соединение с
+LISTEN, читает уведомления прямо в event loop (add_reader, без потоков),
+один раз рендерит строку таблицы и раздаёт готовое SSE-сообщение всем
+открытым страницам /admin этого процесса.
+
+У каждой страницы своя ограниченная очередь. Если страница не успевает
+забирать сообщения, ей отправляется reset, и она перезагружается сама,
+а не копит память процесса. То же происходит после переподключения к
+БД или браузера: пропущенные за это время уведомления не восстановить.
+
+uvicorn при остановке ждёт закрытия всех соединений и только потом
+вызывает shutdown приложения, поэтому в начале остановки сервера
+вызывается close_streams (см. uvicorn_worker.py): потоки отдают последнее
+сообщение и заканчиваются, браузер переподключается к другому процессу.
+"""
+import asyncio
+import json
+import logging
+import weakref
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Optional
+
+import psycopg2
+from starlette.concurrency import run_in_threadpool
+
+from config import SSE_CLIENT_QUEUE_SIZE, SSE_KEEPALIVE_SECONDS, SSE_MAX_CLIENTS
+from database import DATABASE_URL, ORDERS_CHANNEL
+from metrics import Counter, CallbackGauge
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 5
+
+ORDER_EVENTS = Counter(
+    "order_events_total", "Уведомления об изменении заказов", ("op",)
+)
+
+_conn = None
+_lost: Optional[asyncio.Event] = None
+_task: Optional[asyncio.Task] = None
+_render_row: Optional[Callable[[dict], str]] = None
+# Клиент попадает сюда в subscribe, чтобы SSE_MAX_CLIENTS учитывал и
+# потоки, которые ещё не начали отдаваться. Ссылки слабые: если ответ так и
+# не начался (браузер отключился раньше), finally в stream_events не
+# выполнится, но место освободится вместе с объектом клиента
+_clients = weakref.WeakSet()
+_closing = False
+
+CallbackGauge("admin_event_clients", "Открытые потоки /admin/events", lambda: len(_clients))
+
+
+class TooManyClients(Exception):
+    """Превышен SSE_MAX_CLIENTS"""
+
+
+class _Client:
+    """Открытая страница админки: очередь сообщений и признак переполнения"""
+    
+    def __init__(self):
+        self.queue = asyncio.Queue(SSE_CLIENT_QUEUE_SIZE)
+        self.reset = False
+        self.closing = False
+    
+    def send(self, message: str):
+        if self.reset or self.closing:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.reset = True
+            self._wake()
+    
+    def close(self):
+        """Процесс останавливается: поток нужно завершить"""
+        self.closing = True
+        self._wake()
+    
+    def _wake(self):
+        # Разбудить ожидающий генератор, очередь больше не нужна
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# Последнее сообщение при остановке процесса: браузер переподключится
+# через секунду (к другому процессу) и по Last-Event-ID перечитает список
+_CLOSE_MESSAGE = "retry: 1000\n" + _sse("close", {})
+
+
+def _broadcast(message: str):
+    for client in _clients:
+        client.send(message)
+
+
+def _order_message(payload: str) -> Optional[str]:
+    """SSE-сообщение со строкой таблицы из уведомления триггера"""
+    try:
+        order = json.loads(payload, parse_float=Decimal)
+        if order["created_at"]:
+            order["created_at"] = datetime.fromisoformat(order["created_at"])
+        html = _render_row(order)
+    except Exception:
+        logger.exception("Bad order notification: %s", payload[:200])
+        return None
+    ORDER_EVENTS.inc(op=order["op"].lower())
+    return _sse("order", {"id": order["id"], "op": order["op"].lower(), "html": html})
+
+
+def _on_notify():
+    """Данные в сокете LISTEN-соединения: разобрать все уведомления"""
+    try:
+        _conn.poll()
+    except psycopg2.Error as e:
+        logger.warning("Order events connection lost: %s", e)
+        _disconnect()
+        return
+    
+    while _conn.notifies:
+        message = _order_message(_conn.notifies.pop(0).payload)
+        if message is not None:
+            _broadcast(message)
+
+
+def _connect():
+    # keepalive: оборванное соединение обнаружит ОС, и сокет станет читаемым
+    conn = psycopg2.connect(
+        DATABASE_URL,
+        keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3
+    )
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f"LISTEN {ORDERS_CHANNEL}")
+    return conn
+
+
+def _disconnect():
+    global _conn
+    if _conn is not None:
+        asyncio.get_running_loop().remove_reader(_conn.fileno())
+        try:
+            _conn.close()
+        except psycopg2.Error:
+            pass
+        _conn = None
+    if _lost is not None:
+        _lost.set()
+
+
+async def _run():
+    """Поддержание LISTEN-соединения; после обрыва — переподключение"""
+    global _conn
+    loop = asyncio.get_running_loop()
+    reconnect = False
+    while True:
+        try:
+            _conn = await run_in_threadpool(_connect)
+        except psycopg2.Error as e:
+            logger.warning("Order events: cannot connect (%s), retry in %ss", e, RECONNECT_DELAY)
+            await asyncio.sleep(RECONNECT_DELAY)
+            continue
+        
+        _lost.clear()
+        loop.add_reader(_conn.fileno(), _on_notify)
+        if reconnect:
+            # Уведомления за время обрыва потеряны — страницы перечитают список
+            _broadcast(_sse("reset", {}))
+        reconnect = True
+        
+        await _lost.wait()
+        await asyncio.sleep(RECONNECT_DELAY)
+
+
+def subscribe(resumed: bool = False) -> "_Client":
+    """Очередь для новой страницы; resumed — браузер переподключается после обрыва
+    
+    Бросает TooManyClients, если процесс уже держит SSE_MAX_CLIENTS потоков.
+    Место занято с этого момента и освобождается, когда поток stream_events
+    закончится.
+    """
+    if len(_clients) >= SSE_MAX_CLIENTS:
+        raise TooManyClients()
+    client = _Client()
+    if resumed:
+        client.send(None)
+    _clients.add(client)
+    return client
+
+
+async def stream_events(client: "_Client"):
+    """Поток SSE для одной страницы админки (client — из subscribe)"""
+    try:
+        if _closing:
+            yield _CLOSE_MESSAGE
+            return
+        # retry — пауза браузера перед переподключением; id нужен, чтобы при
+        # переподключении пришёл Last-Event-ID и страница перечитала список
+        yield "retry: 3000\nid: 1\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(client.queue.get(), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Комментарий не даёт прокси закрыть «молчащее» соединение
+                yield ": keepalive\n\n"
+                continue
+            if message is None:
+                yield _CLOSE_MESSAGE if client.closing else _sse("reset", {})
+                return
+            yield message
+    finally:
+        _clients.discard(client)
+
+
+def start_order_events(render_row: Callable[[dict], str]):
+    """Запуск слушателя в текущем event loop (вызывается в startup)
+    
+    render_row(order) возвращает HTML строки таблицы заказов.
+    """
+    global _task, _render_row, _lost
+    if _task is None:
+        _render_row = render_row
+        _lost = asyncio.Event()
+        _task = asyncio.create_task(_run())
+
+
+def close_streams():
+    """Завершение всех потоков страниц (в начале остановки сервера)
+    
+    Новые потоки после этого сразу отдают последнее сообщение и закрываются.
+    """
+    global _closing
+    _closing = True
+    for client in list(_clients):
+        client.close()
+
+
+async def stop_order_events():
+    """Остановка слушателя и закрытие потоков страниц (вызывается в shutdown)"""
+    global _task
+    close_streams()
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    _disconnect()
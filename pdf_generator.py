@@ -4,53 +4,280 @@ from reportlab.pdfgen import canvas
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib import colors
+from reportlab.lib.utils import simpleSplit
+from reportlab import rl_config
 from datetime import datetime, timedelta
-from num2words import num2words
+from functools import lru_cache
 from io import BytesIO
+from pathlib import Path
+import json
 
-from config import COMPANY, PAYMENT_DAYS
+import config
+from amount_words import CURRENCIES, amount_in_words, normalize_currency
 
+# Потоки PDF только сжимаем zlib, без ASCII85 поверх: без C-ускорителя
+# reportlab кодирование ASCII85 занимает больше половины времени рендера
+rl_config.useA85 = 0
 
-def number_to_words_ru(number: float) -> str:
-    """Преобразование числа в сумму прописью на русском"""
-    rubles = int(number)
-    kopeks = int(round((number - rubles) * 100))
+# При изменении вёрстки увеличьте PDF_LAYOUT_VERSION в pdf_hash.py
+
+
+# Шрифты с кириллицей лежат в репозитории, в PDF попадают только использованные глифы
+FONT_DIR = Path(__file__).resolve().parent / "fonts"
+FONT = "DejaVuSans"
+FONT_BOLD = "DejaVuSans-Bold"
+
+# Поля страницы
+PAGE_WIDTH, PAGE_HEIGHT = A4
+LEFT_MARGIN = 20*mm
+TOP_Y = PAGE_HEIGHT - 30*mm
+BOTTOM_Y = 20*mm
+
+# Колонки таблицы товаров
+COL_X = [LEFT_MARGIN, LEFT_MARGIN + 10*mm, LEFT_MARGIN + 100*mm, LEFT_MARGIN + 140*mm]
+TABLE_WIDTH = 170*mm
+NAME_WIDTH = COL_X[2] - COL_X[1] - 4*mm
+PERIOD_WIDTH = COL_X[3] - COL_X[2] - 4*mm
+ROW_HEIGHT = 6*mm
+
+# НДС и ИТОГО под таблицей, без строк суммы прописью
+TOTALS_HEIGHT = 15*mm
+
+# Отступ текста после подписи "Агент:" / "Клиент:"
+LABEL_WIDTH = 15*mm
+
+LINE_HEIGHT = 4*mm
+TERMS_LINE_HEIGHT = 3.5*mm
+
+
+@lru_cache(maxsize=None)
+def register_fonts():
+    """Регистрирует TTF-шрифты в ReportLab (разбор файлов — один раз на процесс)"""
+    pdfmetrics.registerFont(TTFont(FONT, str(FONT_DIR / "DejaVuSans.ttf")))
+    pdfmetrics.registerFont(TTFont(FONT_BOLD, str(FONT_DIR / "DejaVuSans-Bold.ttf")))
+
+
+def _wrap(text: str, font: str, size: float, width: float) -> list:
+    """Строки текста, уложенные по ширине"""
+    return simpleSplit(text, font, size, width) or [""]
+
+
+def _layout_key() -> str:
+    """Всё, от чего зависит статичная часть счёта"""
+    return json.dumps([config.COMPANY, config.PAYMENT_DAYS], ensure_ascii=False, sort_keys=True)
+
+
+@lru_cache(maxsize=16)
+def _static_layout(layout_key: str, currency: str) -> dict:
+    """Статичные части счёта в виде готового содержимого страницы
     
-    rubles_word = num2words(rubles, lang='ru')
+    Строится один раз на процесс для каждой валюты (и заново, если
+    поменялись реквизиты в config.COMPANY). Блоки описываются командами
+    ("font", имя, размер), ("text", x, y, строка), ("fill", цвет),
+    ("rect", x, y, ширина, высота, заливка): рендеру остаётся только
+    нарисовать их, без переноса строк и форматирования.
+    """
+    register_fonts()
+    company, payment_days = json.loads(layout_key)
     
-    last_two = rubles % 100
-    last_one = rubles % 10
+    # === ШАПКА С РЕКВИЗИТАМИ БАНКА И ИСПОЛНИТЕЛЕМ ===
+    header = []
+    y = TOP_Y
+    header.append(("font", FONT_BOLD, 10))
+    header.append(("text", LEFT_MARGIN, y, "Получатель:"))
+    y -= 5*mm
     
-    if 11 <= last_two <= 19:
-        rub_form = "рублей"
-    elif last_one == 1:
-        rub_form = "рубль"
-    elif 2 <= last_one <= 4:
-        rub_form = "рубля"
-    else:
-        rub_form = "рублей"
+    header.append(("font", FONT, 9))
+    header.append(("text", LEFT_MARGIN, y, f"ИНН {company['inn']} КПП {company['kpp']}"))
+    y -= LINE_HEIGHT
+    for line in _wrap(company["name"], FONT, 9, TABLE_WIDTH):
+        header.append(("text", LEFT_MARGIN, y, line))
+        y -= LINE_HEIGHT
+    header.append(("text", LEFT_MARGIN, y, f"Р/сч. № {company['account']}"))
+    y -= 6*mm
     
-    kop_last_two = kopeks % 100
-    kop_last_one = kopeks % 10
+    header.append(("font", FONT_BOLD, 10))
+    header.append(("text", LEFT_MARGIN, y, "Банк получателя:"))
+    y -= 5*mm
     
-    if 11 <= kop_last_two <= 19:
-        kop_form = "копеек"
-    elif kop_last_one == 1:
-        kop_form = "копейка"
-    elif 2 <= kop_last_one <= 4:
-        kop_form = "копейки"
-    else:
-        kop_form = "копеек"
+    header.append(("font", FONT, 9))
+    for line in _wrap(company["bank_name"], FONT, 9, TABLE_WIDTH):
+        header.append(("text", LEFT_MARGIN, y, line))
+        y -= LINE_HEIGHT
+    header.append(("text", LEFT_MARGIN, y, f"БИК {company['bik']} К/сч. № {company['corr_account']}"))
+    y -= 10*mm
     
-    return f"{rubles_word.capitalize()} {rub_form} {kopeks:02d} {kop_form}"
+    # Заголовок с номером счёта рисуется поверх, на этой высоте
+    title_y = y
+    y -= 10*mm
+    
+    header.append(("font", FONT_BOLD, 9))
+    header.append(("text", LEFT_MARGIN, y, "Агент:"))
+    header.append(("font", FONT, 9))
+    agent = f"{company['name']}, ИНН: {company['inn']}, КПП: {company['kpp']}"
+    for line in _wrap(agent, FONT, 9, TABLE_WIDTH - LABEL_WIDTH):
+        header.append(("text", LEFT_MARGIN + LABEL_WIDTH, y, line))
+        y -= LINE_HEIGHT
+    for line in _wrap(f"Адрес: {company['address']}", FONT, 9, TABLE_WIDTH):
+        header.append(("text", LEFT_MARGIN, y, line))
+        y -= LINE_HEIGHT
+    header.append(("text", LEFT_MARGIN, y, f"Тел.: {company['phone']}, Email: {company['email']}"))
+    y -= 6*mm
+    
+    # === ЗАГОЛОВОК ТАБЛИЦЫ (координаты от базовой линии y = 0) ===
+    table_header = [
+        ("fill", colors.lightgrey),
+        ("rect", LEFT_MARGIN, -2*mm, TABLE_WIDTH, 7*mm, True),
+        ("fill", colors.black),
+        ("font", FONT_BOLD, 9),
+        ("text", COL_X[0] + 2*mm, 0, "№"),
+        ("text", COL_X[1] + 2*mm, 0, "Наименование"),
+        ("text", COL_X[2] + 2*mm, 0, "Период"),
+        ("text", COL_X[3] + 2*mm, 0, f"Сумма, {CURRENCIES[currency]['short']}"),
+    ]
+    
+    # === УСЛОВИЯ ОФЕРТЫ (координаты от первой строки y = 0) ===
+    terms_paragraphs = [
+        "Настоящий Счёт-оферта является письменным предложением (офертой) Агента заключить Договор "
+        "в соответствии со ст. 432–444 ГК РФ. Договор заключается путём принятия (акцепта) оферты Клиентом.",
+        "",
+        "1. Предмет Договора.",
+        "1.1. По настоящему договору Агент обязуется оказать услуги, перечисленные в Счёте, "
+        "а Клиент обязуется оплатить эти услуги.",
+        "",
+        "2. Порядок расчётов.",
+        f"2.1. Клиент обязуется оплатить Счёт-оферту в течение {payment_days}-х рабочих дней с момента получения.",
+        "2.2. Обязанность Клиента по оплате считается исполненной с момента поступления денежных средств "
+        "на расчётный счёт Агента.",
+        "",
+        "3. Срок действия Договора.",
+        "3.1. Договор вступает в действие с момента акцепта (оплаты Счёта-оферты) до момента выполнения услуг.",
+    ]
+    terms = [("font", FONT, 7)]
+    line_count = 0
+    for paragraph in terms_paragraphs:
+        for line in _wrap(paragraph, FONT, 7, TABLE_WIDTH):
+            if line:
+                terms.append(("text", LEFT_MARGIN, -line_count * TERMS_LINE_HEIGHT, line))
+            line_count += 1
+    
+    return {
+        "header": header,
+        "table_header": table_header,
+        "terms": terms,
+        "title_y": title_y,
+        "body_y": y,
+        "terms_height": line_count * TERMS_LINE_HEIGHT,
+    }
+
+
+def _draw_ops(c: canvas.Canvas, ops: list):
+    for op in ops:
+        kind = op[0]
+        if kind == "text":
+            c.drawString(op[1], op[2], op[3])
+        elif kind == "font":
+            c.setFont(op[1], op[2])
+        elif kind == "fill":
+            c.setFillColor(op[1])
+        elif kind == "rect":
+            c.rect(op[1], op[2], op[3], op[4], fill=op[5], stroke=True)
+
+
+def _draw_block(c: canvas.Canvas, ops: list, y: float = 0):
+    """Статичный блок с координатами от y = 0 на высоте y"""
+    c.saveState()
+    if y:
+        c.translate(0, y)
+    _draw_ops(c, ops)
+    c.restoreState()
+
+
+def _draw_table_header(c: canvas.Canvas, layout: dict, y: float):
+    """Шапка таблицы на высоте y
+    
+    Она повторяется на каждой странице таблицы, поэтому рисуется один раз
+    на документ в form XObject, а на страницах только вставляется.
+    """
+    if not c.hasForm("table_header"):
+        c.beginForm("table_header", lowery=-5*mm, uppery=10*mm)
+        _draw_ops(c, layout["table_header"])
+        c.endForm()
+    c.saveState()
+    c.translate(0, y)
+    c.doForm("table_header")
+    c.restoreState()
+
+
+def _format_money(value) -> str:
+    return f"{value:,.2f}".replace(",", " ")
+
+
+def _table_rows(products: list):
+    """Строки таблицы с переносом текста по ширине колонок и высотой строки"""
+    for idx, product in enumerate(products, 1):
+        name = _wrap(product["name"], FONT, 9, NAME_WIDTH)
+        period = _wrap(product.get("period", "-") or "-", FONT, 9, PERIOD_WIDTH)
+        height = ROW_HEIGHT + (max(len(name), len(period)) - 1) * LINE_HEIGHT
+        yield idx, name, period, product["amount"], height
+
+
+def _draw_carry(c: canvas.Canvas, y: float, label: str, amount):
+    c.setFont(FONT_BOLD, 9)
+    c.drawRightString(COL_X[3] - 2*mm, y, label)
+    c.drawString(COL_X[3] + 2*mm, y, _format_money(amount))
+    c.setFont(FONT, 9)
+
+
+def _draw_table(c: canvas.Canvas, layout: dict, products: list, y: float) -> float:
+    """Таблица товаров с разбиением на страницы
+    
+    На каждой новой странице повторяется шапка таблицы, а сумма строк
+    с предыдущих страниц переносится отдельной строкой. Каждая строка
+    измеряется и рисуется один раз, поэтому время растёт линейно.
+    Возвращает y под последней строкой.
+    """
+    _draw_table_header(c, layout, y)
+    y -= 7*mm
+    c.setFont(FONT, 9)
+    
+    subtotal = 0
+    for idx, name, period, amount, height in _table_rows(products):
+        # Под строкой должно остаться место для строки переноса
+        if y + 4*mm - height - ROW_HEIGHT < BOTTOM_Y:
+            _draw_carry(c, y, "Итого на странице, к переносу:", subtotal)
+            c.showPage()
+            y = PAGE_HEIGHT - 20*mm
+            _draw_table_header(c, layout, y)
+            y -= 7*mm
+            _draw_carry(c, y, "Перенос с предыдущей страницы:", subtotal)
+            y -= ROW_HEIGHT
+        
+        c.rect(LEFT_MARGIN, y + 4*mm - height, TABLE_WIDTH, height, fill=False, stroke=True)
+        c.drawString(COL_X[0] + 2*mm, y, str(idx))
+        for i, line in enumerate(name):
+            c.drawString(COL_X[1] + 2*mm, y - i * LINE_HEIGHT, line)
+        for i, line in enumerate(period):
+            c.drawString(COL_X[2] + 2*mm, y - i * LINE_HEIGHT, line)
+        c.drawString(COL_X[3] + 2*mm, y, _format_money(amount))
+        
+        subtotal += amount
+        y -= height
+    
+    return y
 
 
 def generate_invoice_pdf(order: dict) -> bytes:
-    """Генерация PDF счёта-оферты"""
+    """Генерация PDF счёта-оферты
+    
+    Реквизиты исполнителя, шапка таблицы и условия оферты берутся готовыми
+    из _static_layout; на каждый заказ считаются только его собственные данные.
+    """
+    currency = normalize_currency(order.get("currency"))
+    layout = _static_layout(_layout_key(), currency)
     
     buffer = BytesIO()
     c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
     
     # Подготавливаем данные
     created_at = order["created_at"]
@@ -59,141 +286,88 @@ def generate_invoice_pdf(order: dict) -> bytes:
     else:
         invoice_date = created_at
     
-    payment_date = invoice_date + timedelta(days=PAYMENT_DAYS)
+    payment_date = invoice_date + timedelta(days=config.PAYMENT_DAYS)
     total_amount = order["total_amount"]
-    total_words = number_to_words_ru(total_amount)
-    
-    # Начальная позиция
-    y = height - 30*mm
-    left_margin = 20*mm
-    
-    # === ШАПКА С РЕКВИЗИТАМИ БАНКА ===
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(left_margin, y, "Poluchatel:")
-    y -= 5*mm
-    
-    c.setFont("Helvetica", 9)
-    c.drawString(left_margin, y, f"INN {COMPANY['inn']} KPP {COMPANY['kpp']}")
-    y -= 4*mm
-    c.drawString(left_margin, y, f"{COMPANY['name']}")
-    y -= 4*mm
-    c.drawString(left_margin, y, f"R/Sch. No {COMPANY['account']}")
-    y -= 6*mm
-    
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(left_margin, y, "Bank poluchatelya:")
-    y -= 5*mm
+    total_words = amount_in_words(total_amount, currency)
     
-    c.setFont("Helvetica", 9)
-    c.drawString(left_margin, y, f"{COMPANY['bank_name']}")
-    y -= 4*mm
-    c.drawString(left_margin, y, f"BIK {COMPANY['bik']} K/Sch. No {COMPANY['corr_account']}")
-    y -= 10*mm
+    # === ШАПКА (статичная) И ЗАГОЛОВОК СЧЁТА ===
+    _draw_block(c, layout["header"])
     
-    # === ЗАГОЛОВОК СЧЁТА ===
-    c.setFont("Helvetica-Bold", 14)
-    title = f"Schet-oferta {order['invoice_number']} ot {invoice_date.strftime('%d.%m.%Y')}"
-    c.drawCentredString(width/2, y, title)
-    y -= 10*mm
-    
-    # === СТОРОНЫ ===
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(left_margin, y, "Agent:")
-    c.setFont("Helvetica", 9)
-    c.drawString(left_margin + 15*mm, y, f"{COMPANY['name']}, INN: {COMPANY['inn']}, KPP: {COMPANY['kpp']}")
-    y -= 4*mm
-    c.drawString(left_margin, y, f"Adres: {COMPANY['address']}")
-    y -= 4*mm
-    c.drawString(left_margin, y, f"Tel.: {COMPANY['phone']}, Email: {COMPANY['email']}")
-    y -= 6*mm
+    c.setFont(FONT_BOLD, 14)
+    title = f"Счёт-оферта № {order['invoice_number']} от {invoice_date.strftime('%d.%m.%Y')}"
+    c.drawCentredString(PAGE_WIDTH/2, layout["title_y"], title)
+    y = layout["body_y"]
     
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(left_margin, y, "Klient:")
-    c.setFont("Helvetica", 9)
-    kpp_text = f", KPP: {order['company_kpp']}" if order.get("company_kpp") else ""
-    c.drawString(left_margin + 15*mm, y, f"{order['company_name']}, INN: {order['company_inn']}{kpp_text}")
-    y -= 4*mm
+    # === КЛИЕНТ ===
+    c.setFont(FONT_BOLD, 9)
+    c.drawString(LEFT_MARGIN, y, "Клиент:")
+    c.setFont(FONT, 9)
+    kpp_text = f", КПП: {order['company_kpp']}" if order.get("company_kpp") else ""
+    client = f"{order['company_name']}, ИНН: {order['company_inn']}{kpp_text}"
+    for line in _wrap(client, FONT, 9, TABLE_WIDTH - LABEL_WIDTH):
+        c.drawString(LEFT_MARGIN + LABEL_WIDTH, y, line)
+        y -= LINE_HEIGHT
     
     if order.get("company_address"):
-        c.drawString(left_margin, y, f"Adres: {order['company_address'][:80]}")
-        y -= 4*mm
+        for line in _wrap(f"Адрес: {order['company_address']}", FONT, 9, TABLE_WIDTH):
+            c.drawString(LEFT_MARGIN, y, line)
+            y -= LINE_HEIGHT
     
     y -= 2*mm
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(left_margin, y, f"Srok oplaty: {payment_date.strftime('%d.%m.%Y')}")
+    c.setFont(FONT_BOLD, 9)
+    c.drawString(LEFT_MARGIN, y, f"Срок оплаты: {payment_date.strftime('%d.%m.%Y')}")
     y -= 8*mm
     
     # === ТАБЛИЦА ТОВАРОВ ===
-    c.setFont("Helvetica-Bold", 9)
+    y = _draw_table(c, layout, order["products"], y)
     
-    # Заголовки таблицы
-    col_x = [left_margin, left_margin + 10*mm, left_margin + 100*mm, left_margin + 140*mm]
-    
-    c.setFillColor(colors.lightgrey)
-    c.rect(left_margin, y - 2*mm, 170*mm, 7*mm, fill=True, stroke=True)
-    c.setFillColor(colors.black)
-    
-    c.drawString(col_x[0] + 2*mm, y, "No")
-    c.drawString(col_x[1] + 2*mm, y, "Naimenovanie")
-    c.drawString(col_x[2] + 2*mm, y, "Period")
-    c.drawString(col_x[3] + 2*mm, y, "Summa, rub.")
-    y -= 7*mm
-    
-    # Строки товаров
-    c.setFont("Helvetica", 9)
-    for idx, product in enumerate(order["products"], 1):
-        c.rect(left_margin, y - 2*mm, 170*mm, 6*mm, fill=False, stroke=True)
-        c.drawString(col_x[0] + 2*mm, y, str(idx))
-        
-        name = product["name"][:45] if len(product["name"]) > 45 else product["name"]
-        c.drawString(col_x[1] + 2*mm, y, name)
-        c.drawString(col_x[2] + 2*mm, y, product.get("period", "-") or "-")
-        c.drawString(col_x[3] + 2*mm, y, f"{product['amount']:,.2f}".replace(",", " "))
-        y -= 6*mm
+    # НДС, ИТОГО и сумма прописью не разрываются между страницами
+    words_lines = _wrap(f"Всего к оплате: {total_words}", FONT_BOLD, 9, TABLE_WIDTH)
+    if y - TOTALS_HEIGHT - len(words_lines) * LINE_HEIGHT < BOTTOM_Y:
+        c.showPage()
+        y = PAGE_HEIGHT - 20*mm
     
     # НДС
     y -= 2*mm
-    c.drawString(col_x[2] + 2*mm, y, "NDS:")
-    c.drawString(col_x[3] + 2*mm, y, "Bez NDS")
+    c.setFont(FONT, 9)
+    c.drawString(COL_X[2] + 2*mm, y, "НДС:")
+    c.drawString(COL_X[3] + 2*mm, y, "Без НДС")
     y -= 5*mm
     
     # ИТОГО
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(col_x[2] + 2*mm, y, "ITOGO:")
-    c.drawString(col_x[3] + 2*mm, y, f"{total_amount:,.2f}".replace(",", " "))
+    c.setFont(FONT_BOLD, 10)
+    c.drawString(COL_X[2] + 2*mm, y, "ИТОГО:")
+    c.drawString(COL_X[3] + 2*mm, y, _format_money(total_amount))
     y -= 8*mm
     
     # === СУММА ПРОПИСЬЮ ===
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(left_margin, y, f"Vsego k oplate: {total_words}")
-    y -= 10*mm
-    
-    # === УСЛОВИЯ ОФЕРТЫ ===
-    c.setFont("Helvetica", 7)
-    terms = [
-        "Nastoyaschiy Schet-oferta yavlyaetsya pismennym predlozheniem (ofertoy) Agenta zaklyuchit Dogovor",
-        "v sootvetstvii so st. 432-444 GK RF. Dogovor zaklyuchaetsya putem prinyatiya (aktsepta) oferty Klientom.",
-        "",
-        "1. Predmet Dogovora.",
-        "1.1. Po nastoyaschemu dogovoru Agent obyazuetsya okazat uslugi, perechislennye v Schete, a Klient obyazuetsya oplatit eti uslugi.",
-        "",
-        "2. Poryadok raschetov.",
-        "2.1. Klient obyazuetsya oplatit Schet-ofertu v techenie 3-h rabochih dney s momenta polucheniya.",
-        "2.2. Obyazannost Klienta po oplate schitaetsya ispolnennoy s momenta postupleniya denezhnyh sredstv na raschetnyy schet Agenta.",
-        "",
-        "3. Srok deystviya Dogovora.",
-        "3.1. Dogovor vstupaet v deystvie s momenta aktsepta (oplaty Scheta-oferty) do momenta vypolneniya uslug.",
-    ]
+    c.setFont(FONT_BOLD, 9)
+    for line in words_lines:
+        c.drawString(LEFT_MARGIN, y, line)
+        y -= LINE_HEIGHT
+    y -= 6*mm
     
-    for line in terms:
-        if y < 20*mm:
-            c.showPage()
-            y = height - 20*mm
-            c.setFont("Helvetica", 7)
-        c.drawString(left_margin, y, line)
-        y -= 3.5*mm
+    # === УСЛОВИЯ ОФЕРТЫ (статичные) ===
+    if y - layout["terms_height"] < BOTTOM_Y:
+        c.showPage()
+        y = PAGE_HEIGHT - 20*mm
+    _draw_block(c, layout["terms"], y)
     
     c.save()
     
     buffer.seek(0)
     return buffer.getvalue()
+
+
+def warm_up():
+    """Прогрев процесса: один пробный рендер, чтобы загрузить шрифты и кэши ReportLab"""
+    generate_invoice_pdf({
+        "invoice_number": "WARMUP",
+        "created_at": datetime.now(),
+        "total_amount": 1.0,
+        "products": [{"name": "Warm-up", "amount": 1.0, "period": ""}],
+        "company_name": "Warm-up",
+        "company_inn": "0000000000",
+        "company_kpp": "",
+        "company_address": "",
+    })
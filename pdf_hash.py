@@ -0,0 +1,30 @@
+"""Ключ кэша готовых PDF
+
+Отдельно от pdf_generator, чтобы веб-процессу не приходилось
+импортировать ReportLab ради одного хэша: рендер идёт в пуле процессов.
+"""
+import hashlib
+import json
+
+import config
+
+# Меняйте при изменении вёрстки в pdf_generator, чтобы сбросить кэш готовых PDF
+PDF_LAYOUT_VERSION = 5
+
+# Поля заказа, которые попадают в PDF
+PDF_ORDER_FIELDS = (
+    "invoice_number", "created_at", "total_amount", "products",
+    "company_name", "company_inn", "company_kpp", "company_address", "currency",
+)
+
+
+def invoice_hash(order: dict) -> str:
+    """Хэш содержимого счёта: данные заказа, реквизиты продавца и версия вёрстки"""
+    payload = {
+        "order": {field: order.get(field) for field in PDF_ORDER_FIELDS},
+        "company": config.COMPANY,
+        "payment_days": config.PAYMENT_DAYS,
+        "layout": PDF_LAYOUT_VERSION,
+    }
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
@@ -0,0 +1,107 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from config import PDF_WORKERS, PDF_QUEUE_LIMIT
+from metrics import Histogram, CallbackGauge
+
+# Рендеринг ReportLab занимает CPU, поэтому выполняется в отдельных процессах.
+# Процессы порождаются от forkserver, в котором pdf_generator уже импортирован,
+# и каждый при старте делает пробный рендер (warm_up).
+_executor: Optional[ProcessPoolExecutor] = None
+
+# Сколько рендеров сейчас выполняется или ждёт свободного процесса
+_pending = 0
+
+
+PDF_RENDER_SECONDS = Histogram(
+    "pdf_render_duration_seconds", "Время рендеринга PDF, включая ожидание процесса"
+)
+PDF_SIZE_BYTES = Histogram(
+    "pdf_size_bytes", "Размер готового PDF",
+    buckets=(10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 5_000_000)
+)
+CallbackGauge(
+    "pdf_renderer_tasks", "Загрузка пула рендеринга",
+    lambda: {"pending": _pending, "workers": PDF_WORKERS, "queue_limit": PDF_QUEUE_LIMIT},
+    labelname="state"
+)
+
+
+class RendererBusy(Exception):
+    """Очередь рендеринга переполнена"""
+
+
+def _init_worker():
+    import pdf_generator
+    pdf_generator.warm_up()
+
+
+def _ping() -> bool:
+    return True
+
+
+def _render(order: dict) -> bytes:
+    # Импорт внутри процесса рендеринга: веб-процессу ReportLab не нужен
+    from pdf_generator import generate_invoice_pdf
+    return generate_invoice_pdf(order)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["pdf_generator"])
+        _executor = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            mp_context=ctx,
+            initializer=_init_worker,
+        )
+    return _executor
+
+
+def start_renderer():
+    """Запуск и прогрев всех процессов рендеринга (вызывается в startup)"""
+    executor = _get_executor()
+    futures = [executor.submit(_ping) for _ in range(PDF_WORKERS)]
+    for future in futures:
+        future.result()
+
+
+def stop_renderer(wait: bool = True):
+    """Остановка процессов рендеринга (вызывается в shutdown)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait, cancel_futures=not wait)
+        _executor = None
+
+
+async def render_invoice(order: dict, check_queue: bool = True) -> bytes:
+    """Рендеринг PDF счёта в пуле процессов
+    
+    Если в очереди уже PDF_QUEUE_LIMIT заказов, сразу бросает RendererBusy,
+    чтобы клиент повторил запрос позже, а не ждал в бесконечной очереди.
+    """
+    global _executor, _pending
+    
+    if check_queue and _pending >= PDF_QUEUE_LIMIT:
+        raise RendererBusy(f"{_pending} invoices are already rendering")
+    
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        executor = _get_executor()
+        with PDF_RENDER_SECONDS.time():
+            pdf = await loop.run_in_executor(executor, _render, order)
+        PDF_SIZE_BYTES.observe(len(pdf))
+        return pdf
+    except BrokenProcessPool:
+        # Процесс упал (например, OOM) — следующий запрос поднимет пул заново
+        if _executor is executor:
+            _executor = None
+            executor.shutdown(wait=False)
+        raise
+    finally:
+        _pending -= 1
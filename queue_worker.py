@@ -0,0 +1,81 @@
+"""Общий цикл фоновых обработчиков очередей в БД (webhook_inbox, render_jobs)
+
+Обработчик берёт пачку записей, пока они есть; очередь пуста — ждёт
+notify() или poll_interval секунд. Записи берутся с арендой, поэтому
+упавший процесс не теряет их: они вернутся в очередь после её истечения.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from config import SHUTDOWN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempts: int) -> int:
+    """Пауза перед повтором: 10 с, 20 с, 40 с ... но не больше часа"""
+    return min(10 * 2 ** (attempts - 1), 3600)
+
+
+class QueueWorker:
+    """Фоновая задача event loop, обрабатывающая очередь пачками
+    
+    process_pending() обрабатывает одну пачку и возвращает её размер.
+    """
+    
+    def __init__(self, name: str, process_pending: Callable[[], Awaitable[int]], poll_interval: float):
+        self.name = name
+        self.process_pending = process_pending
+        self.poll_interval = poll_interval
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+    
+    async def _run(self):
+        while not self._stopping:
+            try:
+                processed = await self.process_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("%s error", self.name)
+                processed = 0
+            
+            if processed:
+                continue
+            
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+    
+    def notify(self):
+        """Разбудить обработчик: в очереди новая запись"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    def start(self):
+        """Запуск в текущем event loop (вызывается в startup)"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """Остановка (вызывается в shutdown)
+        
+        Текущая пачка дорабатывается до конца, новые не берутся; если она не
+        успела за timeout секунд, задача отменяется, а незавершённые записи
+        вернутся в очередь после истечения аренды.
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            logger.warning("%s did not finish in %ss, cancelled", self.name, timeout)
+        self._task = None
+        self._stopping = False
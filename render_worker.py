@@ -0,0 +1,89 @@
+"""Фоновый рендер PDF из таблицы render_jobs
+
+Задача ставится в update_order_company; к моменту, когда клиент нажмёт
+«Скачать», счёт уже лежит в pdf_cache и отдаётся без ожидания ReportLab.
+"""
+import asyncio
+import logging
+
+from starlette.concurrency import run_in_threadpool
+
+from config import PDF_WORKERS, SHUTDOWN_TIMEOUT
+from database import (
+    claim_render_jobs, complete_render_job, fail_render_job,
+    get_order, get_cached_pdf, save_cached_pdf
+)
+from metrics import Counter
+from pdf_hash import invoice_hash
+from pdf_renderer import render_invoice
+from queue_worker import QueueWorker, retry_delay
+
+logger = logging.getLogger(__name__)
+
+RENDER_JOBS = Counter(
+    "render_jobs_total", "Задачи фонового рендера PDF", ("result",)
+)
+
+RENDER_BATCH_SIZE = PDF_WORKERS     # не занимаем больше процессов, чем есть
+RENDER_POLL_INTERVAL = 5
+RENDER_LEASE_SECONDS = 120
+RENDER_MAX_ATTEMPTS = 5
+
+async def process_job(job: dict) -> str:
+    """Рендер и сохранение PDF одного заказа"""
+    order = await run_in_threadpool(get_order, job["order_id"])
+    if not order or not order["company_inn"]:
+        await run_in_threadpool(complete_render_job, job["order_id"], job["queued_at"])
+        return "skipped"
+    
+    content_hash = invoice_hash(order)
+    # Клиент мог успеть скачать счёт раньше — тогда он уже в кэше
+    if await run_in_threadpool(get_cached_pdf, order["id"], content_hash) is None:
+        pdf = await render_invoice(order, check_queue=False)
+        await run_in_threadpool(save_cached_pdf, order["id"], content_hash, pdf)
+    
+    await run_in_threadpool(complete_render_job, order["id"], job["queued_at"])
+    return "ok"
+
+
+async def _process(job: dict):
+    try:
+        result = await process_job(job)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.exception("Render job for order %s failed (attempt %s)", job["order_id"], job["attempts"])
+        retry_in = None
+        if job["attempts"] < RENDER_MAX_ATTEMPTS:
+            retry_in = retry_delay(job["attempts"])
+        await run_in_threadpool(fail_render_job, job["order_id"], job["queued_at"], repr(e), retry_in)
+        RENDER_JOBS.inc(result="retry" if retry_in is not None else "failed")
+        return
+    
+    RENDER_JOBS.inc(result=result)
+    logger.info("Rendered PDF for order %s", job["order_id"])
+
+
+async def process_pending() -> int:
+    """Обработка одной пачки задач, возвращает их число"""
+    jobs = await run_in_threadpool(claim_render_jobs, RENDER_BATCH_SIZE, RENDER_LEASE_SECONDS)
+    await asyncio.gather(*(_process(job) for job in jobs))
+    return len(jobs)
+
+
+_worker = QueueWorker("Render worker", process_pending, RENDER_POLL_INTERVAL)
+
+
+def notify_render_worker():
+    """Разбудить обработчик: поставлена новая задача"""
+    _worker.notify()
+
+
+def start_render_worker():
+    """Запуск обработчика в текущем event loop (вызывается в startup)"""
+    _worker.start()
+
+
+async def stop_render_worker(timeout: float = SHUTDOWN_TIMEOUT):
+    """Остановка обработчика (вызывается в shutdown), см. QueueWorker.stop"""
+    await _worker.stop(timeout)
@@ -0,0 +1,73 @@
+import os
+import sys
+
+# Модули приложения лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class FakeDaData:
+    """Заглушка DaData на локальном порту
+    
+    respond(inn) возвращает (статус, заголовки, тело); по умолчанию —
+    компания «ООО Тест» для любого ИНН. requests — полученные ИНН.
+    """
+    
+    def __init__(self):
+        self.requests = []
+        self.respond = self.found
+        fake = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                inn = json.loads(body)["query"]
+                fake.requests.append(inn)
+                status, headers, data = fake.respond(inn)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/findById/party"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+    
+    @staticmethod
+    def found(inn: str) -> tuple:
+        suggestion = {
+            "value": "ООО Тест",
+            "data": {"inn": inn, "kpp": "770101001", "ogrn": "1027700000000",
+                     "address": {"value": "г. Москва"}},
+        }
+        return 200, {}, json.dumps({"suggestions": [suggestion]}).encode()
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def dadata(monkeypatch):
+    """Заглушка DaData; кэши dadata_client пусты, БД для кэша не нужна"""
+    import dadata_client
+    
+    fake = FakeDaData()
+    monkeypatch.setattr(dadata_client, "DADATA_URL", fake.url)
+    monkeypatch.setattr(dadata_client, "DADATA_API_KEY", "test")
+    monkeypatch.setattr(dadata_client, "get_cached_company", lambda inn: None)
+    monkeypatch.setattr(dadata_client, "save_cached_company", lambda inn, company: None)
+    dadata_client._cache.clear()
+    yield fake
+    fake.close()
+    dadata_client._cache.clear()
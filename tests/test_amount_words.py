@@ -0,0 +1,125 @@
+"""Сумма прописью: формы слов, копейки и валюты"""
+from decimal import Decimal
+
+import pytest
+from num2words import num2words
+
+from amount_words import (
+    CURRENCIES, amount_in_words, currency_sign, normalize_currency, plural
+)
+
+RUB = CURRENCIES["RUB"]
+
+# Окончания 0..99, выписанные явно: 1 рубль, 2–4 рубля, остальные — рублей
+ONE = {1, 21, 31, 41, 51, 61, 71, 81, 91}
+FEW = {
+    2, 3, 4, 22, 23, 24, 32, 33, 34, 42, 43, 44, 52, 53, 54,
+    62, 63, 64, 72, 73, 74, 82, 83, 84, 92, 93, 94,
+}
+
+
+def expected_form(number: int, forms: tuple) -> str:
+    ending = number % 100
+    if ending in ONE:
+        return forms[0]
+    if ending in FEW:
+        return forms[1]
+    return forms[2]
+
+
+def sample_numbers():
+    """Все числа до 10 000, шаг по 0..10^7 и границы разрядов"""
+    numbers = set(range(10001))
+    numbers.update(range(0, 10 ** 7 + 1, 9973))
+    for power in range(1, 8):
+        base = 10 ** power
+        for delta in (-2, -1, 0, 1, 2, 11, 21, 101):
+            numbers.add(base + delta)
+            numbers.add(base * 2 + delta)
+            numbers.add(base * 5 + delta)
+    return sorted(n for n in numbers if 0 <= n <= 10 ** 7)
+
+
+def test_plural_small_numbers():
+    assert [plural(n, RUB["units"]) for n in (0, 1, 2, 4, 5, 11, 12, 14, 21, 22, 25, 111, 121)] == [
+        "рублей", "рубль", "рубля", "рубля", "рублей", "рублей", "рублей", "рублей",
+        "рубль", "рубля", "рублей", "рублей", "рубль",
+    ]
+
+
+def test_plural_all_numbers_to_ten_million():
+    forms = RUB["units"]
+    table = {n: expected_form(n, forms) for n in range(100)}
+    for number in range(10 ** 7 + 1):
+        assert plural(number, forms) == table[number % 100], number
+
+
+@pytest.mark.parametrize("currency", sorted(CURRENCIES))
+def test_integer_amounts(currency):
+    names = CURRENCIES[currency]
+    for number in sample_numbers():
+        words = num2words(number, lang="ru")
+        expected = (
+            f"{words[:1].upper()}{words[1:]} {expected_form(number, names['units'])} "
+            f"00 {names['cents'][2]}"
+        )
+        assert amount_in_words(number, currency) == expected
+
+
+def test_thousands_and_millions_agree_with_number():
+    for number in sample_numbers():
+        words = amount_in_words(number).lower().split()
+        thousands = number // 1000 % 1000
+        millions = number // 10 ** 6 % 1000
+        if thousands:
+            assert expected_form(thousands, ("тысяча", "тысячи", "тысяч")) in words, number
+        if millions:
+            assert expected_form(millions, ("миллион", "миллиона", "миллионов")) in words, number
+
+
+@pytest.mark.parametrize("cents", range(100))
+def test_cents_are_exact(cents):
+    form = expected_form(cents, RUB["cents"])
+    expected = f"{cents:02d} {form}"
+    # float, строка и Decimal дают одинаковые копейки (0.29 — 29, а не 28)
+    assert amount_in_words(Decimal(f"1234.{cents:02d}")).endswith(expected)
+    assert amount_in_words(f"0.{cents:02d}").endswith(expected)
+    assert amount_in_words(0 + cents / 100).endswith(expected)
+    assert amount_in_words(1234 + cents / 100).endswith(expected)
+
+
+@pytest.mark.parametrize("amount, text", [
+    (Decimal("0.004"), "Ноль рублей 00 копеек"),
+    (Decimal("0.005"), "Ноль рублей 01 копейка"),
+    (Decimal("0.994"), "Ноль рублей 99 копеек"),
+    (Decimal("0.995"), "Один рубль 00 копеек"),
+    (Decimal("-1500.29"), "Одна тысяча пятьсот рублей 29 копеек"),
+    (Decimal("10000000"), "Десять миллионов рублей 00 копеек"),
+])
+def test_rounding_and_sign(amount, text):
+    assert amount_in_words(amount) == text
+
+
+@pytest.mark.parametrize("amount, currency, text", [
+    (1, "USD", "Один доллар США 00 центов"),
+    (Decimal("2.01"), "USD", "Два доллара США 01 цент"),
+    (Decimal("5.22"), "EUR", "Пять евро 22 цента"),
+    (Decimal("21.01"), "KZT", "Двадцать один тенге 01 тиын"),
+    (Decimal("1000.11"), "KZT", "Одна тысяча тенге 11 тиынов"),
+])
+def test_other_currencies(amount, currency, text):
+    assert amount_in_words(amount, currency) == text
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("RUB", "RUB"), ("rur", "RUB"), ("₽", "RUB"), (None, "RUB"), ("", "RUB"),
+    (" usd ", "USD"), ("EUR", "EUR"), ("kzt", "KZT"), ("XYZ", "RUB"),
+])
+def test_normalize_currency(code, expected):
+    assert normalize_currency(code) == expected
+
+
+def test_currency_sign():
+    assert [currency_sign(code) for code in ("RUB", "USD", "EUR", "KZT", None)] == [
+        "₽", "$", "€", "₸", "₽",
+    ]
@@ -0,0 +1,70 @@
+"""Клиент DaData против заглушки: разбор ответа, ошибки и проверка ИНН"""
+import asyncio
+
+import pytest
+
+import dadata_client
+from dadata_client import DaDataError, DaDataRateLimited, fetch_company, get_company_by_inn
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await dadata_client.close_client()
+    return asyncio.run(main())
+
+
+def test_found(dadata):
+    company = run(get_company_by_inn(" 7707083893 "))
+    assert company["name"] == "ООО Тест"
+    assert company["address"] == "г. Москва"
+    assert dadata.requests == ["7707083893"]
+
+
+def test_second_lookup_is_cached(dadata):
+    run(get_company_by_inn("7707083893"))
+    run(get_company_by_inn("7707083893"))
+    assert dadata.requests == ["7707083893"]
+
+
+def test_not_found(dadata):
+    dadata.respond = lambda inn: (200, {}, b'{"suggestions": []}')
+    assert run(fetch_company("7707083893")) is None
+
+
+@pytest.mark.parametrize("inn", ["", "123", "77070838931", "770708389x", "7707083893 1"])
+def test_invalid_inn_is_not_requested(dadata, inn):
+    assert run(get_company_by_inn(inn)) is None
+    assert dadata.requests == []
+    assert inn.strip() not in dadata_client._cache
+
+
+@pytest.mark.parametrize("body", [b"<html>Bad gateway</html>", b"", b"[1, 2]"])
+def test_bad_body_raises_dadata_error(dadata, body):
+    dadata.respond = lambda inn: (200, {"Content-Type": "text/html"}, body)
+    with pytest.raises(DaDataError):
+        run(fetch_company("7707083893"))
+
+
+def test_bad_body_is_not_cached(dadata):
+    dadata.respond = lambda inn: (200, {}, b"not json")
+    assert run(get_company_by_inn("7707083893")) is None
+    assert "7707083893" not in dadata_client._cache
+    
+    dadata.respond = dadata.found
+    assert run(get_company_by_inn("7707083893"))["name"] == "ООО Тест"
+
+
+def test_server_error(dadata):
+    dadata.respond = lambda inn: (502, {}, b"")
+    with pytest.raises(DaDataError):
+        run(fetch_company("7707083893"))
+
+
+def test_rate_limited(dadata):
+    dadata.respond = lambda inn: (429, {"Retry-After": "2"}, b"")
+    with pytest.raises(DaDataRateLimited) as e:
+        run(fetch_company("7707083893"))
+    assert e.value.retry_after == 2.0
@@ -0,0 +1,74 @@
+"""Пакетные запросы enrich.py к заглушке DaData, которая отвечает 429"""
+import asyncio
+import threading
+import time
+
+import dadata_client
+from enrich import MAX_RETRIES, lookup_many
+
+INNS = [f"77070838{n:02d}" for n in range(10)]
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await dadata_client.close_client()
+    return asyncio.run(main())
+
+
+class RateLimitedDaData:
+    """Первые limited запросов — 429 с Retry-After, дальше — компания"""
+    
+    def __init__(self, dadata, limited: int, retry_after: float):
+        self.dadata = dadata
+        self.limited = limited
+        self.retry_after = retry_after
+        self.times = []
+        self._lock = threading.Lock()
+        dadata.respond = self
+    
+    def __call__(self, inn: str) -> tuple:
+        with self._lock:
+            self.times.append(time.monotonic())
+            if len(self.times) <= self.limited:
+                return 429, {"Retry-After": str(self.retry_after)}, b""
+        return self.dadata.found(inn)
+
+
+def test_all_found_after_rate_limit(dadata):
+    RateLimitedDaData(dadata, limited=3, retry_after=0.3)
+    
+    results = run(lookup_many(INNS, concurrency=5, rate=1000))
+    
+    assert sorted(results) == INNS
+    assert all(company["inn"] == inn for inn, company in results.items())
+    assert len(dadata.requests) == len(INNS) + 3
+
+
+def test_requests_pause_after_429(dadata):
+    server = RateLimitedDaData(dadata, limited=1, retry_after=0.3)
+    
+    run(lookup_many(INNS, concurrency=1, rate=1000))
+    
+    # После 429 следующий запрос уходит не раньше Retry-After
+    assert server.times[1] - server.times[0] >= 0.25
+
+
+def test_rate_is_respected(dadata):
+    server = RateLimitedDaData(dadata, limited=0, retry_after=0)
+    
+    run(lookup_many(INNS, concurrency=5, rate=50))
+    
+    elapsed = server.times[-1] - server.times[0]
+    assert elapsed >= (len(INNS) - 1) / 50 * 0.7
+
+
+def test_gives_up_when_always_limited(dadata):
+    RateLimitedDaData(dadata, limited=10 ** 6, retry_after=0.01)
+    
+    results = run(lookup_many(INNS[:2], concurrency=2, rate=1000))
+    
+    assert results == {}
+    assert len(dadata.requests) == 2 * MAX_RETRIES
@@ -0,0 +1,26 @@
+"""Значения CSV-выгрузки: даты, суммы и защита от формул"""
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from export_orders import _csv_value
+
+
+@pytest.mark.parametrize("text", [
+    "=HYPERLINK(\"http://evil\")", "+79990000000", "-2+3", "@SUM(A1:A2)", "\t=1", "\r=1",
+])
+def test_formula_is_escaped(text):
+    assert _csv_value(text) == "'" + text
+
+
+@pytest.mark.parametrize("text", ["ООО «Ромашка»", "a=b", "", "7707083893"])
+def test_plain_text_is_kept(text):
+    assert _csv_value(text) == text
+
+
+def test_numbers_and_dates():
+    assert _csv_value(Decimal("-1500.5")) == "-1500,50"
+    assert _csv_value(3) == 3
+    assert _csv_value(None) == ""
+    assert _csv_value(datetime(2026, 10, 18, 12, 30)) == "18.10.2026"
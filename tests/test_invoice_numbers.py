@@ -0,0 +1,97 @@
+"""Нумерация счетов при параллельном создании заказов: без дублей и пропусков
+
+Нужна рабочая БД со схемой (DATABASE_URL, python migrate.py --schema-only),
+без неё тесты пропускаются. Заказы пишутся с отдельным префиксом и
+удаляются после теста, настоящие счётчики не затрагиваются.
+"""
+import os
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
+
+from config import INVOICE_START_NUMBER
+from database import (
+    check_schema, close_pool, create_order, get_connection, get_next_invoice_number
+)
+
+pytestmark = pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="DATABASE_URL is not set")
+
+THREADS = 20
+ORDERS = 400
+# Каждая ROLLBACK_EVERY-я транзакция берёт номер и откатывается
+ROLLBACK_EVERY = 10
+
+PRODUCTS = [{
+    "name": "Проверка нумерации", "quantity": 1,
+    "price": Decimal("100.00"), "amount": Decimal("100.00"), "sku": "", "period": "",
+}]
+
+
+class _Rollback(Exception):
+    """Намеренный откат транзакции после получения номера"""
+
+
+@pytest.fixture
+def prefix():
+    try:
+        missing = check_schema()
+    except Exception as e:
+        pytest.skip(f"database is not available: {e}")
+    if missing:
+        pytest.skip(f"schema is not migrated, missing tables: {', '.join(missing)}")
+    
+    prefix = f"T{uuid.uuid4().hex[:6].upper()}"
+    yield prefix
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM orders WHERE invoice_number LIKE %s", (f"{prefix}-%",))
+        cursor.execute("DELETE FROM invoice_counters WHERE prefix = %s", (prefix,))
+    close_pool()
+
+
+def _create(prefix: str, n: int):
+    if n % ROLLBACK_EVERY == 0:
+        try:
+            with get_connection() as conn:
+                get_next_invoice_number(conn.cursor(), prefix, INVOICE_START_NUMBER)
+                raise _Rollback()
+        except _Rollback:
+            return None
+    return create_order(
+        products=PRODUCTS, total_amount=Decimal("100.00"),
+        customer_name=f"Нагрузка {n}", customer_email="", customer_phone="",
+        invoice_prefix=prefix, start_number=INVOICE_START_NUMBER,
+    )
+
+
+def _numbers_by_day(prefix: str) -> dict:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT invoice_number FROM orders WHERE invoice_number LIKE %s",
+            (f"{prefix}-%",)
+        )
+        rows = cursor.fetchall()
+    
+    by_day = defaultdict(list)
+    for row in rows:
+        _, day, number = row["invoice_number"].rsplit("-", 2)
+        by_day[day].append(int(number))
+    return by_day
+
+
+def test_concurrent_orders_get_unique_gapless_numbers(prefix):
+    with ThreadPoolExecutor(THREADS) as executor:
+        results = list(executor.map(lambda n: _create(prefix, n), range(1, ORDERS + 1)))
+    created = [order_id for order_id in results if order_id is not None]
+    assert len(created) == ORDERS - ORDERS // ROLLBACK_EVERY
+    assert len(set(created)) == len(created)
+    
+    by_day = _numbers_by_day(prefix)
+    assert sum(len(numbers) for numbers in by_day.values()) == len(created)
+    # Заказы около полуночи могут попасть в два дня, в каждом — своя нумерация
+    for day, numbers in by_day.items():
+        assert sorted(numbers) == list(range(INVOICE_START_NUMBER, INVOICE_START_NUMBER + len(numbers))), day
@@ -0,0 +1,54 @@
+import json
+import os
+
+from metrics import Counter, Histogram, CallbackGauge, _render_merged, mark_process_dead
+
+REQUESTS = Counter("test_requests_total", "Запросы", ("route",))
+LATENCY = Histogram("test_latency_seconds", "Задержка", buckets=(0.1, 1.0))
+CLIENTS = CallbackGauge("test_clients", "Клиенты", lambda: 3)
+
+
+def _other_worker(directory, pid, requests):
+    """Снимок другого воркера, как его записал бы write_snapshot"""
+    snapshot = {
+        "test_requests_total": {"type": "counter", "values": [[["/"], requests]]},
+        "test_latency_seconds": {"type": "histogram", "values": [[[], [1, 2, 5.0, 3]]]},
+        "test_clients": {"type": "gauge", "values": [[[], 7]]},
+    }
+    with open(os.path.join(directory, f"{pid}.json"), "w") as f:
+        json.dump(snapshot, f)
+
+
+def _lines(directory):
+    return [line for line in _render_merged(str(directory)) if line.startswith("test_")]
+
+
+def test_counters_and_histograms_are_summed_across_workers(tmp_path):
+    REQUESTS.inc(2, route="/")
+    LATENCY.observe(0.05)
+    _other_worker(tmp_path, 1, 5)
+    
+    lines = _lines(tmp_path)
+    assert 'test_requests_total{route="/"} 7' in lines
+    assert 'test_latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'test_latency_seconds_bucket{le="1.0"} 3' in lines
+    assert 'test_latency_seconds_count 4' in lines
+    assert f'test_clients{{worker="{os.getpid()}"}} 3' in lines
+    assert 'test_clients{worker="1"} 7' in lines
+
+
+def test_dead_worker_keeps_counters_and_drops_gauges(tmp_path):
+    _other_worker(tmp_path, 1, 5)
+    _other_worker(tmp_path, 2, 10)
+    mark_process_dead(1, str(tmp_path))
+    mark_process_dead(2, str(tmp_path))
+    _other_worker(tmp_path, 3, 1)
+    
+    lines = _lines(tmp_path)
+    own = REQUESTS.collect().get(("/",), 0)
+    assert f'test_requests_total{{route="/"}} {own + 16}' in lines
+    own_latency = LATENCY.collect().get((), [0, 0, 0.0, 0])
+    assert f'test_latency_seconds_count {own_latency[-1] + 9}' in lines
+    assert 'test_clients{worker="3"} 7' in lines
+    assert not any('worker="1"' in line or 'worker="2"' in line for line in lines)
+    assert not os.path.exists(tmp_path / "1.json")
@@ -0,0 +1,27 @@
+"""Живые обновления админки: ограничение числа потоков SSE"""
+import asyncio
+
+import pytest
+
+import order_events
+from order_events import TooManyClients, subscribe, stream_events
+
+
+def test_max_clients_counts_streams_not_started_yet(monkeypatch):
+    async def main():
+        monkeypatch.setattr(order_events, "SSE_MAX_CLIENTS", 2)
+        first, second = subscribe(), subscribe()
+        with pytest.raises(TooManyClients):
+            subscribe()
+        
+        # Закончившийся поток освобождает место
+        stream = stream_events(first)
+        assert (await stream.__anext__()).startswith("retry:")
+        await stream.aclose()
+        third = subscribe()
+        
+        # Поток, который так и не начался, освобождает место вместе с клиентом
+        del second, third
+        subscribe()
+    
+    asyncio.run(main())
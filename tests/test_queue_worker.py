@@ -0,0 +1,68 @@
+"""Общий цикл обработчиков очередей: пачки подряд, пробуждение и остановка"""
+import asyncio
+
+from queue_worker import QueueWorker, retry_delay
+
+
+def test_retry_delay():
+    assert [retry_delay(n) for n in (1, 2, 3)] == [10, 20, 40]
+    assert retry_delay(20) == 3600
+
+
+def test_batches_until_empty_then_wakes_on_notify():
+    async def main():
+        queue = [3, 2]
+        calls = []
+        
+        async def process_pending():
+            calls.append(len(queue))
+            return queue.pop(0) if queue else 0
+        
+        worker = QueueWorker("Test worker", process_pending, poll_interval=60)
+        worker.start()
+        await asyncio.sleep(0.05)
+        assert calls == [2, 1, 0]
+        
+        queue.append(1)
+        worker.notify()
+        await asyncio.sleep(0.05)
+        assert calls == [2, 1, 0, 1, 0]
+        
+        await asyncio.wait_for(worker.stop(), 1)
+    
+    asyncio.run(main())
+
+
+def test_errors_do_not_stop_the_loop():
+    async def main():
+        calls = []
+        
+        async def process_pending():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("db is down")
+            return 0
+        
+        worker = QueueWorker("Test worker", process_pending, poll_interval=60)
+        worker.start()
+        await asyncio.sleep(0.01)
+        worker.notify()
+        await asyncio.sleep(0.01)
+        await worker.stop()
+        assert len(calls) == 2
+    
+    asyncio.run(main())
+
+
+def test_stop_cancels_a_stuck_batch():
+    async def main():
+        async def process_pending():
+            await asyncio.sleep(60)
+        
+        worker = QueueWorker("Test worker", process_pending, poll_interval=60)
+        worker.start()
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(worker.stop(timeout=0.05), 1)
+        assert worker._task is None
+    
+    asyncio.run(main())
@@ -0,0 +1,32 @@
+"""Разбор заказа Тильды: суммы и количества из произвольных строк"""
+from decimal import Decimal
+
+import pytest
+
+from tilda import parse_tilda_order, to_money
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1 500,50", Decimal("1500.50")),
+    ("99.999", Decimal("100.00")),
+    ("", Decimal("0")),
+    ("abc", Decimal("0")),
+    ("NaN", Decimal("0")),
+    ("sNaN", Decimal("0")),
+    ("inf", Decimal("0")),
+    ("-Infinity", Decimal("0")),
+])
+def test_to_money(value, expected):
+    assert to_money(value) == expected
+
+
+def test_non_finite_values_in_order():
+    order = parse_tilda_order({"payment": {
+        "amount": "NaN",
+        "products": [{"name": "Товар", "quantity": "inf", "price": "100", "amount": "Infinity"}],
+    }})
+    product = order["products"][0]
+    assert (product["quantity"], product["price"], product["amount"]) == (
+        1, Decimal("100.00"), Decimal("100.00")
+    )
+    assert order["total_amount"] == Decimal("100.00")
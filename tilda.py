@@ -0,0 +1,210 @@
+"""Разбор заказов, приходящих вебхуком от Тильды
+
+    python tilda.py --bench                 # корзины из 1, 10, 100 и 1000 товаров
+    python tilda.py --bench 5 500 --repeat 200
+"""
+import argparse
+import json
+import re
+import time
+from decimal import Decimal, InvalidOperation
+
+from amount_words import normalize_currency
+
+# payment[products][0][options][1][variant] -> "payment", "[products][0][options][1][variant]"
+_KEY_RE = re.compile(r"^([^\[\]]+)((?:\[[^\[\]]*\])+)$")
+_PART_RE = re.compile(r"\[([^\[\]]*)\]")
+
+CENT = Decimal("0.01")
+
+
+def unflatten_form(data: dict) -> dict:
+    """Превращает ключи form-data вида a[b][0][c] во вложенные словари
+    
+    Один проход по ключам; индексы списков остаются ключами-строками,
+    поэтому пропуски в нумерации ничего не ломают.
+    """
+    result = {}
+    for key, value in data.items():
+        match = _KEY_RE.match(key)
+        if not match:
+            result.setdefault(key, value)
+            continue
+        
+        node = result.setdefault(match.group(1), {})
+        parts = _PART_RE.findall(match.group(2))
+        for part in parts[:-1]:
+            if not isinstance(node, dict):
+                break
+            node = node.setdefault(part, {})
+        if isinstance(node, dict):
+            node[parts[-1]] = value
+    
+    return result
+
+
+def _as_list(value) -> list:
+    """Список из JSON-массива или словаря {"0": ..., "3": ...} по возрастанию индекса"""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        indexes = sorted((key for key in value if str(key).isdigit()), key=int)
+        return [value[key] for key in indexes]
+    return []
+
+
+def to_money(value, default: Decimal = Decimal("0")) -> Decimal:
+    """Сумма в Decimal с точностью до копейки ("1 500,50" -> 1500.50)"""
+    if value is None or value == "":
+        return default
+    try:
+        text = str(value).replace(" ", "").replace("\u00a0", "").replace(",", ".")
+        amount = Decimal(text)
+        # "NaN" и "Infinity" Decimal разбирает, но суммой они не являются
+        if not amount.is_finite():
+            return default
+        return amount.quantize(CENT)
+    except InvalidOperation:
+        return default
+
+
+def _to_quantity(value) -> int:
+    try:
+        return max(int(Decimal(str(value))), 1)
+    except (InvalidOperation, ValueError, OverflowError):
+        # OverflowError — "inf", ValueError — "nan"
+        return 1
+
+
+def _parse_options(value) -> list:
+    options = []
+    for option in _as_list(value):
+        if isinstance(option, dict):
+            options.append({
+                "option": option.get("option", ""),
+                "variant": option.get("variant", ""),
+                "price": to_money(option.get("price")),
+            })
+    return options
+
+
+def _parse_product(item) -> dict:
+    # В простом режиме Тильда присылает товар строкой
+    if not isinstance(item, dict):
+        return {
+            "name": str(item), "quantity": 1,
+            "price": Decimal("0"), "amount": Decimal("0"),
+            "sku": "", "period": "",
+        }
+    
+    quantity = _to_quantity(item.get("quantity", 1))
+    price = to_money(item.get("price"))
+    amount = to_money(item.get("amount"), default=price * quantity)
+    
+    product = {
+        "name": item.get("name", ""),
+        "quantity": quantity,
+        "price": price,
+        "amount": amount,
+        "sku": item.get("sku", ""),
+        "period": "",  # Можно извлечь из названия если нужно
+    }
+    options = _parse_options(item.get("options"))
+    if options:
+        product["options"] = options
+    return product
+
+
+def parse_tilda_order(data: dict) -> dict:
+    """Парсит данные заказа от Тильды (form-data или JSON)"""
+    
+    if any(key.startswith("payment[") for key in data):
+        data = unflatten_form(data)
+    
+    payment = data.get("payment") or {}
+    if isinstance(payment, str):
+        # Тильда может передать payment одной JSON-строкой
+        try:
+            payment = json.loads(payment)
+        except ValueError:
+            payment = {}
+    
+    products = [_parse_product(item) for item in _as_list(payment.get("products"))]
+    
+    # Общая сумма
+    total_amount = to_money(payment.get("amount"))
+    
+    # Если товары не найдены, создаём один товар из общей суммы
+    if not products and total_amount > 0:
+        products = [{
+            "name": "Заказ",
+            "quantity": 1,
+            "price": total_amount,
+            "amount": total_amount,
+            "sku": "",
+            "period": "",
+        }]
+    
+    if total_amount == 0:
+        total_amount = sum((p["amount"] for p in products), Decimal("0"))
+    
+    return {
+        "tilda_order_id": str(payment.get("orderid", "") or ""),
+        "customer_name": data.get("Name", ""),
+        "customer_email": data.get("Email", ""),
+        "customer_phone": data.get("Phone", ""),
+        "products": products,
+        "total_amount": total_amount,
+        "promocode": str(payment.get("promocode") or ""),
+        "discount": to_money(payment.get("discount")),
+        "currency": normalize_currency(payment.get("currency") or data.get("currency")),
+    }
+
+
+def sample_form(items: int) -> dict:
+    """Form-data вебхука Тильды с корзиной из items товаров (для замера)"""
+    data = {
+        "Name": "Иван Петров", "Email": "ivan@example.com", "Phone": "+79990000000",
+        "payment[orderid]": "1234567890", "payment[amount]": f"{items * 1500}",
+        "payment[promocode]": "SALE", "payment[discount]": "100",
+    }
+    for i in range(items):
+        prefix = f"payment[products][{i}]"
+        data.update({
+            f"{prefix}[name]": f"Размещение статьи {i}",
+            f"{prefix}[quantity]": "1",
+            f"{prefix}[price]": "1 500,00",
+            f"{prefix}[amount]": "1500",
+            f"{prefix}[sku]": f"ART-{i}",
+            f"{prefix}[options][0][option]": "Срок",
+            f"{prefix}[options][0][variant]": "1 месяц",
+            f"{prefix}[options][0][price]": "0",
+        })
+    return data
+
+
+def bench(sizes: list, repeat: int):
+    """Время parse_tilda_order на корзинах разного размера"""
+    for items in sizes:
+        data = sample_form(items)
+        assert len(parse_tilda_order(data)["products"]) == items
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parse_tilda_order(data)
+        elapsed = (time.perf_counter() - start) / repeat
+        print(
+            f"{items:>5} items: {elapsed * 1e3:.3f} ms per webhook, "
+            f"{elapsed / items * 1e6:.2f} us per item"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Разбор вебхуков Тильды")
+    parser.add_argument("--bench", nargs="*", type=int, metavar="ITEMS",
+                        help="Замер разбора корзин из ITEMS товаров (по умолчанию 1 10 100 1000)")
+    parser.add_argument("--repeat", type=int, default=100, help="Повторов на каждый размер")
+    args = parser.parse_args()
+    
+    if args.bench is None:
+        parser.error("nothing to do: use --bench")
+    bench(args.bench or [1, 10, 100, 1000], args.repeat)
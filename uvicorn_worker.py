@@ -0,0 +1,34 @@
+"""Воркер gunicorn (gunicorn.conf.py), который закрывает потоки SSE при остановке
+
+uvicorn при остановке (SIGTERM) сначала ждёт закрытия всех соединений и
+только потом вызывает shutdown приложения. Потоки /admin/events сами не
+заканчиваются, поэтому сервер закрывает их в самом начале своей остановки
+(order_events.close_streams), иначе воркер ждал бы их до graceful_timeout.
+"""
+import sys
+
+import uvicorn
+from gunicorn.arbiter import Arbiter
+from uvicorn.workers import UvicornWorker as _UvicornWorker
+
+
+class Server(uvicorn.Server):
+    async def shutdown(self, sockets=None):
+        # Импорт здесь: модуль загружает и мастер gunicorn, которому
+        # приложение и его настройки не нужны
+        from order_events import close_streams
+        
+        close_streams()
+        await super().shutdown(sockets)
+
+
+class UvicornWorker(_UvicornWorker):
+    """UvicornWorker с Server из этого модуля"""
+    
+    async def _serve(self):
+        self.config.app = self.wsgi
+        server = Server(config=self.config)
+        self._install_sigquit_handler()
+        await server.serve(sockets=self.sockets)
+        if not server.started:
+            sys.exit(Arbiter.WORKER_BOOT_ERROR)
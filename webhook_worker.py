@@ -0,0 +1,84 @@
+"""Фоновая обработка вебхуков Тильды из таблицы webhook_inbox"""
+import logging
+
+from starlette.concurrency import run_in_threadpool
+
+from config import INVOICE_PREFIX, INVOICE_START_NUMBER, SHUTDOWN_TIMEOUT
+from database import claim_webhooks, complete_webhook, fail_webhook, create_order
+from metrics import Counter
+from queue_worker import QueueWorker, retry_delay
+from tilda import parse_tilda_order
+
+logger = logging.getLogger(__name__)
+
+WEBHOOKS_PROCESSED = Counter(
+    "webhooks_processed_total", "Обработанные вебхуки Тильды", ("result",)
+)
+
+WEBHOOK_BATCH_SIZE = 20
+WEBHOOK_POLL_INTERVAL = 5       # секунд между проверками, если никто не разбудил
+WEBHOOK_LEASE_SECONDS = 300     # через сколько зависшая запись снова доступна
+WEBHOOK_MAX_ATTEMPTS = 8
+
+def process_webhook(webhook: dict) -> int:
+    """Создание заказа из сохранённого вебхука"""
+    order_data = parse_tilda_order(webhook["payload"])
+    
+    return create_order(
+        products=order_data["products"],
+        total_amount=order_data["total_amount"],
+        customer_name=order_data["customer_name"],
+        customer_email=order_data["customer_email"],
+        customer_phone=order_data["customer_phone"],
+        invoice_prefix=INVOICE_PREFIX,
+        start_number=INVOICE_START_NUMBER,
+        tilda_order_id=order_data["tilda_order_id"],
+        currency=order_data["currency"],
+        promocode=order_data["promocode"],
+        discount=order_data["discount"],
+    )
+
+
+def process_pending() -> int:
+    """Обработка одной пачки вебхуков, возвращает их число"""
+    webhooks = claim_webhooks(WEBHOOK_BATCH_SIZE, WEBHOOK_LEASE_SECONDS)
+    
+    for webhook in webhooks:
+        try:
+            order_id = process_webhook(webhook)
+        except Exception as e:
+            logger.exception("Webhook %s failed (attempt %s)", webhook["id"], webhook["attempts"])
+            retry_in = None
+            if webhook["attempts"] < WEBHOOK_MAX_ATTEMPTS:
+                retry_in = retry_delay(webhook["attempts"])
+            fail_webhook(webhook["id"], repr(e), retry_in)
+            WEBHOOKS_PROCESSED.inc(result="retry" if retry_in is not None else "failed")
+            continue
+        
+        complete_webhook(webhook["id"], order_id)
+        WEBHOOKS_PROCESSED.inc(result="ok")
+        logger.info("Webhook %s -> order %s", webhook["id"], order_id)
+    
+    return len(webhooks)
+
+
+async def _process_pending() -> int:
+    return await run_in_threadpool(process_pending)
+
+
+_worker = QueueWorker("Webhook worker", _process_pending, WEBHOOK_POLL_INTERVAL)
+
+
+def notify_webhook_worker():
+    """Разбудить обработчик: пришёл новый вебхук"""
+    _worker.notify()
+
+
+def start_webhook_worker():
+    """Запуск обработчика в текущем event loop (вызывается в startup)"""
+    _worker.start()
+
+
+async def stop_webhook_worker(timeout: float = SHUTDOWN_TIMEOUT):
+    """Остановка обработчика (вызывается в shutdown), см. QueueWorker.stop"""
+    await _worker.stop(timeout)